@@ -0,0 +1,36 @@
+# Microbenchmark de GlobalConfig.get: recorrido de la ruta (antes) vs tabla precalculada (ahora)
+# uso: python scripts/bench_config.py [config.yml]
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tagworker.config import Config, GlobalConfig
+
+PATHS = [
+    'app.fullsync_interval',
+    'app.HR.tag',
+    'app.noHL.categories',
+    'app.dupes.enabled',
+    'app.lowseeds.min_seeds',
+    'app.orphan_maxfiles',  # no existe: devuelve default
+]
+NUMBER = 200_000
+
+
+def main():
+    if len(sys.argv) > 1:
+        GlobalConfig.set(Config(sys.argv[1]))
+    else:
+        GlobalConfig.set(Config(config_dict=GlobalConfig.DEFAULTS, is_root=False))
+
+    print(f"{'path':<25} {'walk (ns)':>10} {'table (ns)':>11} {'speedup':>8}")
+    for path in PATHS:
+        walk = timeit.timeit(lambda: GlobalConfig._resolve(path), number=NUMBER) / NUMBER * 1e9
+        table = timeit.timeit(lambda: GlobalConfig.get(path), number=NUMBER) / NUMBER * 1e9
+        print(f"{path:<25} {walk:>10.0f} {table:>11.0f} {walk / table:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
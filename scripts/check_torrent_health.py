@@ -1,9 +1,14 @@
 import json
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 import utils
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tagworker.btbackup import BTBackup
+
 script_dir = os.path.dirname(os.path.abspath(__file__))
 dotenv_path = os.path.join(script_dir, '.env')
 load_dotenv(dotenv_path, override=True)
@@ -11,6 +16,7 @@ load_dotenv(dotenv_path, override=True)
 # CONFIG
 ROOTDIR = Path(os.getenv('TORRENTS_PATH', "")).resolve() # ruta al torrentdir real en el disco, completa
 QBIT_ROOT = Path(os.getenv('TRANSLATED_TORRENTS_PATH', "")).resolve() # ruta al torrentdir tal cual la ve qbit
+BT_BACKUP = os.getenv('BT_BACKUP_PATH', "") # BT_backup de qbit en este disco: ficheros sin una peticion por torrent
 ERRORED_TAG = "☢️"
 AUTOPAUSE_MISSING = True
 AUTOPAUSE_SIZE_MISSMATCH = False
@@ -30,15 +36,25 @@ def translate_path(qbit_path: str) -> Path:
         return qbit.resolve()
 
 
-def check_torrent_status(torrent):
+def torrent_files(torrent, bt_backup):
+    # (nombre, prioridad, progreso) de cada fichero
+    if bt_backup is not None:
+        local = bt_backup.torrent(torrent.hash)
+        if local is not None:
+            # solo se miran torrents completos: todo lo que se descarga esta entero
+            return [(name, priority, 1.0) for name, priority in zip(local.names, local.priorities)]
+    return [(file.name, file.priority, file.progress) for file in torrent.files]
+
+
+def check_torrent_status(torrent, bt_backup=None):
     if torrent.progress != 1: # ignore incomplete torrents
         return NOERROR
 
-    for file in torrent.files:
-        if file.priority == 0: # skip file download
+    for name, priority, progress in torrent_files(torrent, bt_backup):
+        if priority == 0: # skip file download
             continue
 
-        qbit_file_path = os.path.join(torrent.save_path, file.name)
+        qbit_file_path = os.path.join(torrent.save_path, name)
         real_file_path = translate_path(qbit_file_path)
 
         if not real_file_path.is_file():
@@ -47,7 +63,7 @@ def check_torrent_status(torrent):
 
         stat = real_file_path.stat()
 
-        if file.progress == 1.0 and stat.st_blocks == 0:
+        if progress == 1.0 and stat.st_blocks == 0:
             logger.info(f"File not materialized on disk: {torrent.name}")
             return ERROR_SIZE
 
@@ -57,11 +73,12 @@ def check_torrent_status(torrent):
 def main():
     qbt_client = utils.init_clients( json.loads(os.getenv("QBIT_CLIENTS", "[]")), single= True )
     torrents = qbt_client.torrents_info()
+    bt_backup = BTBackup(BT_BACKUP) if BT_BACKUP else None
 
     errored_hashes = set()
     pauselist = set()
     for torrent in torrents:
-        torrent_status = check_torrent_status(torrent)
+        torrent_status = check_torrent_status(torrent, bt_backup)
         if torrent_status == NOERROR:
             continue
         errored_hashes.add(torrent.hash)
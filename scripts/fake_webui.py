@@ -0,0 +1,294 @@
+# WebUI de qBittorrent falsa para probar tagWorker (los dos engines) sin un qBittorrent de verdad.
+# implementa login, sync/maindata con deltas por rid, tags, trackers, files y los setters que usa el worker.
+# uso: python scripts/fake_webui.py [--port 8080] [--torrents 5000] [--latency 50] [--churn 0.01]
+import argparse
+import copy
+import json
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TRACKERS = [
+    'https://aither.cc/announce/x',
+    'https://blutopia.cc/announce/y',
+    'https://tracker.torrentleech.org/a',
+    'https://hawke.uno/announce/z',
+    'http://unknown.org/announce',
+]
+CATEGORIES = ['tv', 'movies', 'xseed', 'manual']
+STATES = ['uploading', 'stalledUP', 'stoppedUP', 'downloading']
+# cuantos rids antiguos se guardan para poder mandar deltas (como qBittorrent, un rid viejo da full_update).
+# como en qBittorrent, cada sesion (SID) tiene los suyos: un rid de otra sesion (o de antes de un login) da full_update
+HISTORY = 64
+
+
+def make_torrent(rng: random.Random, i: int) -> dict:
+    thash = f"{rng.getrandbits(160):040x}"
+    size = rng.randint(10**6, 10**10)
+    category = rng.choice(CATEGORIES)
+    return {
+        'hash': thash,
+        'name': f"torrent.{i}",
+        'tags': rng.choice(['', 'xs', 'cross-seed']),
+        'category': category,
+        'tracker': rng.choice(TRACKERS),
+        'state': rng.choice(STATES),
+        'progress': rng.choice([1, 1, 1, 0.5]),
+        'seeding_time': rng.randint(0, 400 * 86400),
+        'ratio': rng.random() * 3,
+        'downloaded': size,
+        'size': size,
+        'num_complete': rng.randint(0, 20),
+        'auto_tmm': rng.random() < 0.9,
+        'save_path': f"/data/torrents/{category}",
+        'content_path': f"/data/torrents/{category}/torrent.{i}.mkv",
+        'max_seeding_time': -1,
+        'ratio_limit': -2,
+        'seeding_time_limit': -2,
+        'up_limit': 0,
+    }
+
+
+class FakeQBit:
+    def __init__(self, torrents: int, churn: float, seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.churn: float = churn
+        self.lock = threading.Lock()
+        self.torrents: dict[str, dict] = {}
+        for i in range(torrents):
+            torrent = make_torrent(self.rng, i)
+            self.torrents[torrent['hash']] = torrent
+        self.count: int = torrents
+        self.tags_removed: list[str] = []
+        self.rid: int = 0
+        self.history: dict[str, OrderedDict[int, tuple[dict, set]]] = {}
+        self.requests: dict[str, int] = {}
+
+    def _tags(self, torrent: dict) -> set[str]:
+        return {tag for tag in torrent['tags'].split(', ') if tag}
+
+    def all_tags(self) -> set[str]:
+        return set().union(*(self._tags(t) for t in self.torrents.values())) if self.torrents else set()
+
+    def _mutate(self) -> None:
+        # algo de movimiento entre syncs: tiempo de seed, alguno nuevo y alguno borrado
+        for torrent in self.torrents.values():
+            if torrent['state'] in ('uploading', 'stalledUP'):
+                torrent['seeding_time'] += 1
+        changes = int(len(self.torrents) * self.churn)
+        for _ in range(changes):
+            if self.torrents and self.rng.random() < 0.5:
+                del self.torrents[self.rng.choice(list(self.torrents))]
+            else:
+                torrent = make_torrent(self.rng, self.count)
+                self.count += 1
+                self.torrents[torrent['hash']] = torrent
+
+    def maindata(self, rid: int, session: str = '') -> dict:
+        with self.lock:
+            self._mutate()
+            self.rid += 1
+            current = copy.deepcopy(self.torrents)
+            tags = self.all_tags()
+            history = self.history.setdefault(session, OrderedDict())
+            history[self.rid] = (current, tags)
+            while len(history) > HISTORY:
+                history.popitem(last=False)
+            tags_removed, self.tags_removed = self.tags_removed, []
+
+            if rid not in history:
+                return {'rid': self.rid, 'full_update': True, 'torrents': current, 'tags': sorted(tags),
+                        'categories': {c: {'name': c, 'savePath': f"/data/torrents/{c}"} for c in CATEGORIES},
+                        'server_state': {'connection_status': 'connected'}}
+
+            old, old_tags = history[rid]
+            delta = {}
+            for thash, torrent in current.items():
+                before = old.get(thash)
+                if before is None:
+                    delta[thash] = torrent
+                else:
+                    changed = {k: v for k, v in torrent.items() if before.get(k) != v}
+                    if changed:
+                        delta[thash] = changed
+            data = {'rid': self.rid}
+            if delta:
+                data['torrents'] = delta
+            removed = [thash for thash in old if thash not in current]
+            if removed:
+                data['torrents_removed'] = removed
+            if tags - old_tags:
+                data['tags'] = sorted(tags - old_tags)
+            if tags_removed:
+                data['tags_removed'] = tags_removed
+            return data
+
+    def edit_tags(self, hashes: list[str], tags: list[str], add: bool) -> None:
+        with self.lock:
+            for thash in hashes:
+                torrent = self.torrents.get(thash)
+                if torrent is None:
+                    continue
+                current = self._tags(torrent)
+                current = current | set(tags) if add else current - set(tags)
+                torrent['tags'] = ', '.join(sorted(current))
+
+    def delete_tags(self, tags: list[str]) -> None:
+        with self.lock:
+            for torrent in self.torrents.values():
+                torrent['tags'] = ', '.join(sorted(self._tags(torrent) - set(tags)))
+            self.tags_removed.extend(tags)
+
+    def set_field(self, hashes: list[str], **fields) -> None:
+        with self.lock:
+            for thash in hashes:
+                if thash in self.torrents:
+                    self.torrents[thash].update(fields)
+
+    def trackers(self, thash: str) -> list[dict] | None:
+        torrent = self.torrents.get(thash)
+        if torrent is None:
+            return None
+        # un tracker de cada diez da error, siempre el mismo
+        errored = int(thash[:2], 16) % 10 == 0
+        return [{'url': torrent['tracker'], 'status': 4 if errored else 2, 'msg': 'unregistered torrent' if errored else ''}]
+
+    def files(self, thash: str) -> list[dict] | None:
+        torrent = self.torrents.get(thash)
+        if torrent is None:
+            return None
+        return [{'name': f"{torrent['name']}.mkv", 'size': torrent['size']}]
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    # el backlog por defecto (5) tira conexiones en cuanto el cliente lanza muchas peticiones a la vez
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def make_handler(server: FakeQBit, user: str, password: str, latency: float):
+    sessions: set[str] = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # cabeceras y cuerpo van en dos write: con Nagle cada respuesta se come el ACK retardado (~40ms)
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status: int, body=None) -> None:
+            if isinstance(body, (dict, list)):
+                payload, content_type = json.dumps(body).encode(), 'application/json'
+            else:
+                payload, content_type = (body or '').encode(), 'text/plain; charset=UTF-8'
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            if getattr(self, '_cookie', None):
+                self.send_header('Set-Cookie', f"SID={self._cookie}; HttpOnly; path=/")
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _params(self) -> dict[str, str]:
+            params = {k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()}
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                params.update({k: v[-1] for k, v in parse_qs(self.rfile.read(length).decode()).items()})
+            return params
+
+        def _authorized(self) -> bool:
+            cookies = dict(part.strip().split('=', 1) for part in (self.headers.get('Cookie') or '').split(';') if '=' in part)
+            self._session = cookies.get('SID')
+            return self._session in sessions
+
+        def do_GET(self):
+            self._handle()
+
+        def do_POST(self):
+            self._handle()
+
+        def _handle(self) -> None:
+            self._cookie = None
+            if latency:
+                time.sleep(latency)
+            endpoint = urlparse(self.path).path.removeprefix('/api/v2/')
+            params = self._params()
+            server.requests[endpoint] = server.requests.get(endpoint, 0) + 1
+
+            if endpoint == 'auth/login':
+                if params.get('username') == user and params.get('password') == password:
+                    self._cookie = secrets.token_hex(16)
+                    sessions.add(self._cookie)
+                    return self._reply(200, 'Ok.')
+                return self._reply(200, 'Fails.')
+            if not self._authorized():
+                return self._reply(403, 'Forbidden')
+
+            hashes = [h for h in params.get('hashes', '').split('|') if h]
+            tags = [t.strip() for t in params.get('tags', '').split(',') if t.strip()]
+            if endpoint == 'auth/logout':
+                return self._reply(200)
+            if endpoint == 'sync/maindata':
+                return self._reply(200, server.maindata(int(params.get('rid', 0)), self._session))
+            if endpoint in ('torrents/addTags', 'torrents/removeTags'):
+                server.edit_tags(hashes, tags, add=endpoint == 'torrents/addTags')
+                return self._reply(200)
+            if endpoint == 'torrents/deleteTags':
+                server.delete_tags(tags)
+                return self._reply(200)
+            if endpoint in ('torrents/trackers', 'torrents/files'):
+                thash = params.get('hash', '')
+                result = server.trackers(thash) if endpoint == 'torrents/trackers' else server.files(thash)
+                return self._reply(404, 'Torrent hash was not found') if result is None else self._reply(200, result)
+            if endpoint in ('torrents/start', 'torrents/resume'):
+                server.set_field(hashes, state='uploading')
+                return self._reply(200)
+            if endpoint == 'torrents/setForceStart':
+                server.set_field(hashes, state='forcedUP')
+                return self._reply(200)
+            if endpoint == 'torrents/setAutoManagement':
+                server.set_field(hashes, auto_tmm=params.get('enable') == 'true')
+                return self._reply(200)
+            if endpoint == 'torrents/setShareLimits':
+                server.set_field(hashes, ratio_limit=float(params['ratioLimit']), seeding_time_limit=int(params['seedingTimeLimit']),
+                                 max_seeding_time=int(params['seedingTimeLimit']))
+                return self._reply(200)
+            if endpoint == 'torrents/setUploadLimit':
+                server.set_field(hashes, up_limit=int(params['limit']))
+                return self._reply(200)
+            return self._reply(404, 'Not Found')
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebUI de qBittorrent falsa para pruebas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--torrents", type=int, default=5000)
+    parser.add_argument("--churn", type=float, default=0.01, help="fraccion de torrents que entran o salen en cada sync")
+    parser.add_argument("--latency", type=float, default=0, help="ms de espera en cada peticion")
+    parser.add_argument("--user", default="admin")
+    parser.add_argument("--password", default="adminadmin")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    fake = FakeQBit(args.torrents, args.churn, args.seed)
+    httpd = FakeHTTPServer((args.host, args.port), make_handler(fake, args.user, args.password, args.latency / 1000))
+    print(f"fake WebUI on http://{args.host}:{args.port} with {args.torrents} torrents. Ctrl+C to stop")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        print(f"requests: {json.dumps(fake.requests, indent=2, sort_keys=True)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 import os
+import sys
 import json
 from pathlib import Path
 from collections import defaultdict, namedtuple
 from dotenv import load_dotenv
 import utils
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tagworker.files import count_inodes
+from tagworker.inodes import InodeIndex
+
 script_dir = os.path.dirname(os.path.abspath(__file__))
 dotenv_path = os.path.join(script_dir, '.env')
 load_dotenv(dotenv_path, override=True)
@@ -22,16 +28,16 @@ POSTFIX_TAG = os.getenv('XSEED_TAG_POSTFIX', ".cross-seed")
 XS_ORPHAN_TAG = os.getenv('XSEED_TAG_ORPHAN', f"@{XSEED_FOLDER}-only")
 
 
-def build_inode_dict(rootdir):
-    inode_dict = {}
-    for path in rootdir.rglob('*'):  # recorre recursivamente
-        if path.is_file():
-            try:
-                inode = path.stat().st_ino
-                inode_dict.setdefault(inode, []).append(path)
-            except FileNotFoundError:
-                continue
-    return inode_dict
+def build_inode_index(rootdir):
+    """
+    Inodos de cada directorio de primer nivel de rootdir, con el directorio como grupo: para cada fichero basta
+    saber en que carpetas tiene enlaces, no guardar todas sus rutas. Los ficheros sueltos en rootdir no cuentan
+    """
+    folders = sorted(entry.name for entry in os.scandir(rootdir) if entry.is_dir(follow_symlinks=False))
+    inode_index = InodeIndex(grouped=True)
+    for group, folder in enumerate(folders):
+        count_inodes(os.path.join(rootdir, folder), index=inode_index, group=group)
+    return inode_index.build(), folders
 
 
 def translate_path(qbit_path):
@@ -44,14 +50,7 @@ def translate_path(qbit_path):
         return qbit.resolve()
 
 
-def get_top_level_folder(relative_path):
-    p = Path(relative_path)
-    if not p.parts:
-        raise ValueError("Invalid or empty relative path.")
-    return p.parts[0]
-
-
-def process_torrents(torrents, inode_dict):
+def process_torrents(torrents, inode_index, folders):
     simpleT = namedtuple('simpleT', ['name', 'hash'])
     tag_queue = defaultdict(set)
     xseed_only = set()
@@ -64,16 +63,10 @@ def process_torrents(torrents, inode_dict):
                 qbit_path = Path(torrent.save_path) / file.name
                 real_path = translate_path(qbit_path)
                 try:
-                    inode = real_path.stat().st_ino
-                    for hardlink in inode_dict.get(inode, []):
-                        hardlink_path = Path(hardlink)
-                        hardlink_relative = hardlink_path.relative_to(ROOTDIR)
-                        top_folder = get_top_level_folder(hardlink_relative)
-                        hardlink_folders.add(top_folder)
+                    stat = real_path.stat()
+                    hardlink_folders.update(folders[group] for group in inode_index.groups(stat.st_dev, stat.st_ino))
                 except FileNotFoundError:
                     logger.warning(f" - {real_path} (File not found)")
-                except ValueError as e:
-                    logger.warning(f" - Skipped invalid path: {hardlink_relative} ({e})")
 
             hardlink_folders.discard(XSEED_FOLDER)
             hardlink_folders.discard(ORPHANFOLDER)
@@ -115,8 +108,8 @@ def main():
     if not torrents:
         logger.info(f"No torrents found in category '{TORRENT_CATEGORY}'.")
     else:
-        inode_dict = build_inode_dict(ROOTDIR)
-        tag_queue, xseed_only = process_torrents(torrents, inode_dict)
+        inode_index, folders = build_inode_index(ROOTDIR)
+        tag_queue, xseed_only = process_torrents(torrents, inode_index, folders)
         apply_tags(qbt_client, tag_queue)
 
         qbt_client.torrents_delete_tags(XS_ORPHAN_TAG)
@@ -1,15 +1,14 @@
 import sys
 import platform
-import time
 import argparse
 import threading
 import signal
-import schedule
 from pytimeparse2 import parse
 from .logger import logger
 from .config import Config, GlobalConfig
 from .worker import worker
 from .locker import acquire_lock, LockAcquisitionError
+from .quarantine import QuarantineJournal, quarantine_path
 
 CONFIG_FILE = 'config/config.yml'
 
@@ -74,6 +73,25 @@ def startup_msg(config=None):
     print('')
 
 
+def restore_orphans(paths: list[str]) -> int:
+    """devuelve a su ruta original lo que se movio a orphaned_path desde paths (ficheros o directorios)"""
+    state_dir = GlobalConfig.get('app.state_dir', 'state')
+    restored = 0
+    for name, client in GlobalConfig.get("clients").items():
+        folders = getattr(client, 'folders', {})
+        if not getattr(client, 'local_instance', False) or not folders.get('orphaned_path'):
+            continue
+        journal = QuarantineJournal(quarantine_path(state_dir, name), folders['orphaned_path'], name=name)
+        try:
+            for path in paths:
+                restored += len(journal.restore(path))
+            journal.sync()
+        finally:
+            journal.close()
+    logger.info(f"{'APP':<10} - {restored} files restored")
+    return restored
+
+
 def main():
     signal.signal(signal.SIGINT, signal_handler)
     parser = argparse.ArgumentParser(
@@ -90,6 +108,12 @@ def main():
         default=CONFIG_FILE,
         help=f"Ruta al archivo de configuración (por defecto: {CONFIG_FILE})"
     )
+    parser.add_argument(
+        "-r", "--restore",
+        nargs="+",
+        metavar="PATH",
+        help="Devuelve a su sitio los huérfanos que estaban en PATH (fichero o directorio) y sale"
+    )
 
     args = parser.parse_args()
     singlerun = args.singlerun
@@ -108,6 +132,12 @@ def main():
     app_config = Config(configfile)
     GlobalConfig.set(app_config)
 
+    if args.restore:
+        if not GlobalConfig.get('app.quarantine_journal', True):
+            logger.error(f"{'APP':<10} - quarantine_journal is disabled. nothing to restore from")
+            sys.exit(1)
+        sys.exit(0 if restore_orphans(args.restore) else 1)
+
     startup_msg()
     # inits
     workers = set()
@@ -128,12 +158,12 @@ def main():
         for t in threads:
             t.join()  # Esperar a que todos terminen
     else:
+        # cada worker arranca su propio hilo con sus timers: un cliente lento no frena a los demas
         for w in workers:
             w.run(singlerun=False)
         try:
             while not stop_event.is_set():
-                schedule.run_pending()
-                time.sleep(1)
+                stop_event.wait(1)
         except Exception as e:
             logger.error(f"Unexpected error: {e}", exc_info=True)
         finally:
@@ -144,7 +174,7 @@ def main():
     for w in workers:
         try:
             logger.info(f"{w.name:<10} - Stopping...")
-            w.logout()
+            w.stop()
         except Exception as e:
             logger.error(f"{w.name:<10}- Error stopping: {e}")
 
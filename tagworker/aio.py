@@ -0,0 +1,232 @@
+import asyncio
+import threading
+
+import qbittorrentapi
+
+try:
+    import aiohttp
+except ImportError: # aiohttp es opcional: sin el, el engine 'asyncio' cae al de hilos
+    aiohttp = None
+
+from .qbit import qBit
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock: threading.Lock = threading.Lock()
+
+
+def available() -> bool:
+    return aiohttp is not None
+
+
+def shared_loop() -> asyncio.AbstractEventLoop:
+    """el event loop de la E/S de todos los clientes, corriendo en su propio hilo. se arranca al pedirlo"""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="aio-loop", daemon=True).start()
+        return _loop
+
+
+def _join(values, sep: str = '|') -> str:
+    return values if isinstance(values, str) else sep.join(values)
+
+
+class AsyncQBit:
+    """
+    Adaptador asincrono de la WebUI API v2 de qBittorrent, solo con los endpoints que usa tagWorker.
+    Las peticiones de un cliente pasan por un semaforo: como mucho concurrency a la vez contra ese servidor.
+    Los errores se levantan con las excepciones de qbittorrentapi para que el resto del codigo no cambie
+    """
+
+    def __init__(self, url: str, user: str, pwd: str, concurrency: int = 8, timeout: float | None = 30) -> None:
+        self.url: str = url.rstrip('/')
+        self._user: str = user
+        self._pwd: str = pwd
+        self._timeout: float | None = timeout
+        self._concurrency: int = max(1, int(concurrency))
+        # se crean dentro del loop la primera vez que hacen falta
+        self._session: "aiohttp.ClientSession | None" = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+    def _open(self) -> "aiohttp.ClientSession":
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self._timeout),
+                cookie_jar=aiohttp.CookieJar(unsafe=True), # la cookie SID tambien con hosts por IP
+            )
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @staticmethod
+    async def _result(endpoint: str, response: "aiohttp.ClientResponse"):
+        if response.status == 404:
+            raise qbittorrentapi.NotFound404Error(f"{endpoint}: not found")
+        if response.status >= 400:
+            raise qbittorrentapi.HTTPError(f"{endpoint}: HTTP {response.status} {await response.text()}")
+        if response.content_type == 'application/json':
+            return await response.json()
+        return await response.text()
+
+    async def _request(self, method: str, endpoint: str, params: dict | None = None, data: dict | None = None, relogin: bool = True):
+        session = self._open()
+        try:
+            async with self._semaphore:
+                async with session.request(method, f"{self.url}/api/v2/{endpoint}", params=params, data=data) as response:
+                    if response.status != 403 or not relogin:
+                        return await self._result(endpoint, response)
+        except aiohttp.ClientError as e:
+            raise qbittorrentapi.APIConnectionError(f"{endpoint}: {e}") from e
+        except asyncio.TimeoutError as e:
+            raise qbittorrentapi.APIConnectionError(f"{endpoint}: timed out") from e
+        # la cookie ha caducado (reinicio de qBittorrent): login y una sola vez mas, ya fuera del semaforo
+        await self.login()
+        return await self._request(method, endpoint, params, data, relogin=False)
+
+    async def login(self) -> None:
+        result = await self._request('POST', 'auth/login', data={'username': self._user, 'password': self._pwd}, relogin=False)
+        if result != 'Ok.':
+            raise qbittorrentapi.LoginFailed(f"{self.url}: {result}")
+
+    async def logout(self) -> None:
+        await self._request('POST', 'auth/logout', relogin=False)
+
+    async def sync_maindata(self, rid: int = 0) -> dict:
+        return await self._request('GET', 'sync/maindata', params={'rid': rid})
+
+    async def trackers(self, thash: str) -> list[dict]:
+        return await self._request('GET', 'torrents/trackers', params={'hash': thash})
+
+    async def trackers_many(self, hashes) -> dict:
+        """hash -> lista de trackers (o la excepcion), todas a la vez dentro del limite del semaforo"""
+        hashes = list(hashes)
+        results = await asyncio.gather(*(self.trackers(thash) for thash in hashes), return_exceptions=True)
+        return dict(zip(hashes, results))
+
+    async def files(self, thash: str) -> list[dict]:
+        return await self._request('GET', 'torrents/files', params={'hash': thash})
+
+    async def files_many(self, hashes) -> dict:
+        """hash -> ficheros (o la excepcion), como trackers_many"""
+        hashes = list(hashes)
+        results = await asyncio.gather(*(self.files(thash) for thash in hashes), return_exceptions=True)
+        return dict(zip(hashes, results))
+
+    async def add_tags(self, hashes, tags) -> None:
+        await self._request('POST', 'torrents/addTags', data={'hashes': _join(hashes), 'tags': _join(tags, ',')})
+
+    async def remove_tags(self, hashes, tags) -> None:
+        await self._request('POST', 'torrents/removeTags', data={'hashes': _join(hashes), 'tags': _join(tags, ',')})
+
+    async def delete_tags(self, tags) -> None:
+        await self._request('POST', 'torrents/deleteTags', data={'tags': _join(tags, ',')})
+
+    async def set_force_start(self, hashes, value: bool = True) -> None:
+        await self._request('POST', 'torrents/setForceStart', data={'hashes': _join(hashes), 'value': str(value).lower()})
+
+    async def set_auto_management(self, hashes, enable: bool = True) -> None:
+        await self._request('POST', 'torrents/setAutoManagement', data={'hashes': _join(hashes), 'enable': str(enable).lower()})
+
+    async def set_share_limits(self, hashes, ratio_limit, seeding_time_limit, inactive_seeding_time_limit) -> None:
+        await self._request('POST', 'torrents/setShareLimits', data={
+            'hashes': _join(hashes),
+            'ratioLimit': ratio_limit,
+            'seedingTimeLimit': seeding_time_limit,
+            'inactiveSeedingTimeLimit': inactive_seeding_time_limit,
+        })
+
+    async def set_upload_limit(self, hashes, limit: int) -> None:
+        await self._request('POST', 'torrents/setUploadLimit', data={'hashes': _join(hashes), 'limit': limit})
+
+    async def start(self, hashes) -> None:
+        # qBittorrent 5 renombro resume -> start
+        try:
+            await self._request('POST', 'torrents/start', data={'hashes': _join(hashes)})
+        except qbittorrentapi.NotFound404Error:
+            await self._request('POST', 'torrents/resume', data={'hashes': _join(hashes)})
+
+
+class BridgedQBit(qBit):
+    """
+    El qBit de siempre (estado, sync, snapshots) con la red pasando por un AsyncQBit en el loop compartido.
+    Los taggers siguen siendo sincronos: corren en un hilo y cada llamada a la API se encola en el loop
+    y espera su resultado. Asi las peticiones de todos los clientes comparten un solo hilo de E/S
+    """
+
+    def __init__(self, url, user, pwd, loop: asyncio.AbstractEventLoop, concurrency=8, numeric=False, timeout=None):
+        super().__init__(url, user, pwd, pool_size=1, numeric=numeric, timeout=timeout)
+        self.aio: AsyncQBit = AsyncQBit(url, user, pwd, concurrency=concurrency, timeout=timeout)
+        self._loop: asyncio.AbstractEventLoop = loop
+
+    def _call(self, coro):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop: # se quedaria esperandose a si mismo
+            raise RuntimeError("blocking API call from the event loop thread")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def sync_maindata(self, rid=0, **kwargs):
+        return self._call(self.aio.sync_maindata(rid))
+
+    def auth_log_in(self, *args, **kwargs):
+        self._call(self.aio.login())
+
+    def auth_log_out(self, *args, **kwargs):
+        try:
+            self._call(self.aio.logout())
+        finally:
+            self._call(self.aio.close())
+
+    def add_tags(self, hashes, tag):
+        self._call(self.aio.add_tags(list(hashes), tag))
+
+    def remove_tags(self, hashes, tags):
+        self._call(self.aio.remove_tags(list(hashes), tags))
+
+    def delete_tags(self, tags):
+        self._call(self.aio.delete_tags(list(tags)))
+
+    def file_names(self, thash):
+        return [file['name'] for file in self._call(self.aio.files(thash))]
+
+    def file_names_many(self, hashes):
+        return {
+            thash: files if isinstance(files, Exception) else [file['name'] for file in files]
+            for thash, files in self._call(self.aio.files_many(hashes)).items()
+        }
+
+    def force_start(self, hashes):
+        self._call(self.aio.set_force_start(list(hashes)))
+
+    def resume_torrents(self, hashes):
+        self._call(self.aio.start(list(hashes)))
+
+    def enable_tmm(self, hashes):
+        self._call(self.aio.set_auto_management(list(hashes)))
+
+    def sharelimit(self, hashes, limits):
+        self._call(self.aio.set_share_limits(
+            list(hashes),
+            ratio_limit=limits['ratio'] if limits['ratio'] is not None else -2,
+            seeding_time_limit=limits['time'] if limits['time'] is not None else -2,
+            inactive_seeding_time_limit=-2,
+        ))
+
+    def uploadlimit(self, hashes, limit):
+        self._call(self.aio.set_upload_limit(list(hashes), limit*1024))
+
+    def get_trackers(self, thash):
+        return self._call(self.aio.trackers(thash))
+
+    def get_trackers_many(self, hashes):
+        return self._call(self.aio.trackers_many(hashes))
+
+    def start(self, thashes):
+        return self._call(self.aio.start(list(thashes)))
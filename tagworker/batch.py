@@ -0,0 +1,122 @@
+from collections import defaultdict
+
+from .logger import logger
+
+
+class TagBatch:
+    """
+    Buffer de cambios de tags de un ciclo. Los taggers escriben aqui en vez de llamar a la API.
+    Cada cambio se aplica al momento en el estado local (optimista), para que el resto de taggers
+    lo vean sin esperar a otro sync, y al final del ciclo flush() manda las peticiones:
+     - se compara el estado local con el que tenia el torrent antes del ciclo, asi un add + remove no genera nada
+     - los hashes que reciben el mismo conjunto de tags van en una sola peticion multi-tag
+       (o una peticion por tag, si con tantas combinaciones distintas salen menos peticiones)
+     - los tags a borrar del servidor (delete) van los ultimos, cuando ya se han mandado los añadidos
+    """
+
+    def __init__(self, client, name: str = '') -> None:
+        self.client = client
+        self.name: str = name
+        # hash -> tags confirmados por el servidor antes de tocarlo en este ciclo
+        self._base: dict[str, frozenset[str]] = {}
+        # hashes cuyos tags locales han cambiado desde el ultimo take_touched()
+        self._touched: set[str] = set()
+        # tags a borrar del servidor despues de mandar los cambios
+        self._deleted: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._base)
+
+    def __bool__(self) -> bool:
+        return bool(self._base or self._deleted)
+
+    @staticmethod
+    def _as_tags(tags) -> frozenset[str]:
+        return frozenset((tags,)) if isinstance(tags, str) else frozenset(tags)
+
+    def _mutate(self, hashes, add=frozenset(), remove=frozenset()) -> None:
+        client = self.client
+        for thash in hashes:
+            if thash not in client.torrentdict:
+                continue
+            current = client.tags_of(thash)
+            new = (current | add) - remove
+            if new == current:
+                continue
+            self._base.setdefault(thash, current)
+            client.set_local_tags(thash, new)
+            self._touched.add(thash)
+
+    def add(self, hashes, tags) -> None:
+        self._mutate(hashes, add=self._as_tags(tags))
+
+    def remove(self, hashes, tags) -> None:
+        self._mutate(hashes, remove=self._as_tags(tags))
+
+    def delete(self, tags) -> None:
+        """quita los tags de todos los torrents y los borra del servidor en el flush, despues de los añadidos"""
+        tags = self._as_tags(tags)
+        for tag in tags:
+            self._mutate(list(self.client.torrents_with_tag(tag)), remove=frozenset((tag,)))
+        self._deleted |= tags
+
+    def take_touched(self) -> set[str]:
+        """hashes cuyos tags han cambiado localmente desde la ultima llamada"""
+        touched, self._touched = self._touched, set()
+        return touched
+
+    def net(self) -> tuple[dict[frozenset, set], dict[frozenset, set]]:
+        """agrupa los cambios netos: {tags a añadir: hashes}, {tags a quitar: hashes}"""
+        tags_of = self.client.tags_of
+        to_add: dict[frozenset, set] = defaultdict(set)
+        to_remove: dict[frozenset, set] = defaultdict(set)
+        for thash, base in self._base.items():
+            current = tags_of(thash)
+            if add := current - base: to_add[add].add(thash)
+            # los que se borran del servidor ya se van de todos los torrents con el delete
+            if remove := base - current - self._deleted: to_remove[remove].add(thash)
+        return self._fewest_requests(to_add), self._fewest_requests(to_remove)
+
+    @staticmethod
+    def _fewest_requests(groups: dict[frozenset, set]) -> dict[frozenset, set]:
+        by_tag: dict[frozenset, set] = defaultdict(set)
+        for tags, hashes in groups.items():
+            for tag in tags:
+                by_tag[frozenset((tag,))] |= hashes
+        return by_tag if len(by_tag) < len(groups) else groups
+
+    def clear(self) -> None:
+        self._base.clear()
+        self._touched.clear()
+        self._deleted.clear()
+
+    def rollback(self) -> None:
+        """deshace en el estado local los cambios que no se han llegado a mandar"""
+        for thash, base in self._base.items():
+            self.client.set_local_tags(thash, base)
+        self.clear()
+
+    def flush(self) -> int:
+        """manda los cambios pendientes. devuelve el numero de peticiones hechas"""
+        if not self:
+            return 0
+        to_add, to_remove = self.net()
+        try:
+            for tags, hashes in to_add.items():
+                self.client.add_tags(hashes, sorted(tags))
+            for tags, hashes in to_remove.items():
+                self.client.remove_tags(hashes, sorted(tags))
+            # si algo de lo anterior falla no se borra nada: un rename no deja torrents sin ninguno de los dos tags
+            if self._deleted:
+                self.client.delete_tags(sorted(self._deleted))
+        except Exception:
+            # no sabemos que ha llegado al servidor: volvemos a lo confirmado y que el siguiente sync lo aclare
+            self.rollback()
+            raise
+        deleted = self._deleted.copy()
+        self.clear()
+
+        requests = len(to_add) + len(to_remove) + bool(deleted)
+        if requests:
+            logger.debug(f"{self.name:<10} - tag batch flushed in {requests} requests")
+        return requests
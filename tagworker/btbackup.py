@@ -0,0 +1,129 @@
+import os
+import threading
+from typing import NamedTuple
+
+import bencodepy
+
+from .logger import logger
+
+
+class LocalTorrent(NamedTuple):
+    save_path: str                  # tal cual lo ve qBittorrent (sin translation_table)
+    names: tuple[str, ...]          # ficheros relativos a save_path, como los de torrents/files
+    priorities: tuple[int, ...]     # prioridad de cada fichero (0: no se descarga)
+
+
+def _text(value) -> str:
+    return value.decode('utf-8', 'surrogateescape') if isinstance(value, bytes) else str(value or '')
+
+
+def _info_files(info: dict) -> list[str | None]:
+    """rutas de los ficheros segun el info del .torrent (v1, o el 'file tree' de un v2 puro). None: fichero de relleno"""
+    name = _text(info.get(b'name.utf-8') or info.get(b'name'))
+    if b'files' in info:
+        files = []
+        for entry in info[b'files']:
+            parts = entry.get(b'path.utf-8') or entry.get(b'path') or []
+            # los ficheros de relleno de los torrents hibridos no estan en disco ni en torrents/files,
+            # pero cuentan para los indices de mapped_files y file_priority
+            if b'p' in entry.get(b'attr', b''):
+                files.append(None)
+            else:
+                files.append('/'.join([name] + [_text(part) for part in parts]))
+        return files
+    if b'file tree' in info:
+        tree: dict = info[b'file tree']
+        # un v2 de un solo fichero: el arbol es solo el nombre
+        if len(tree) == 1 and b'' in next(iter(tree.values())):
+            return [name]
+        files = []
+        # en el orden de libtorrent: claves ordenadas, en profundidad
+        stack: list[tuple[list[str], dict]] = [([name], tree)]
+        while stack:
+            prefix, node = stack.pop()
+            for key, child in sorted(node.items(), reverse=True):
+                if key == b'':
+                    files.append('/'.join(prefix))
+                else:
+                    stack.append((prefix + [_text(key)], child))
+        return files
+    return [name]
+
+
+def parse(torrent_data: bytes | None, resume_data: bytes) -> LocalTorrent:
+    """un .torrent y su .fastresume de BT_backup. el info puede venir en el .fastresume (qBittorrent < 4.2)"""
+    resume: dict = bencodepy.decode(resume_data)
+    info: dict | None = None
+    if torrent_data:
+        info = bencodepy.decode(torrent_data).get(b'info')
+    if info is None:
+        info = resume.get(b'info')
+    if info is None:
+        raise ValueError("no metadata (magnet without info?)")
+    names = _info_files(info)
+    # ficheros renombrados en qBittorrent (y el layout sin subcarpeta): libtorrent guarda la ruta nueva aqui
+    mapped = resume.get(b'mapped_files') or []
+    for i, path in enumerate(mapped[:len(names)]):
+        if path and names[i] is not None:
+            names[i] = _text(path).replace('\\', '/')
+    priorities = list(resume.get(b'file_priority') or [])
+    priorities += [1] * (len(names) - len(priorities))
+    kept = [i for i, name in enumerate(names) if name is not None]
+    save_path = _text(resume.get(b'save_path') or resume.get(b'qBt-savePath'))
+    return LocalTorrent(save_path, tuple(names[i] for i in kept), tuple(priorities[i] for i in kept))
+
+
+class BTBackup:
+    """
+    Metadatos de los torrents leidos del BT_backup de qBittorrent (instancias locales): ficheros, save_path y
+    prioridades sin pedir nada a la WebUI. Cada hash se parsea una vez y se guarda junto al mtime de sus dos ficheros:
+    mientras no cambien (qBittorrent reescribe el .fastresume al mover o renombrar) se reutiliza lo parseado.
+    Lo que no se puede leer (no existe, torrents.db en vez de ficheros, metadatos sin bajar) devuelve None
+    """
+
+    def __init__(self, path: str, name: str = '') -> None:
+        self.path: str = path
+        self.name: str = name
+        self._cache: dict[str, tuple[int, int, LocalTorrent]] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self.parsed: int = 0        # parseos de verdad, para el log
+
+    def available(self) -> bool:
+        return os.path.isdir(self.path)
+
+    def torrent(self, thash: str) -> LocalTorrent | None:
+        base = os.path.join(self.path, thash.lower())
+        try:
+            resume_mtime = os.stat(f"{base}.fastresume").st_mtime_ns
+        except OSError:
+            return None
+        try:
+            torrent_mtime = os.stat(f"{base}.torrent").st_mtime_ns
+        except OSError:
+            torrent_mtime = 0
+
+        with self._lock:
+            cached = self._cache.get(thash)
+        if cached is not None and cached[0] == torrent_mtime and cached[1] == resume_mtime:
+            return cached[2]
+
+        try:
+            with open(f"{base}.fastresume", 'rb') as f:
+                resume_data = f.read()
+            torrent_data = None
+            if torrent_mtime:
+                with open(f"{base}.torrent", 'rb') as f:
+                    torrent_data = f.read()
+            parsed = parse(torrent_data, resume_data)
+        except Exception as e:
+            logger.debug(f"{self.name:<10} - unable to read {thash} from BT_backup: {e}")
+            return None
+        with self._lock:
+            self._cache[thash] = (torrent_mtime, resume_mtime, parsed)
+            self.parsed += 1
+        return parsed
+
+    def forget(self, hashes) -> None:
+        with self._lock:
+            for thash in hashes:
+                self._cache.pop(thash, None)
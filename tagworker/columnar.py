@@ -0,0 +1,145 @@
+try:
+    import numpy as np
+except ImportError: # numpy es opcional: sin el, los taggers usan los bucles de siempre
+    np = None
+
+# campos numericos que se guardan como arrays float64 (NaN si el torrent no lo tiene)
+NUMERIC_FIELDS: tuple[str, ...] = (
+    'progress', 'seeding_time', 'ratio', 'downloaded', 'size', 'num_complete',
+    'max_seeding_time', 'ratio_limit', 'seeding_time_limit', 'up_limit',
+)
+# campos str con pocos valores distintos: se guardan como codigo entero (-1 si no lo tiene)
+CODED_FIELDS: tuple[str, ...] = ('state', 'tracker')
+
+_INITIAL_CAPACITY: int = 1024
+
+
+def available() -> bool:
+    return np is not None
+
+
+class NumericColumns:
+    """
+    Copia en arrays de numpy de los campos numericos del TorrentStore, indexados por el mismo id entero.
+    El store le pasa los valores al aplicar los deltas; se acumulan en dicts y se vuelcan a los arrays
+    de golpe al pedir un Frame (asignar elemento a elemento en numpy es mas lento que en una lista).
+    Asi los taggers numericos se evaluan con mascaras sobre todos los torrents en vez de torrent a torrent.
+    """
+
+    def __init__(self) -> None:
+        self._capacity: int = 0
+        self._numeric: dict[str, "np.ndarray"] = {}
+        self._codes: dict[str, "np.ndarray"] = {}
+        self._values: dict[str, list[str]] = {}
+        self._lookup: dict[str, dict[str, int]] = {}
+        # campo -> {id: valor} pendiente de volcar. el store escribe aqui directamente
+        self.pending: dict[str, dict[int, object]] = {field: {} for field in NUMERIC_FIELDS + CODED_FIELDS}
+        self.clear()
+
+    def clear(self) -> None:
+        self._capacity = _INITIAL_CAPACITY
+        self._numeric = {field: np.full(self._capacity, np.nan) for field in NUMERIC_FIELDS}
+        self._codes = {field: np.full(self._capacity, -1, dtype=np.int32) for field in CODED_FIELDS}
+        self._values = {field: [] for field in CODED_FIELDS}
+        self._lookup = {field: {} for field in CODED_FIELDS}
+        for pending in self.pending.values():
+            pending.clear()
+
+    def _grow(self, tid: int) -> None:
+        capacity = self._capacity
+        while capacity <= tid:
+            capacity *= 2
+        for columns, fill in ((self._numeric, np.nan), (self._codes, -1)):
+            for field, array in columns.items():
+                grown = np.full(capacity, fill, dtype=array.dtype)
+                grown[:self._capacity] = array
+                columns[field] = grown
+        self._capacity = capacity
+
+    def remove(self, tid: int) -> None:
+        for pending in self.pending.values():
+            pending[tid] = None
+
+    def code(self, field: str, value) -> int:
+        if not isinstance(value, str):
+            return -1
+        lookup = self._lookup[field]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self._values[field])
+            self._values[field].append(value)
+        return code
+
+    def flush(self) -> None:
+        """vuelca a los arrays lo acumulado desde el ultimo flush"""
+        for field, pending in self.pending.items():
+            if not pending:
+                continue
+            tids = np.fromiter(pending.keys(), dtype=np.intp, count=len(pending))
+            if tids.max() >= self._capacity:
+                self._grow(int(tids.max()))
+            if field in self._numeric:
+                try:
+                    values = np.fromiter(pending.values(), dtype=float, count=len(pending))
+                except (TypeError, ValueError): # algun None (borrado) o valor raro
+                    values = np.array([value if isinstance(value, (int, float)) else np.nan for value in pending.values()], dtype=float)
+                self._numeric[field][tids] = values
+            else:
+                code = self.code
+                self._codes[field][tids] = [code(field, value) for value in pending.values()]
+            pending.clear()
+
+
+class Frame:
+    """
+    Un grupo de torrents (los cambiados en la pasada) visto como arrays alineados.
+    Las mascaras que se construyen con column(), codes(), lookup() y has_tag() se convierten
+    de vuelta a hashes con hashes_where()
+    """
+
+    def __init__(self, store, columns: NumericColumns, hashes) -> None:
+        ids = store._ids
+        columns.flush()
+        self._store = store
+        self._columns: NumericColumns = columns
+        self.hashes: list[str] = [thash for thash in hashes if thash in ids]
+        self.tids: "np.ndarray" = np.fromiter((ids[thash] for thash in self.hashes), dtype=np.intp, count=len(self.hashes))
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def column(self, field: str, missing: float | None = None) -> "np.ndarray":
+        """el campo numerico de cada torrent. NaN (o missing) si no lo tiene"""
+        values = self._columns._numeric[field][self.tids]
+        if missing is not None:
+            values[np.isnan(values)] = missing
+        return values
+
+    def codes(self, field: str) -> "np.ndarray":
+        return self._columns._codes[field][self.tids]
+
+    def isin(self, field: str, values) -> "np.ndarray":
+        """mascara: el campo codificado (state, tracker) es uno de values"""
+        lookup = self._columns._lookup[field]
+        wanted = [lookup[value] for value in values if value in lookup]
+        return np.isin(self.codes(field), wanted)
+
+    def lookup(self, field: str, func, dtype=float) -> "np.ndarray":
+        """
+        func(valor) para cada torrent, calculado una sola vez por valor distinto del campo.
+        Los torrents sin el campo reciben func(None)
+        """
+        values = self._columns._values[field]
+        # el codigo -1 (sin valor) indexa el ultimo elemento: func(None)
+        table = np.array([func(value) for value in values] + [func(None)], dtype=dtype)
+        return table[self.codes(field)]
+
+    def has_tag(self, tag: str) -> "np.ndarray":
+        store = self._store
+        tagged = np.zeros(len(store._hashes), dtype=bool)
+        tagged[[store._ids[thash] for thash in store.with_tag(tag)]] = True
+        return tagged[self.tids]
+
+    def hashes_where(self, mask) -> set[str]:
+        hashes = self.hashes
+        return {hashes[i] for i in np.flatnonzero(mask)}
@@ -1,12 +1,33 @@
 import yaml
 
+from .rules import CompiledRules, compile_rules
+
+_UNRESOLVED = object()
+
 class GlobalConfig:
     _config = None
+    # ruta -> valor ya resuelto (config + DEFAULTS). se regenera en cada set()
+    _table: dict | None = None
+    # config ya parseada para los bucles por torrent. se regenera en cada set()
+    rules: CompiledRules = None
     DEFAULTS = {
         "app": {
             "tagging_schedule_interval": 30,
             "disktasks_schedule_interval": "10m",
             "fullsync_interval": "60m",
+            # snapshot del estado de cada cliente para arrancar sin full sync
+            "state_dir": "state",
+            "snapshot_interval": "5m",
+            # cada cliente con sus propios timers, en su hilo
+            "scheduler": {
+                # "asyncio": la E/S de todos los clientes en un solo event loop (necesita aiohttp)
+                "engine": "threads",
+                "concurrency": 8,           # peticiones simultaneas por cliente con asyncio
+                "jitter": 0.1,              # fraccion del intervalo
+                "tag_timeout": "5m",        # aviso si un ciclo tarda mas
+                "disk_timeout": "2h",
+                "request_timeout": 30       # segundos por peticion a qBittorrent
+            },
             "share_limits_tag_prefix": "~sl.",
             "dupes": {
                 "enabled": True,
@@ -15,6 +36,12 @@ class GlobalConfig:
             "issue": {
                 "tag": "@issue"
             },
+            "tracker_status": {
+                "workers": 8,
+                "ttl": "5m"
+            },
+            # taggers numericos (HR, lowseeds, HUNO, share limits) vectorizados con numpy, si esta instalado
+            "columnar": True,
             "lowseeds": {
                 "min_seeds": 3,
                 "tag": "~lowSeeds"
@@ -30,6 +57,21 @@ class GlobalConfig:
                 ]
             },
             "prune_orphaned_time": "2w",
+            # diario en state_dir de lo movido a orphaned_path: prune no recorre el directorio y se puede restaurar
+            "quarantine_journal": True,
+            # cada cuanto se recorre orphaned_path para apuntar en el diario lo que llegue sin pasar por tagworker
+            # (si esta dentro de root_path no hace falta: se mira en cada pasada con lo que ya se ha leido)
+            "quarantine_reconcile": "1d",
+            # recorridos del disco repartidos por directorio de primer nivel ("dir") o por st_dev ("device")
+            "scan": {
+                "workers": 4,
+                # "device" solo ayuda si cada directorio de primer nivel es un montaje distinto, o con mergerfs y sus xattr
+                "shard_by": "dir",
+                # indice de ficheros en state_dir: cada pasada solo relista los directorios que han cambiado
+                "index": True,
+                # ficheros de cada torrent guardados en state_dir: solo se piden a qBittorrent si el torrent se mueve
+                "file_lists": True
+            },
             "noTMM": {
                 "auto_enable": False,
                 "tag": "~noTMM",
@@ -272,6 +314,8 @@ class GlobalConfig:
     @classmethod
     def set(cls, config):
         cls._config = config
+        cls._table = cls._flatten()
+        cls.rules = compile_rules(cls.get)
 
     @classmethod
     def _get_from_dict(cls, source, path, default=None):
@@ -290,10 +334,34 @@ class GlobalConfig:
         return current
 
     @classmethod
-    def get(cls, path=None, default=None):
+    def _flatten(cls) -> dict:
         """
-        Busca primero en _config y si no encuentra, en DEFAULTS.
-        Si no encuentra en ninguna, devuelve default.
+        Tabla ruta -> valor con DEFAULTS y encima la config del usuario, para que get() sea un solo acceso a dict.
+        Las rutas intermedias tambien estan ('app.noTMM' devuelve el nodo entero, como antes).
+        """
+        table: dict = {}
+
+        def walk(node, prefix):
+            children = node.items() if isinstance(node, dict) else vars(node).items()
+            for key, value in children:
+                # las claves con punto ('opsfet.ch') no se pueden pedir por ruta
+                if not isinstance(key, str) or '.' in key or value is None:
+                    continue
+                path = f"{prefix}.{key}" if prefix else key
+                table[path] = value
+                if isinstance(value, (dict, Config)):
+                    walk(value, path)
+
+        walk(cls.DEFAULTS, '')
+        if cls._config is not None:
+            walk(cls._config, '')
+        return table
+
+    @classmethod
+    def _resolve(cls, path):
+        """
+        Busca primero en _config y si no encuentra, en DEFAULTS, recorriendo la ruta.
+        Es el camino lento: solo para las rutas que no estan en la tabla.
         """
         def _get_from(source, path_parts):
             current = source
@@ -308,9 +376,6 @@ class GlobalConfig:
                     return None
             return current
 
-        if path is None:
-            return cls._config or cls.DEFAULTS
-
         parts = path.split('.')
 
         # Primero intento en la config personalizada
@@ -320,15 +385,28 @@ class GlobalConfig:
                 return result
 
         # Si no está, intento en DEFAULTS
-        result = _get_from(cls.DEFAULTS, parts)
-        if result is not None:
-            # logger.warning(f"Using DEFAULT value for {path} key config. Value: {result}")
-            return result
+        return _get_from(cls.DEFAULTS, parts)
 
-        # logger.warning(f"Config value for {path} key config not found. Using: {default}")
+    @classmethod
+    def get(cls, path=None, default=None):
+        """
+        Busca primero en _config y si no encuentra, en DEFAULTS.
+        Si no encuentra en ninguna, devuelve default.
+        """
+        if path is None:
+            return cls._config or cls.DEFAULTS
 
-        # Si no está en ninguno, devuelvo param default
-        return default
+        table = cls._table
+        if table is None:
+            table = cls._table = cls._flatten()
+        result = table.get(path, _UNRESOLVED)
+        if result is _UNRESOLVED:
+            # ruta rara (atributos, etc). la resolvemos una vez y queda en la tabla, tambien si no existe (None)
+            result = table[path] = cls._resolve(path)
+        if result is None:
+            # logger.warning(f"Config value for {path} key config not found. Using: {default}")
+            return default
+        return result
 
 
 class Config:
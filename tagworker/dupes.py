@@ -0,0 +1,57 @@
+import threading
+
+
+class HashIndex:
+    """
+    hash -> clientes que lo tienen, compartido por todos los workers del proceso.
+    Se alimenta de los added/removed de cada sync. Cuando cambian los dueños de un hash se apunta como
+    pendiente para cada uno de ellos, y cada cliente recoge solo sus pendientes: el coste de tag_dupes
+    va con los cambios, no con el total de torrents por el numero de clientes
+    """
+
+    def __init__(self) -> None:
+        self._owners: dict[str, set[str]] = {}
+        self._dirty: dict[str, set[str]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    def update(self, client: str, added=(), removed=()) -> None:
+        with self._lock:
+            owners_of, dirty = self._owners, self._dirty
+            for thash in added:
+                owners = owners_of.setdefault(thash, set())
+                if client in owners:
+                    continue
+                owners.add(client)
+                for owner in owners:
+                    dirty.setdefault(owner, set()).add(thash)
+            for thash in removed:
+                owners = owners_of.get(thash)
+                if not owners or client not in owners:
+                    continue
+                owners.discard(client)
+                for owner in owners:
+                    dirty.setdefault(owner, set()).add(thash)
+                if not owners:
+                    del owners_of[thash]
+
+    def forget(self, client: str) -> None:
+        """el cliente deja de contar (p.ej. antes de recargar su estado entero)"""
+        with self._lock:
+            hashes = [thash for thash, owners in self._owners.items() if client in owners]
+        self.update(client, removed=hashes)
+        with self._lock:
+            self._dirty.pop(client, None)
+
+    def take_dirty(self, client: str) -> set[str]:
+        """hashes del cliente cuyos dueños han cambiado desde la ultima llamada"""
+        with self._lock:
+            return self._dirty.pop(client, set())
+
+    def dupes(self, hashes) -> set[str]:
+        """los de hashes que estan en mas de un cliente"""
+        with self._lock:
+            owners_of = self._owners
+            return {thash for thash in hashes if len(owners_of.get(thash, ())) > 1}
@@ -0,0 +1,105 @@
+from typing import NamedTuple
+
+_NO_HASHES: tuple[str, ...] = ()
+
+
+class SyncEvents(NamedTuple):
+    """
+    Lo que ha traido un sync, sacado en la misma pasada en que se aplica el delta al estado:
+    torrents nuevos, borrados, y para cada torrent del delta los campos que han cambiado (los nuevos traen todos)
+    """
+    added: tuple[str, ...] = _NO_HASHES
+    removed: tuple[str, ...] = _NO_HASHES
+    changed: dict[str, frozenset[str]] = {}
+    tags_added: frozenset[str] = frozenset()
+    full_update: bool = False
+
+    @classmethod
+    def local(cls, hashes, fields: frozenset[str] = frozenset({'tags'})) -> "SyncEvents":
+        """cambios hechos por nosotros en el estado local (tags de una pasada de los taggers)"""
+        return cls(changed=dict.fromkeys(hashes, fields))
+
+
+NO_EVENTS: SyncEvents = SyncEvents()
+
+# campos que qBittorrent cambia casi cada segundo: entre el ultimo delta y el full sync siempre se han movido,
+# asi que distintos no quiere decir que un delta se haya perdido. Drift no los cuenta
+VOLATILE_FIELDS: frozenset[str] = frozenset({
+    'time_active', 'seeding_time', 'last_activity', 'dlspeed', 'upspeed', 'eta',
+    'num_seeds', 'num_leechs', 'num_complete', 'num_incomplete', 'availability', 'popularity', 'reannounce',
+    'uploaded', 'uploaded_session', 'downloaded', 'downloaded_session', 'completed', 'amount_left',
+    'progress', 'ratio', 'seen_complete',
+})
+
+
+class Drift(NamedTuple):
+    """
+    Lo que un full sync ha encontrado distinto del estado local, sin los campos de VOLATILE_FIELDS.
+    Con los deltas funcionando deberia ser ~0 (salvo lo que haya cambiado de verdad justo antes del full sync):
+    lo que haya aqui son cambios que los deltas no nos contaron (o campos que qBittorrent no manda en los deltas)
+    """
+    time: float = 0
+    torrents: int = 0                   # torrents que ya teniamos con algun campo distinto
+    added: int = 0
+    removed: int = 0
+    fields: dict[str, int] = {}         # campo -> en cuantos torrents ha cambiado
+
+    @classmethod
+    def measure(cls, events: SyncEvents, when: float) -> "Drift":
+        added = set(events.added)
+        fields: dict[str, int] = {}
+        torrents = 0
+        for thash, changed in events.changed.items():
+            if thash in added:
+                continue
+            changed = changed - VOLATILE_FIELDS
+            if not changed:
+                continue
+            torrents += 1
+            for field in changed:
+                fields[field] = fields.get(field, 0) + 1
+        return cls(when, torrents, len(events.added), len(events.removed), fields)
+
+
+class EventBus:
+    """
+    Reparte los torrents cambiados entre los consumidores segun los campos a los que se suscriben.
+    publish() recorre el delta una sola vez, tenga los suscriptores que tenga: la ruta de cada
+    combinacion de campos se calcula una vez y se memoiza (casi todos los torrents traen las mismas)
+    """
+
+    def __init__(self) -> None:
+        self._subscriptions: dict[str, frozenset[str]] = {}
+        self._routes: dict[frozenset[str], tuple[str, ...]] = {}
+        self._batches: dict[str, list[str]] = {}
+
+    def subscribe(self, name: str, fields) -> None:
+        """name recibe los torrents con algun cambio en fields. sin fields, todos los cambios"""
+        self._subscriptions[name] = frozenset(fields)
+        self._routes.clear()
+
+    def _route(self, fields: frozenset[str]) -> tuple[str, ...]:
+        route = self._routes.get(fields)
+        if route is None:
+            route = self._routes[fields] = tuple(
+                name for name, watched in self._subscriptions.items() if not watched or not watched.isdisjoint(fields)
+            )
+        return route
+
+    def publish(self, events: SyncEvents) -> None:
+        batches: dict[str, list[str]] = {name: [] for name in self._subscriptions}
+        routes = self._routes
+        for thash, fields in events.changed.items():
+            route = routes.get(fields)
+            if route is None:
+                route = self._route(fields)
+            for name in route:
+                batches[name].append(thash)
+        self._batches = batches
+
+    def batch(self, name: str) -> list[str]:
+        """hashes que le tocan a name en lo ultimo publicado"""
+        return self._batches.get(name, [])
+
+    def clear(self) -> None:
+        self._batches = {}
@@ -0,0 +1,181 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import logger
+from .snapshot import write_snapshot, read_snapshot
+
+# lo que hace que la lista guardada ya no valga: si cambia, qBittorrent ha movido o renombrado el torrent
+KEY_FIELDS: frozenset[str] = frozenset({'save_path', 'content_path', 'name'})
+
+# separador de los nombres guardados: no puede aparecer en una ruta
+_SEP: str = '\0'
+
+
+def filelists_path(state_dir: str, name: str) -> str:
+    return os.path.join(state_dir, f"{name}.filelists")
+
+
+def _key(torrent) -> tuple[str, str, str]:
+    return (torrent.get('save_path', ''), torrent.get('content_path', ''), torrent.get('name', ''))
+
+
+class FileListCache:
+    """
+    Ficheros de cada torrent (torrents/files, rutas relativas a save_path) guardados por hash en state_dir.
+    La lista de un torrent casi nunca cambia: solo se vuelve a pedir si el delta trae cambios de save_path,
+    content_path o name (invalidate), si no coincide con la que se guardo o si quien la pide ve en el disco ficheros
+    que no explica (fetch(unlisted=...): renombrar un fichero dentro del torrent no cambia ninguno de esos campos).
+    Los que siguen sin explicar con la lista recien pedida se apuntan por torrent: son huerfanos de verdad (en dry-run
+    no se mueven) y no se vuelve a pedir hasta que cambien. Lo que falta se lee del BT_backup
+    (local, un btbackup.BTBackup) si lo hay, y lo que tampoco este ahi se pide a la WebUI en paralelo.
+    Cada lista se guarda como una sola cadena con los nombres separados por '\\0': un objeto por torrent en el pickle
+    """
+
+    def __init__(self, client, path: str | None = None, workers: int = 8, name: str = '', local=None) -> None:
+        self.client = client
+        self.local = local
+        self.path: str | None = path
+        self.workers: int = max(1, int(workers))
+        self.name: str = name
+        self._cache: dict[str, tuple[tuple[str, str, str], str]] = {}
+        self._confirmed: dict[str, frozenset[str]] = {}     # hash -> ficheros que su lista recien pedida no explicaba
+        self._lock: threading.Lock = threading.Lock()
+        self._loaded: bool = False
+        self._dirty: bool = False
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.path is None:
+            return
+        payload = read_snapshot(self.path)
+        if payload is None:
+            return
+        with self._lock:
+            self._cache.update(payload.get('lists', {}))
+            self._confirmed.update(payload.get('confirmed', {}))
+        logger.debug(f"{self.name:<10} - {len(self._cache)} torrent file lists loaded")
+
+    def save(self) -> int:
+        """escribe la cache si ha cambiado. devuelve los bytes escritos"""
+        if self.path is None or not self._dirty:
+            return 0
+        with self._lock:
+            lists, confirmed = dict(self._cache), dict(self._confirmed)
+            self._dirty = False
+        return write_snapshot(self.path, {'lists': lists, 'confirmed': confirmed})
+
+    def invalidate(self, hashes) -> None:
+        with self._lock:
+            for thash in hashes:
+                self._confirmed.pop(thash, None)
+                if self._cache.pop(thash, None) is not None:
+                    self._dirty = True
+
+    def retain(self, hashes) -> None:
+        """se olvida de los torrents que ya no estan (borrados con tagWorker parado)"""
+        keep = set(hashes)
+        with self._lock:
+            gone = [thash for thash in self._cache if thash not in keep]
+            for thash in gone:
+                del self._cache[thash]
+                self._confirmed.pop(thash, None)
+            if gone:
+                self._dirty = True
+
+    def _get(self, thash: str):
+        try:
+            return thash, self.client.file_names(thash)
+        except Exception as e:
+            logger.warning(f"{self.name:<10} - unable to fetch files for {thash}: {e}")
+            return thash, None
+
+    def _get_many(self, hashes: list[str]) -> list:
+        # cliente asincrono (aio.BridgedQBit): todas las peticiones en el loop, acotadas por su semaforo
+        fetched = []
+        for thash, names in self.client.file_names_many(hashes).items():
+            if isinstance(names, Exception):
+                logger.warning(f"{self.name:<10} - unable to fetch files for {thash}: {names}")
+                names = None
+            fetched.append((thash, names))
+        return fetched
+
+    def _stale(self, thash: str, names, unlisted) -> bool:
+        """si hay ficheros que la lista no explica y no son los que ya quedaron la ultima vez que se pidio"""
+        extra: frozenset[str] = unlisted(thash, names)
+        with self._lock:
+            if not extra:
+                if self._confirmed.pop(thash, None) is not None:
+                    self._dirty = True
+                return False
+            return extra != self._confirmed.get(thash)
+
+    def fetch(self, torrents: dict, unlisted=None) -> dict[str, list[str]]:
+        """
+        hash -> nombres de sus ficheros (relativos a save_path) para los torrents dados. los que fallan no aparecen.
+        unlisted(hash, nombres): los ficheros en disco que la lista no explica si parece que ya no vale (vacio si cuadra)
+        """
+        self.load()
+        result: dict[str, list[str]] = {}
+        missing: list[str] = []
+        with self._lock:
+            for thash, torrent in torrents.items():
+                cached = self._cache.get(thash)
+                if cached is not None and cached[0] == _key(torrent):
+                    result[thash] = cached[1].split(_SEP) if cached[1] else []
+                else:
+                    missing.append(thash)
+        if unlisted is not None:
+            outdated = [thash for thash, names in result.items() if self._stale(thash, names, unlisted)]
+            for thash in outdated:
+                del result[thash]
+            missing += outdated
+            if outdated:
+                logger.debug(f"{self.name:<10} - file lists: {len(outdated)} cached lists don't match the disk")
+
+        if not missing:
+            return result
+
+        fetched: list[tuple[str, list[str] | None]] = []
+        remote: list[str] = missing
+        if self.local is not None:
+            remote = []
+            for thash in missing:
+                local = self.local.torrent(thash)
+                # un .fastresume que aun no se ha reescrito tras mover o renombrar no vale: a la WebUI
+                if (local is None or local.save_path.rstrip('/\\') != torrents[thash].get('save_path', '').rstrip('/\\')
+                        or (unlisted is not None and self._stale(thash, local.names, unlisted))):
+                    remote.append(thash)
+                else:
+                    fetched.append((thash, local.names))
+            logger.debug(f"{self.name:<10} - file lists: {len(fetched)} read from BT_backup")
+
+        if remote and hasattr(self.client, 'file_names_many'):
+            fetched += self._get_many(remote)
+        elif len(remote) == 1:
+            fetched.append(self._get(remote[0]))
+        elif remote:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(remote)), thread_name_prefix=f"files-{self.name}") as pool:
+                fetched += pool.map(self._get, remote)
+
+        for thash, names in fetched:
+            if names is None:
+                continue
+            names = list(names)
+            # lo que la lista recien pedida tampoco explica es huerfano: no se vuelve a pedir por ello
+            extra: frozenset[str] = unlisted(thash, names) if unlisted is not None else frozenset()
+            with self._lock:
+                self._cache[thash] = (_key(torrents[thash]), _SEP.join(names))
+                if extra:
+                    self._confirmed[thash] = extra
+                else:
+                    self._confirmed.pop(thash, None)
+                self._dirty = True
+            result[thash] = names
+        logger.debug(f"{self.name:<10} - file lists: {len(torrents) - len(missing)} cached, {len(remote)} fetched")
+        return result
@@ -1,7 +1,9 @@
 import os
+import re
 import time
-from collections import defaultdict
+import fnmatch
 from .logger import logger
+from .inodes import InodeIndex
 
 def is_file(content_path):
     if os.path.isdir(content_path):
@@ -18,55 +20,216 @@ def translate_path(fullpath: str, translation_table: dict) -> str:
             break
     return os.path.normpath(path)
 
-def move_to_dir(root_path, orphaned_path, file):
+class IgnoreMatcher:
+    """
+    orphaned_ignored compilado una vez en una sola regex contra la ruta relativa a root (separada por /).
+    Mismas reglas que el fnmatch de antes sobre la ruta absoluta: '*' tambien cruza '/'.
+    Un directorio se poda si lo ignora algun patron o si un 'dir/*' ignora todo lo que tiene dentro
+    """
+
+    def __init__(self, root: str, patterns) -> None:
+        rels: list[str] = [
+            os.path.relpath(os.path.abspath(os.path.join(root, pattern)), root).replace(os.sep, '/')
+            for pattern in patterns
+        ]
+        # fnmatch compara con normcase: sin distinguir mayusculas en windows
+        flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+        self._file = self._compile(rels, flags)
+        self._dir = self._compile(rels + [rel[:-2] for rel in rels if rel.endswith('/*')], flags)
+
+    @staticmethod
+    def _compile(patterns: list[str], flags: int):
+        if not patterns:
+            return None
+        return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns), flags).match
+
+    def ignores_file(self, rel: str) -> bool:
+        return self._file is not None and self._file(rel) is not None
+
+    def prunes_dir(self, rel: str) -> bool:
+        return self._dir is not None and self._dir(rel) is not None
+
+
+def scan_files(root: str, ignore: IgnoreMatcher | None = None, skip: str | None = None, rel: str = '', recursive: bool = True) -> set[str]:
+    """
+    Ficheros bajo root (rutas absolutas normalizadas) que no ignora ignore.
+    Recorrido con os.scandir: el tipo sale del DirEntry sin otro stat, la ruta relativa para los patrones
+    se va construyendo por el camino, y no se entra en directorios podados ni en los que empiezan por skip.
+    Como os.walk, los enlaces a directorios no se siguen y los directorios ilegibles se saltan.
+    rel es la ruta de root relativa a la de los patrones (para recorrer un shard de scan.ShardedScanner)
+    """
+    root = os.path.abspath(root)
+    file_ignored = ignore._file if ignore is not None else None
+    dir_pruned = ignore._dir if ignore is not None else None
+    found: set[str] = set()
+    stack: list[tuple[str, str]] = [(root, rel)]
+    while stack:
+        path, rel = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    entry_rel = rel + entry.name
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if entry.is_symlink():
+                            continue
+                        if skip is not None and entry.path.startswith(skip):
+                            continue
+                        if dir_pruned is not None and dir_pruned(entry_rel) is not None:
+                            continue
+                        if recursive:
+                            stack.append((entry.path, entry_rel + '/'))
+                    elif file_ignored is None or file_ignored(entry_rel) is None:
+                        found.add(entry.path)
+        except OSError:
+            continue
+    return found
+
+
+def move_to_dir(root_path, orphaned_path, file, journal=None) -> str | None:
+    """mueve file a la misma ruta relativa bajo orphaned_path y lo apunta en journal (un quarantine.QuarantineJournal) si lo hay"""
     if file.startswith(root_path):
         rel_path = file[len(root_path):]
         new_path = os.path.join(orphaned_path, rel_path.strip('\\').strip('/'))
         try:
+            # lstat: un enlace simbolico roto tambien se mueve. si falla, se apunta sin tamaño
+            try:
+                size = os.lstat(file).st_size
+            except OSError:
+                size = 0
             os.makedirs(os.path.dirname(new_path), exist_ok=True)
             os.rename(file, new_path)
-            os.utime(new_path, (time.time(), time.time()))
+            # la hora de entrada tambien en el mtime: sin diario (o si se pierde) prune se guia por el
+            now = time.time()
+            try:
+                os.utime(new_path, (now, now), follow_symlinks=False)
+            except (OSError, NotImplementedError):
+                # ya esta movido: sin el mtime solo pierde la hora si se pierde el diario
+                pass
+            if journal is not None:
+                journal.record(file, new_path, size, now)
+            return new_path
         except Exception as e:
             logger.error(f'Error: {e}')
     else:
         logger.info(f"Path for {file} not in {root_path}")
+    return None
 
-def build_inode_map(path):
-    inode_map: defaultdict[int, int] = defaultdict(int)
+def _walk_files(path: str, recursive: bool = True):
+    """DirEntry de los ficheros bajo path (scandir, sin seguir enlaces a directorios, saltando los ilegibles)"""
+    stack: list[str] = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        yield entry
+                    elif recursive and not entry.is_symlink():
+                        stack.append(entry.path)
+        except OSError:
+            continue
 
-    for dirpath, _, filenames in os.walk(path):
-        for name in filenames:
-            fullpath = os.path.join(dirpath, name)
-            try:
-                stat_path = os.stat(fullpath)
-                inode = stat_path.st_ino
-                inode_map[inode] += 1
-            except FileNotFoundError:
-                pass
-    return inode_map
 
-def file_has_outer_links(path, inode_map):
+def count_inodes(path, recursive: bool = True, index: InodeIndex | None = None, group: int = 0) -> InodeIndex:
+    """(dispositivo, inodo, nlink) de cada fichero bajo path a index (uno nuevo si no se pasa), sin construirlo (build)"""
+    if index is None:
+        index = InodeIndex()
+    for entry in _walk_files(path, recursive):
+        try:
+            # como el os.stat de antes: de un enlace cuenta el fichero al que apunta
+            st = os.stat(entry.path) if entry.is_symlink() else entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        index.add(st.st_dev, st.st_ino, st.st_nlink, group)
+    return index
+
+
+def files_older_than(path, time_limit: float, recursive: bool = True) -> set[str]:
+    old: set[str] = set()
+    for entry in _walk_files(path, recursive):
+        try:
+            if entry.stat().st_mtime < time_limit:
+                old.add(entry.path)
+        except OSError:
+            pass
+    return old
+
+
+def build_inode_map(path, scanner=None) -> InodeIndex:
+    """inodes.InodeIndex de todo path. con un scan.ShardedScanner, por shards en paralelo"""
+    if scanner is None:
+        return count_inodes(path).build()
+    inode_map = InodeIndex()
+    for partial in scanner.run(path, lambda shard: count_inodes(shard.path, shard.recursive), label='inodes'):
+        inode_map.update(partial)
+    return inode_map.build()
+
+def file_has_outer_links(path, inode_map: InodeIndex):
     try:
         stat = os.stat(path)
-        in_count = inode_map[stat.st_ino]
-        return stat.st_nlink > in_count
+        return inode_map.has_outer_links(stat.st_dev, stat.st_ino, stat.st_nlink)
     except FileNotFoundError:
         return False
 
-def remove_empty_dirs(path, dryrun=True, iname=''):
-    # $ find $ROOT_FOLDER -type d -empty -delete
-    if not os.path.isdir(path):
-        return
-
+def _remove_empty(path, dryrun, done):
+    # done: (path, error) en el orden de siempre, para sacarlos al log despues
     for name in os.listdir(path):
         fullpath = os.path.join(path, name)
         if os.path.isdir(fullpath):
-            remove_empty_dirs(fullpath, dryrun, iname)
+            _remove_empty(fullpath, dryrun, done)
 
     # Después de eliminar los posibles subdirectorios vacíos, comprobamos si el actual está vacío
     if not os.listdir(path):
         try:
             if not dryrun: os.rmdir(path)
-            logger.info(f"{iname:<10} - Removed empty dir: {path}")
+            done.append((path, None))
         except OSError as e:
-            logger.warning(f"{iname:<10} - Error deleting {path}: {e}")
+            done.append((path, e))
+
+def remove_empty_dirs(path, dryrun=True, iname='', scanner=None, result=None):
+    # $ find $ROOT_FOLDER -type d -empty -delete
+    if not os.path.isdir(path):
+        return
+
+    done = []
+    if result is not None and result.covers(path):
+        # candidatos del scan.ScanResult de la pasada; antes de borrar se comprueba en disco que sigue vacio
+        for fullpath in result.empty_dirs(path, cascade=not dryrun):
+            try:
+                if os.listdir(fullpath):
+                    continue
+                if not dryrun: os.rmdir(fullpath)
+                done.append((fullpath, None))
+            except OSError as e:
+                done.append((fullpath, e))
+    elif scanner is None:
+        _remove_empty(path, dryrun, done)
+    else:
+        # cada directorio de primer nivel en su shard; root al final, cuando ya se sabe si ha quedado vacio
+        def shard_empty(shard):
+            shard_done = []
+            if shard.recursive:
+                _remove_empty(shard.path, dryrun, shard_done)
+            return shard_done
+        for shard_done in scanner.run(path, shard_empty, label='empty dirs'):
+            done.extend(shard_done)
+        if not os.listdir(path):
+            try:
+                if not dryrun: os.rmdir(path)
+                done.append((path, None))
+            except OSError as e:
+                done.append((path, e))
+
+    for fullpath, error in done:
+        if error is None:
+            logger.info(f"{iname:<10} - Removed empty dir: {fullpath}")
+        else:
+            logger.warning(f"{iname:<10} - Error deleting {fullpath}: {error}")
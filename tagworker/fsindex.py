@@ -0,0 +1,294 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import NamedTuple
+
+from .logger import logger
+from .scan import FileStat, ScanResult, list_dir, visible_dirs, empty_dirs, older_than
+from .inodes import InodeIndex
+
+# se sube si cambia el esquema: un indice de otra version se tira y se rehace
+INDEX_VERSION: int = 1
+
+# un directorio tocado hace menos de esto puede cambiar otra vez sin que se note en su mtime
+# (resolucion del sistema de ficheros): no nos fiamos y se vuelve a listar la proxima vez
+_RACY_NS: int = 2_000_000_000
+_UNTRUSTED: int = -1
+
+_SCHEMA: tuple[str, ...] = (
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER)",
+    "CREATE TABLE IF NOT EXISTS files (dir TEXT, name TEXT, dev INTEGER, ino INTEGER, nlink INTEGER, size INTEGER, mtime REAL, PRIMARY KEY (dir, name))",
+)
+
+
+def _under(path: str) -> tuple[str, str]:
+    # rango de claves de todo lo que cuelga de path: de 'path/' hasta el caracter siguiente al separador
+    return path + os.sep, path + chr(ord(os.sep) + 1)
+
+
+class RefreshStats(NamedTuple):
+    dirs: int = 0           # directorios comprobados (un stat cada uno)
+    rescanned: int = 0      # los que habia que volver a listar
+    files: int = 0          # ficheros de esos directorios (stat cada uno)
+    removed: int = 0        # directorios que ya no existen
+    seconds: float = 0
+
+
+class _Listing(NamedTuple):
+    path: str
+    parent: str | None
+    mtime_ns: int
+    subdirs: list[str]
+    files: list[tuple]
+
+
+class FileIndex:
+    """
+    Indice persistente (SQLite, en state_dir) de los ficheros bajo root: inodo, nlink, tamaño y mtime.
+    refresh() hace un stat por directorio y solo vuelve a listar (y a hacer stat de sus ficheros) los que han
+    cambiado de mtime: crear, borrar o renombrar algo dentro cambia el mtime del directorio.
+    Lo que NO cambia el mtime del directorio es modificar un fichero ya existente o crearle un hardlink desde
+    fuera: size, mtime y sobre todo nlink pueden estar viejos. Quien necesite el nlink de verdad (noHL) hace stat
+    del fichero; del indice solo se fia para saber que hay y cuantas veces aparece cada inodo
+    """
+
+    def __init__(self, path: str, root: str, scanner=None, name: str = '') -> None:
+        self.path: str = path
+        self.root: str = os.path.abspath(root)
+        self.scanner = scanner
+        self.name: str = name
+        self.last: RefreshStats = RefreshStats()
+        self._lock: threading.Lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is not None:
+            return self._db
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            db.execute(statement)
+        meta = dict(db.execute("SELECT key, value FROM meta"))
+        if meta.get('version') != str(INDEX_VERSION) or meta.get('root') != self.root:
+            if meta:
+                logger.info(f"{self.name:<10} - file index for a different root or version. rebuilding")
+            db.execute("DELETE FROM dirs")
+            db.execute("DELETE FROM files")
+            db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", (('version', str(INDEX_VERSION)), ('root', self.root)))
+            db.commit()
+        self._db = db
+        return db
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # ------------------------------------------------------------------ refresh
+
+    def _list(self, path: str, parent: str | None, mtime_ns: int, racy_limit: int) -> _Listing:
+        subdirs, stats = list_dir(path)
+        files = [(path, name, *st) for name, st in stats.items()]
+        return _Listing(path, parent, mtime_ns if mtime_ns < racy_limit else _UNTRUSTED, subdirs, files)
+
+    def _walk(self, top: str, parent: str | None, recursive: bool, known: dict, children: dict, racy_limit: int):
+        """los directorios cambiados bajo top (listados) y los que ya no existen. solo lee del disco"""
+        listings: list[_Listing] = []
+        gone: list[str] = []
+        checked = 0
+        stack: list[tuple[str, str | None]] = [(top, parent)]
+        while stack:
+            path, parent = stack.pop()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                gone.append(path)
+                continue
+            checked += 1
+            previous = known.get(path)
+            if previous is not None and previous == mtime_ns:
+                subdirs = children.get(path, ())
+            else:
+                try:
+                    listing = self._list(path, parent, mtime_ns, racy_limit)
+                except OSError:
+                    continue
+                listings.append(listing)
+                subdirs = listing.subdirs
+                gone.extend(set(children.get(path, ())) - set(subdirs))
+            if recursive:
+                stack.extend((subdir, path) for subdir in subdirs)
+        return checked, listings, gone
+
+    def refresh(self) -> RefreshStats:
+        """pone el indice al dia con el disco. trabajo: un stat por directorio + lo que haya cambiado"""
+        start = time.perf_counter()
+        racy_limit = time.time_ns() - _RACY_NS
+        with self._lock:
+            db = self._connect()
+            known: dict[str, int] = {}
+            children: dict[str, list[str]] = {}
+            for path, parent, mtime_ns in db.execute("SELECT path, parent, mtime_ns FROM dirs"):
+                known[path] = mtime_ns
+                if parent is not None:
+                    children.setdefault(parent, []).append(path)
+
+        if not os.path.isdir(self.root):
+            results = [(0, [], [self.root])]
+        elif self.scanner is None:
+            results = [self._walk(self.root, None, True, known, children, racy_limit)]
+        else:
+            # root sin bajar (su listado dice que directorios de primer nivel se han ido) y cada uno en su shard
+            results = self.scanner.run(self.root, lambda shard: self._walk(
+                shard.path, None if not shard.recursive else self.root, shard.recursive, known, children, racy_limit,
+            ), label='file index')
+
+        checked = rescanned = files = 0
+        with self._lock:
+            db = self._connect()
+            with db:
+                for shard_checked, listings, gone in results:
+                    checked += shard_checked
+                    for path in gone:
+                        low, high = _under(path)
+                        db.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (path, low, high))
+                        db.execute("DELETE FROM files WHERE dir = ? OR (dir >= ? AND dir < ?)", (path, low, high))
+                    for listing in listings:
+                        rescanned += 1
+                        files += len(listing.files)
+                        db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (listing.path, listing.parent, listing.mtime_ns))
+                        db.execute("DELETE FROM files WHERE dir = ?", (listing.path,))
+                        db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", listing.files)
+        removed = sum(len(gone) for _, _, gone in results)
+        self.last = RefreshStats(checked, rescanned, files, removed, time.perf_counter() - start)
+        logger.debug(f"{self.name:<10} - file index: {checked} dirs checked, {rescanned} rescanned ({files} files), "
+                     f"{removed} gone in {self.last.seconds:.2f}s")
+        return self.last
+
+    # ------------------------------------------------------------------ consultas
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def _stream(self, sql: str, params: tuple = (), size: int = 10000):
+        """las filas de sql poco a poco, sin tenerlas todas en memoria"""
+        with self._lock:
+            cursor = self._connect().execute(sql, params)
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(size)
+            if not rows:
+                return
+            yield from rows
+
+    def _executemany(self, sql: str, rows: list) -> None:
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.executemany(sql, rows)
+
+    def result(self) -> "IndexResult":
+        """el indice como un scan.ScanResult que se consulta en SQLite segun se necesita, sin cargarlo entero"""
+        return IndexResult(self)
+
+
+class IndexResult(ScanResult):
+    """
+    Un scan.ScanResult que no carga nada: cada consulta va al indice y lee solo lo suyo (una clave, un rango de
+    rutas, o todas las filas en streaming para los inodos y los huerfanos), sin un FileStat por fichero en memoria.
+    Lo unico que se carga entero es el arbol de directorios, y solo para huerfanos y directorios vacios.
+    nlink y mtime son los del indice (nlink_fresh False). discard() quita la fila (el fichero ya no esta)
+    antes de la siguiente consulta
+    """
+
+    def __init__(self, index: FileIndex) -> None:
+        super().__init__(index.root, nlink_fresh=False)
+        self._index: FileIndex = index
+        self._discarded: list[tuple[str, str]] = []     # (dir, name) a borrar del indice antes de la siguiente consulta
+
+    def _apply_discarded(self) -> None:
+        # todos los discard() de una tarea en una sola transaccion
+        if self._discarded:
+            discarded, self._discarded = self._discarded, []
+            self._index._executemany("DELETE FROM files WHERE dir = ? AND name = ?", discarded)
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        self._apply_discarded()
+        return self._index._query(sql, params)
+
+    def _stream(self, sql: str, params: tuple = ()):
+        self._apply_discarded()
+        return self._index._stream(sql, params)
+
+    def __len__(self) -> int:
+        return self._query("SELECT COUNT(*) FROM files")[0][0]
+
+    def _children(self, top: str | None = None) -> dict[str, list[str]]:
+        if top is None:
+            rows = self._query("SELECT path, parent FROM dirs")
+        else:
+            rows = self._query("SELECT path, parent FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (top, *_under(top)))
+        children: dict[str, list[str]] = {}
+        for path, parent in rows:
+            children.setdefault(path, [])
+            if parent is not None:
+                children.setdefault(parent, []).append(path)
+        return children
+
+    def is_dir(self, path: str) -> bool:
+        return bool(self._query("SELECT 1 FROM dirs WHERE path = ?", (path,)))
+
+    def stat(self, path: str) -> FileStat | None:
+        directory, name = os.path.split(path)
+        rows = self._query("SELECT dev, ino, nlink, size, mtime FROM files WHERE dir = ? AND name = ?", (directory, name))
+        return FileStat(*rows[0]) if rows else None
+
+    def discard(self, path: str) -> None:
+        self._discarded.append(os.path.split(path))
+
+    def walk_files(self, top: str):
+        rows = self._query(
+            "SELECT dir, name, dev, ino, nlink, size, mtime FROM files WHERE dir = ? OR (dir >= ? AND dir < ?)", (top, *_under(top)),
+        )
+        join = os.path.join
+        for directory, name, *st in rows:
+            yield join(directory, name), FileStat(*st)
+
+    def inode_index(self) -> InodeIndex:
+        index = InodeIndex()
+        add = index.add
+        for dev, ino, nlink in self._stream("SELECT dev, ino, nlink FROM files"):
+            add(dev, ino, nlink)
+        return index.build()
+
+    def scan_files(self, ignore=None, skip: str | None = None) -> set[str]:
+        file_ignored = ignore._file if ignore is not None else None
+        visible = visible_dirs(self.root, self._children(), ignore, skip)
+        found: set[str] = set()
+        join = os.path.join
+        for directory, name in self._stream("SELECT dir, name FROM files"):
+            rel = visible.get(directory)
+            if rel is not None and (file_ignored is None or file_ignored(rel + name) is None):
+                found.add(join(directory, name))
+        return found
+
+    def files_older_than(self, path: str, time_limit: float) -> set[str]:
+        top = os.path.abspath(path)
+        rows = self._query(
+            "SELECT dir, name, mtime FROM files WHERE (dir = ? OR (dir >= ? AND dir < ?)) AND mtime < ?", (top, *_under(top), time_limit),
+        )
+        # el mtime del indice puede ser viejo (un fichero reescrito no cambia el de su directorio): se confirma en disco
+        return {fullpath for fullpath in (os.path.join(directory, name) for directory, name, _ in rows) if older_than(fullpath, time_limit)}
+
+    def empty_dirs(self, path: str, cascade: bool = True) -> list[str]:
+        top = os.path.abspath(path)
+        with_files = {directory for directory, in self._query(
+            "SELECT DISTINCT dir FROM files WHERE dir = ? OR (dir >= ? AND dir < ?)", (top, *_under(top)),
+        )}
+        return empty_dirs(top, self._children(top), with_files, cascade)
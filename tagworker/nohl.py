@@ -0,0 +1,81 @@
+import os
+import threading
+
+from .scan import FileStat, ScanResult
+from .inodes import InodeIndex
+
+
+def _disk_nlink(path: str) -> int | None:
+    try:
+        return os.stat(path).st_nlink
+    except OSError:
+        return None
+
+
+class NoHLTracker:
+    """
+    Para cada torrent con enlace fuera de root, el fichero donde se encontro. La siguiente pasada mira primero ese
+    (un lookup, mas un stat si el nlink es del indice): si lo sigue teniendo, ya esta, sin recorrer el resto.
+    Los que no tienen enlace fuera no se guardan: un hardlink nuevo desde fuera no cambia nada dentro de root
+    (ni el mtime del directorio), asi que hay que evaluarlos siempre. La evaluacion para en el primer enlace de fuera
+    """
+
+    def __init__(self) -> None:
+        self._outer: dict[str, tuple[str, str]] = {}    # hash -> (content_path con el que se evaluo, fichero con enlace fuera)
+        self._lock: threading.Lock = threading.Lock()
+        self.evaluated: int = 0     # de la ultima pasada: torrents evaluados
+        self.reused: int = 0        # y los que ha bastado con el fichero de la vez anterior
+        self.stats: int = 0         # stat en disco
+
+    def reset_counters(self) -> None:
+        self.evaluated = self.reused = self.stats = 0
+
+    def forget(self, hashes) -> None:
+        with self._lock:
+            for thash in hashes:
+                self._outer.pop(thash, None)
+
+    def retain(self, hashes) -> None:
+        keep = set(hashes)
+        with self._lock:
+            for thash in [thash for thash in self._outer if thash not in keep]:
+                del self._outer[thash]
+
+    def _has_outer_links(self, path: str, st: FileStat, fresh: bool, inode_map: InodeIndex) -> bool:
+        if fresh:
+            nlink = st.nlink
+        else:
+            self.stats += 1
+            nlink = _disk_nlink(path)
+            if nlink is None:
+                return False
+        return nlink > inode_map.count(st.dev, st.ino)
+
+    def has_HL(self, thash: str, path: str, result: ScanResult, inode_map: InodeIndex) -> bool | None:
+        """
+        Si el torrent de content_path path (ya traducido) tiene algun enlace fuera de root.
+        None si la pasada no tiene path (fuera de root, bajo un enlace a directorio o no existe): se mira en disco
+        """
+        st = result.stat(path)
+        if st is None and not result.is_dir(path):
+            return None
+        fresh: bool = result.nlink_fresh
+        with self._lock:
+            previous = self._outer.get(thash)
+
+        # el que tenia enlace fuera la ultima vez
+        if previous is not None and previous[0] == path:
+            outer_st = result.stat(previous[1])
+            if outer_st is not None and self._has_outer_links(previous[1], outer_st, fresh, inode_map):
+                self.reused += 1
+                return True
+
+        self.evaluated += 1
+        files = [(path, st)] if st is not None else result.walk_files(path)
+        outer: str | None = next((fullpath for fullpath, file_st in files if self._has_outer_links(fullpath, file_st, fresh, inode_map)), None)
+        with self._lock:
+            if outer is None:
+                self._outer.pop(thash, None)
+            else:
+                self._outer[thash] = (path, outer)
+        return outer is not None
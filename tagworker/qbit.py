@@ -1,77 +1,164 @@
 import os
+import time
 import qbittorrentapi
 
 from .files import is_file
-
-def deep_merge(target, source):
-    for key, value in source.items():
-        if isinstance(value, dict):
-            # Si el valor es un diccionario, hacemos una fusión recursiva
-            node = target.setdefault(key, {})
-            deep_merge(node, value)
-        else:
-            # Si no es diccionario, actualizamos el valor en el target
-            target[key] = value
-            # if value is None or value == '':
-            #     print(f'Valor vacio para clave {key}')
-    return target
+from .state import TorrentStore
+from .events import SyncEvents, NO_EVENTS, Drift
+from .snapshot import write_snapshot, read_snapshot
+from . import columnar
 
 class qBit(qbittorrentapi.Client):
-    def __init__(self, url, user, pwd):
-        super().__init__(host=url, username=user, password=pwd)
+    def __init__(self, url, user, pwd, pool_size=10, numeric=False, timeout=None):
+        # pool de conexiones del tamaño de las peticiones concurrentes que vamos a lanzar
+        # timeout: un cliente caido corta la peticion en vez de colgar su hilo
+        super().__init__(host=url, username=user, password=pwd,
+                         HTTPADAPTER_ARGS={'pool_connections': pool_size, 'pool_maxsize': pool_size},
+                         REQUESTS_ARGS={'timeout': timeout} if timeout else None)
+        self.__url = url
         self.__rid = None
+        self.__full_update_time = 0
         self.__sync_data = None
+        self.__events = NO_EVENTS
+        self.__drift = Drift()
+        # numeric: copia los campos numericos a arrays de numpy (si esta instalado) para los taggers vectorizados
+        self.__torrents = TorrentStore(columnar.NumericColumns() if numeric and columnar.available() else None)
         self.__state = dict()
 
     @property
     def synced(self):
         return self.__rid is not None
 
+    @property
+    def full_update_time(self):
+        # ultima vez que el servidor nos mando el estado completo
+        return self.__full_update_time
+
     @property
     def torrentdict(self):
-        return self.__state.get('torrents', {})
+        return self.__torrents.table()
+
+    def tags_of(self, thash):
+        return self.__torrents.tags_of(thash)
+
+    def torrent_rows(self, hashes, *fields):
+        return self.__torrents.rows(hashes, *fields)
+
+    def torrent_frame(self, hashes):
+        return self.__torrents.frame(hashes)
+
+    def set_local_tags(self, thash, tags):
+        return self.__torrents.set_tags(thash, tags)
+
+    def has_tag(self, thash, tag):
+        return self.__torrents.has_tag(thash, tag)
+
+    def torrents_with_tag(self, tag):
+        return self.__torrents.with_tag(tag)
+
+    def torrents_in_category(self, category):
+        return self.__torrents.in_category(category)
 
     @property
     def sync_data(self):
         return self.__sync_data
 
+    @property
+    def events(self):
+        return self.__events
+
+    @property
+    def drift(self):
+        # metrica del ultimo full sync: cuanto se habia desviado el estado local del servidor
+        return self.__drift
+
     @property
     def status(self):
         return self.__state
 
     def do_sync(self, fullsync = False):
-        if fullsync: self.sync.maindata.reset_rid()
-        sync_data = self.sync.maindata.delta()
+        """aplica el siguiente delta de sync/maindata y devuelve lo que ha cambiado (events.SyncEvents)"""
+        # llevamos el rid nosotros (y no sync.maindata) para poder retomarlo desde un snapshot
+        sync_data = self.sync_maindata(rid=0 if fullsync else (self.__rid or 0))
 
         full_update = sync_data.get("full_update", False)
-        # torrents = sync_data.get("torrents", {})
-        torrents_removed = list(sync_data.get("torrents_removed", []))
-        # categories = sync_data.get("categories", {})
-        # categories_removed = sync_data.get("categories_removed", {})
-        # tags = sync_data.get("tags", {})
-        # tags_removed = sync_data.get("tags_removed", {})
-        # server_state = sync_data.server_state
-        # trackers = sync_data.get("trackers")
+        torrents = sync_data.get("torrents", {})
+        torrents_removed = sync_data.get("torrents_removed", [])
 
         self.__sync_data = sync_data
 
+        # una sola pasada por el delta: el store dice que hashes son nuevos o se han ido
+        # y los campos que trae cada torrent son los que han cambiado.
+        # en un full update el store compara con lo que ya tenia y solo cuenta lo que difiere
+        added, removed = [], []
+        # en un full update vienen todos los tags: nuevos son los que no conociamos
+        known_tags = self.__state.get('tags', set()) if full_update else set()
+        if full_update:
+            added, removed, changed = self.__torrents.replace(torrents)
+            self.__state = dict()
+            self.__full_update_time = time.time()
+        else:
+            changed = {thash: frozenset(fields) for thash, fields in torrents.items()}
+            if sync_data:
+                added, removed = self.__torrents.update(torrents, torrents_removed)
+                for thash in self.__torrents.remove_tags(sync_data.get("tags_removed", [])):
+                    changed[thash] = changed.get(thash, frozenset()) | {'tags'}
+        self.__merge_state(sync_data)
+
+        self.__events = SyncEvents(
+            added=tuple(added),
+            removed=tuple(removed),
+            changed=changed,
+            tags_added=frozenset(sync_data.get("tags", [])) - known_tags,
+            full_update=bool(full_update),
+        )
         if full_update:
-            self.__state = sync_data
-        elif sync_data:
-            # this drags obsolete data unless we clean. but we only care about torrents
-            self.__state = deep_merge(self.__state, sync_data)
-            # if 'tags' in sync_data:
-            #     self.__acumulado['tags'] = list(set(self.__acumulado['tags']) | set(sync_data['tags']))
-            # if 'tags_removed' in sync_data:
-            #     self.__acumulado['tags'] = list(set(self.__acumulado['tags']) - set(sync_data['tags_removed']))
-            # if 'categories' in sync_data:
-            #     self.__acumulado['categories'].update(sync_data['categories'])
-            # if 'categories_removed' in sync_data:
-            #     self.__acumulado['categories'] = {cname:cval for cname, cval in self.__acumulado['categories'].items() if cname not in sync_data['categories_removed']}
-            for thash in torrents_removed:
-                self.__state['torrents'].pop(thash, None)
-
-        self.__rid = sync_data.rid
+            self.__drift = Drift.measure(self.__events, self.__full_update_time)
+
+        self.__rid = sync_data['rid']
+        return self.__events
+
+    def save_snapshot(self, path):
+        """guarda estado, indices y rid para arrancar sin full sync. devuelve los bytes escritos (0 si no hay nada)"""
+        if self.__rid is None:
+            return 0
+        return write_snapshot(path, {
+            'url': self.__url,
+            'rid': self.__rid,
+            'full_update_time': self.__full_update_time,
+            'state': self.__state,
+            'torrents': self.__torrents.snapshot(),
+        })
+
+    def load_snapshot(self, path):
+        """
+        Carga un snapshot de save_snapshot. El siguiente do_sync pide el delta desde su rid, pero qBittorrent
+        guarda los rid por sesion de la WebUI (SID) y al arrancar siempre se hace login: casi siempre contesta
+        con full_update. Lo que se ahorra no es la descarga sino el trabajo: replace() compara el full_update
+        con lo restaurado y los taggers solo ven lo que ha cambiado mientras tagWorker estaba parado
+        """
+        payload = read_snapshot(path)
+        if payload is None or payload.get('url') != self.__url:
+            return False
+        self.__torrents.restore(payload['torrents'])
+        self.__state = payload['state']
+        self.__full_update_time = payload['full_update_time']
+        self.__rid = payload['rid']
+        return True
+
+    def __merge_state(self, sync_data):
+        # solo guardamos lo que no son torrents. los torrents viven en el TorrentStore
+        state = self.__state
+        if 'server_state' in sync_data:
+            state.setdefault('server_state', {}).update(sync_data['server_state'])
+        categories = state.setdefault('categories', {})
+        for name, value in sync_data.get('categories', {}).items():
+            categories.setdefault(name, {}).update(value)
+        for name in sync_data.get('categories_removed', []):
+            categories.pop(name, None)
+        tags = state.setdefault('tags', set())
+        tags.update(sync_data.get('tags', []))
+        tags.difference_update(sync_data.get('tags_removed', []))
 
     def login(self):
         try:
@@ -88,19 +175,22 @@ class qBit(qbittorrentapi.Client):
     # @property
     def torrent_files(self, thash):
         # Si es un archivo único, devuelve su ruta
-        torrent = self.__state.get('torrents', {}).get(thash)
+        torrent = self.__torrents.view(thash)
         content_path = torrent.get('content_path', '')
         # FIXME: no aplica translation path, por lo que nunca existe si vamos a buscarlo al disco.
         if is_file(content_path):
             return {content_path}
 
         filelist = set()
-        files = self.torrents_files(thash)
-        for file in files:
+        for name in self.file_names(thash):
             # WARNING windows necesita normalizacion o uniria el path con el filename mediante /
-            filelist.add(os.path.join(torrent.get('save_path'), file.name))
+            filelist.add(os.path.join(torrent.get('save_path'), name))
         return filelist
 
+    def file_names(self, thash):
+        # rutas relativas a save_path de los ficheros del torrent
+        return [file.name for file in self.torrents_files(thash)]
+
     def delete_tags(self, tags):
         self.torrent_tags.delete_tags(tags)
 
@@ -0,0 +1,279 @@
+import os
+import heapq
+import struct
+import threading
+import time
+from typing import NamedTuple
+
+from .logger import logger
+
+# cabecera del fichero: si cambia el formato se sube la version y el diario viejo se rehace desde el disco
+_MAGIC: bytes = b'TWQJ1\n'
+# tipo, hora, tamaño, bytes de la ruta original, bytes de la ruta en cuarentena
+_RECORD = struct.Struct('<cdQII')
+_MOVED: bytes = b'M'
+_GONE: bytes = b'G'     # borrado por prune o restaurado
+
+# registros de ficheros que ya no estan a partir de los que se reescribe el diario
+_COMPACT_MIN: int = 1024
+
+
+def quarantine_path(state_dir: str, name: str) -> str:
+    return os.path.join(state_dir, f"{name}.quarantine")
+
+
+class QuarantineEntry(NamedTuple):
+    time: float         # cuando se movio a orphaned_path
+    size: int
+    original: str       # donde estaba ('' si se encontro en orphaned_path sin diario)
+    moved: str          # donde esta
+
+
+def _encode(kind: bytes, entry: QuarantineEntry) -> bytes:
+    original, moved = os.fsencode(entry.original), os.fsencode(entry.moved)
+    return _RECORD.pack(kind, entry.time, entry.size, len(original), len(moved)) + original + moved
+
+
+class QuarantineJournal:
+    """
+    Diario de lo que move_to_dir lleva a orphaned_path: un registro binario por fichero movido (ruta original,
+    ruta nueva, tamaño y hora) y otro cuando desaparece, siempre añadidos al final. Se carga en memoria con un
+    heap por hora, asi prune saca solo lo caducado sin recorrer orphaned_path ni hacer un stat por fichero, y
+    restore() devuelve un fichero (o un directorio entero) a su ruta original.
+    Si no hay diario se crea uno con lo que ya haya en orphaned_path, con su mtime como hora (move_to_dir lo pone al mover),
+    y reconcile() hace lo mismo despues con lo que aparezca sin pasar por move_to_dir (a mano, otra instancia, un fallo al apuntar).
+    Un registro a medias (corte al escribir) se descarta al cargar; el diario se reescribe cuando sobra mas de lo que vale
+    """
+
+    def __init__(self, path: str, root: str, name: str = '') -> None:
+        self.path: str = path
+        self.root: str = os.path.abspath(root)
+        self.name: str = name
+        self._entries: dict[str, QuarantineEntry] = {}     # ruta en cuarentena -> entrada
+        self._originals: dict[str, str] = {}                # ruta original -> ruta en cuarentena
+        self._heap: list[tuple[float, str]] = []
+        self._dead: int = 0                                 # registros que ya no valen
+        self._file = None
+        self._lock: threading.Lock = threading.Lock()
+        self._loaded: bool = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self._seed()
+            return
+        if not data.startswith(_MAGIC):
+            logger.warning(f"{self.name:<10} - unknown quarantine journal format in {self.path}. rebuilding it from {self.root}")
+            self._seed()
+            return
+
+        offset, end = len(_MAGIC), len(data)
+        while offset + _RECORD.size <= end:
+            kind, when, size, original_len, moved_len = _RECORD.unpack_from(data, offset)
+            record_end = offset + _RECORD.size + original_len + moved_len
+            if record_end > end or kind not in (_MOVED, _GONE):
+                break
+            original = os.fsdecode(data[offset + _RECORD.size:offset + _RECORD.size + original_len])
+            moved = os.fsdecode(data[offset + _RECORD.size + original_len:record_end])
+            if kind == _MOVED:
+                self._add(QuarantineEntry(when, size, original, moved))
+            else:
+                self._remove(moved)
+                self._dead += 1
+            offset = record_end
+        self._heapify()
+        if offset < end:
+            logger.warning(f"{self.name:<10} - quarantine journal truncated at byte {offset} of {end}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+        logger.debug(f"{self.name:<10} - quarantine journal: {len(self._entries)} files")
+        if self._dead > max(_COMPACT_MIN, len(self._entries)):
+            self._rewrite()
+
+    def _walk(self):
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                yield os.path.join(directory, name)
+
+    @staticmethod
+    def _found(moved: str) -> QuarantineEntry | None:
+        """entrada de un fichero que esta en orphaned_path sin diario: su mtime como hora"""
+        try:
+            st = os.lstat(moved)
+        except OSError:
+            return None
+        return QuarantineEntry(st.st_mtime, st.st_size, '', moved)
+
+    def _seed(self) -> None:
+        """el diario empieza con lo que ya esta en orphaned_path (movido por una version sin diario o a mano)"""
+        for moved in self._walk():
+            entry = self._found(moved)
+            if entry is not None:
+                self._add(entry)
+        self._heapify()
+        if self._entries:
+            logger.info(f"{self.name:<10} - quarantine journal created with {len(self._entries)} files already in {self.root}")
+        self._rewrite()
+
+    def _add(self, entry: QuarantineEntry) -> None:
+        previous = self._entries.get(entry.moved)
+        if previous is not None:
+            # el mismo destino otra vez: rename piso el fichero anterior
+            self._remove(previous.moved)
+            self._dead += 1
+        self._entries[entry.moved] = entry
+        if entry.original:
+            self._originals[entry.original] = entry.moved
+
+    def _heapify(self) -> None:
+        self._heap = [(entry.time, entry.moved) for entry in self._entries.values()]
+        heapq.heapify(self._heap)
+
+    def _remove(self, moved: str) -> QuarantineEntry | None:
+        entry = self._entries.pop(moved, None)
+        if entry is not None and self._originals.get(entry.original) == moved:
+            del self._originals[entry.original]
+        # lo del heap se descarta al sacarlo
+        return entry
+
+    def _append(self, record: bytes) -> None:
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'ab')
+            if self._file.tell() == 0:
+                self._file.write(_MAGIC)
+        self._file.write(record)
+        # a disco en sync(); aqui basta con que no se pierda si muere el proceso
+        self._file.flush()
+
+    def _rewrite(self) -> None:
+        """solo lo que sigue en cuarentena, por orden de hora. escritura atomica como los snapshots"""
+        self.close()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(_MAGIC)
+                for entry in sorted(self._entries.values()):
+                    f.write(_encode(_MOVED, entry))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._dead = 0
+
+    def record(self, original: str, moved: str, size: int, when: float | None = None) -> None:
+        """move_to_dir ha movido original a moved"""
+        entry = QuarantineEntry(time.time() if when is None else when, size, original, moved)
+        with self._lock:
+            self.load()
+            self._add(entry)
+            heapq.heappush(self._heap, (entry.time, entry.moved))
+            self._append(_encode(_MOVED, entry))
+
+    def reconcile(self, paths=None) -> int:
+        """
+        apunta lo que hay en orphaned_path y no esta en el diario (paths: sus ficheros, si ya se han listado; si no, se recorre).
+        solo añade: lo apuntado que ya no esta lo quita prune al caducar. devuelve cuantos
+        """
+        with self._lock:
+            self.load()
+            unknown = [moved for moved in (self._walk() if paths is None else paths) if moved not in self._entries]
+        added: int = 0
+        # el stat fuera del lock: move_to_dir puede seguir apuntando
+        for entry in filter(None, map(self._found, unknown)):
+            with self._lock:
+                if entry.moved in self._entries:
+                    continue
+                self._add(entry)
+                heapq.heappush(self._heap, (entry.time, entry.moved))
+                self._append(_encode(_MOVED, entry))
+            added += 1
+        if added:
+            logger.info(f"{self.name:<10} - quarantine journal: {added} files found in {self.root} that were not in it")
+        return added
+
+    def discard(self, moved: str) -> None:
+        """el fichero en cuarentena ya no esta (borrado o restaurado)"""
+        with self._lock:
+            self.load()
+            entry = self._remove(moved)
+            if entry is None:
+                return
+            self._dead += 1
+            self._append(_encode(_GONE, entry._replace(time=time.time())))
+
+    def expired(self, time_limit: float) -> list[QuarantineEntry]:
+        """lo que entro en cuarentena antes de time_limit, por orden de hora. no lo quita: eso lo hace discard()"""
+        with self._lock:
+            self.load()
+            found: list[QuarantineEntry] = []
+            while self._heap and self._heap[0][0] < time_limit:
+                when, moved = heapq.heappop(self._heap)
+                entry = self._entries.get(moved)
+                # entradas del heap de ficheros que ya no estan o que se volvieron a mover
+                if entry is not None and entry.time == when:
+                    found.append(entry)
+            for entry in found:
+                heapq.heappush(self._heap, (entry.time, entry.moved))
+            return found
+
+    def find(self, original: str) -> list[QuarantineEntry]:
+        """lo que estaba en original: el fichero, o todo lo que habia debajo si era un directorio"""
+        original = os.path.abspath(original)
+        with self._lock:
+            self.load()
+            moved = self._originals.get(original)
+            if moved is not None:
+                return [self._entries[moved]]
+            prefix = original.rstrip(os.sep) + os.sep
+            return sorted(
+                (self._entries[moved] for path, moved in self._originals.items() if path.startswith(prefix)),
+                key=lambda entry: entry.original,
+            )
+
+    def restore(self, original: str, dry_run: bool = False) -> list[QuarantineEntry]:
+        """devuelve a su sitio lo que habia en original (fichero o directorio). lo que ya existe alli no se pisa"""
+        restored: list[QuarantineEntry] = []
+        for entry in self.find(original):
+            if os.path.lexists(entry.original):
+                logger.warning(f"{self.name:<10} - {entry.original} already exists. not restoring {entry.moved}")
+                continue
+            if dry_run:
+                logger.info(f"{self.name:<10} - *** DRY-RUN *** restored {entry.original}")
+                restored.append(entry)
+                continue
+            try:
+                os.makedirs(os.path.dirname(entry.original), exist_ok=True)
+                os.rename(entry.moved, entry.original)
+            except OSError as e:
+                logger.error(f"{self.name:<10} - unable to restore {entry.original}: {e}")
+                continue
+            self.discard(entry.moved)
+            restored.append(entry)
+            logger.info(f"{self.name:<10} - restored {entry.original}")
+        return restored
+
+    def sync(self) -> None:
+        """a disco lo añadido, y se reescribe si ya hay mas registros muertos que vivos"""
+        with self._lock:
+            if self._dead > max(_COMPACT_MIN, len(self._entries)):
+                self._rewrite()
+            elif self._file is not None:
+                os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,163 @@
+from typing import NamedTuple
+from pytimeparse2 import parse
+
+from .trackers import TrackerClassifier
+from .sharelimits import ShareLimitClassifier
+
+
+class HRRule(NamedTuple):
+    time: float                 # segundos
+    ratio: float | None
+    percent: float | None
+
+
+class HRSettings(NamedTuple):
+    tag: str
+    extra_time: float           # segundos
+    extra_ratio: float
+    exclude_xseed: bool
+    autostart: bool
+
+
+class TrackerRule(NamedTuple):
+    expr: str                   # clave de tracker_details: palabras separadas por |
+    tags: frozenset[str]
+    hr: HRRule | None
+    category: str | None
+
+
+class HUNORank(NamedTuple):
+    name: str
+    tag: str
+    min_time: float             # segundos
+
+
+class ShareLimitProfile(NamedTuple):
+    name: str
+    tag: str
+    add_group_to_tag: bool
+    categories: frozenset[str] | None   # None: la clausula no esta en la config
+    include_all_tags: frozenset[str] | None
+    include_any_tags: frozenset[str] | None
+    exclude_all_tags: frozenset[str] | None
+    exclude_any_tags: frozenset[str] | None
+    max_ratio: float
+    max_seeding_time: int       # minutos, o el valor especial (-1, -2) tal cual
+    upload_limit: int
+    auto_resume: bool
+    auto_delete: bool
+
+
+class CompiledRules(NamedTuple):
+    fullsync_interval: float
+    prune_orphaned_time: float
+    hr: HRSettings
+    trackers: TrackerClassifier
+    huno: tuple[HUNORank, ...]
+    share_limits: dict[str, ShareLimitClassifier]
+
+
+HUNO_RANKS: tuple[tuple[str, str], ...] = (
+    ("Legend", "5y"),
+    ("Champion", "1y"),
+    ("Knight", "6 months"),
+    ("Squire", "10d"),
+    ("Vanguard", "1d"),
+)
+
+
+def seconds(value, default: float = 0) -> float:
+    """'5d' -> 432000. los numeros se dan ya por segundos"""
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return value
+    parsed = parse(str(value))
+    return default if parsed is None else parsed
+
+
+def compile_hr(hr) -> HRRule | None:
+    if not hr:
+        return None
+    # formato corto de la config de ejemplo: HR: [time, ratio, percent]
+    if isinstance(hr, list):
+        hr = dict(zip(('time', 'ratio', 'percent'), hr))
+    return HRRule(
+        time=seconds(hr.get('time')),
+        ratio=hr.get('ratio'),
+        percent=hr.get('percent'),
+    )
+
+
+def compile_trackers(tracker_details) -> TrackerClassifier:
+    rules: list[TrackerRule] = []
+    default_tag = None
+    for expr, value in tracker_details.items():
+        if expr == 'default':
+            default_tag = value.get('tag')
+            continue
+        rules.append(TrackerRule(
+            expr=expr,
+            tags=frozenset(tag for tag in (value.get('tag', '') or '').split(", ") if tag),
+            hr=compile_hr(value.get('HR')),
+            category=value.get('category'),
+        ))
+    return TrackerClassifier(rules, default_tag)
+
+
+def _tagset(profile, key) -> frozenset[str] | None:
+    if key not in profile:
+        return None
+    value = profile[key]
+    return frozenset((value,)) if isinstance(value, str) else frozenset(value)
+
+
+def compile_share_limits(share_limits, tagprefix: str) -> tuple[ShareLimitProfile, ...]:
+    profiles: list[ShareLimitProfile] = []
+    for name, profile in (share_limits or {}).items():
+        profile = dict(profile)
+        max_seeding_time = profile.get('max_seeding_time', -2)
+        if seconds(max_seeding_time, -2) > 0:
+            max_seeding_time = int(seconds(max_seeding_time) / 60)
+        profiles.append(ShareLimitProfile(
+            name=name,
+            tag=profile.get('custom_tag', tagprefix + name),
+            add_group_to_tag=profile.get('add_group_to_tag', True),
+            categories=_tagset(profile, 'category'),
+            include_all_tags=_tagset(profile, 'include_all_tags'),
+            include_any_tags=_tagset(profile, 'include_any_tags'),
+            exclude_all_tags=_tagset(profile, 'exclude_all_tags'),
+            exclude_any_tags=_tagset(profile, 'exclude_any_tags'),
+            max_ratio=profile.get('max_ratio', -2),
+            max_seeding_time=max_seeding_time,
+            upload_limit=profile.get('upload_limit', -2),
+            auto_resume=profile.get('auto_resume', True),
+            auto_delete=profile.get('auto_delete', False),
+        ))
+    return tuple(profiles)
+
+
+def compile_rules(get) -> CompiledRules:
+    """
+    Se llama una vez al cargar la config (GlobalConfig.set). get es GlobalConfig.get.
+    Todo lo que los taggers usan por torrent queda parseado y en objetos inmutables.
+    """
+    tagprefix: str = get("app.share_limits_tag_prefix", '')
+    huno_prefix: str = get("app.huno_tag_prefix", '')
+    return CompiledRules(
+        fullsync_interval=seconds(get("app.fullsync_interval")),
+        prune_orphaned_time=seconds(get("app.prune_orphaned_time", 0)),
+        hr=HRSettings(
+            tag=get("app.HR.tag"),
+            extra_time=seconds(get("app.HR.extra_seed_time")),
+            extra_ratio=get("app.HR.extra_ratio", 0),
+            exclude_xseed=get("app.HR.exclude_xseed", False),
+            autostart=get("app.HR.autostart", False),
+        ),
+        trackers=compile_trackers(get("tracker_details", {})),
+        huno=tuple(HUNORank(name, huno_prefix + name, seconds(time)) for name, time in HUNO_RANKS),
+        share_limits={
+            name: ShareLimitClassifier(compile_share_limits(getattr(client, 'share_limits', {}), tagprefix))
+            for name, client in (get("clients") or {}).items()
+        },
+    )
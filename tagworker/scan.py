@@ -0,0 +1,318 @@
+import os
+import time
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import logger
+from .inodes import InodeIndex
+
+SHARD_BY_DIR: str = 'dir'
+SHARD_BY_DEVICE: str = 'device'
+
+
+class Shard(NamedTuple):
+    path: str           # directorio del shard
+    rel: str            # su ruta relativa a root, acabada en '/' (vacia para root)
+    device: int         # st_dev del directorio
+    recursive: bool     # False solo para root: sus ficheros sueltos, los directorios van en su propio shard
+
+
+def branch_of(path: str) -> str | None:
+    """
+    Rama de mergerfs en la que esta path (su xattr user.mergerfs.basepath), o None si no es mergerfs
+    (o tiene los xattr desactivados). Un directorio que esta en varias ramas da la primera segun la politica de getattr
+    """
+    getxattr = getattr(os, 'getxattr', None) # solo linux
+    if getxattr is None:
+        return None
+    try:
+        return os.fsdecode(getxattr(path, 'user.mergerfs.basepath'))
+    except OSError:
+        return None
+
+
+class ShardTiming(NamedTuple):
+    shard: str
+    device: int
+    seconds: float
+    items: int
+
+
+def plan_shards(root: str, keep=None) -> list[Shard]:
+    """
+    root (sin bajar) y un shard por cada directorio de primer nivel, por orden de nombre.
+    keep(path, rel) (rel sin '/' final) puede descartar directorios antes de repartirlos. Los enlaces a directorios no se siguen
+    """
+    root = os.path.abspath(root)
+    shards: list[Shard] = [Shard(root, '', os.stat(root).st_dev, False)]
+    with os.scandir(root) as entries:
+        dirs = sorted((entry for entry in entries if entry.is_dir(follow_symlinks=False)), key=lambda entry: entry.name)
+    for entry in dirs:
+        rel = entry.name + '/'
+        if keep is not None and not keep(entry.path, entry.name):
+            continue
+        shards.append(Shard(entry.path, rel, entry.stat(follow_symlinks=False).st_dev, True))
+    return shards
+
+
+class ShardedScanner:
+    """
+    Reparte un recorrido del disco entre hilos: un shard por directorio de primer nivel de root.
+    Con by='device' los shards del mismo disco van seguidos en el mismo hilo (un lector por disco, sin
+    que dos hilos se peleen por el mismo cabezal); con by='dir' cada shard es una tarea del pool.
+    El disco es el st_dev, que solo distingue discos si cada directorio de primer nivel es su propio montaje:
+    en un pool FUSE (mergerfs) todo da el st_dev del pool. Ahi se usa la rama que da mergerfs en sus xattr
+    (branch_of); sin ellos todo cae en un grupo y el recorrido es en serie: mejor by='dir'
+    Los resultados vuelven en el orden de los shards, tarden lo que tarden, y se guarda cuanto ha tardado cada uno
+    """
+
+    def __init__(self, workers: int = 4, by: str = SHARD_BY_DIR, name: str = '') -> None:
+        self.workers: int = max(1, int(workers))
+        self.by: str = by if by in (SHARD_BY_DIR, SHARD_BY_DEVICE) else SHARD_BY_DIR
+        self.name: str = name
+        self.timings: list[ShardTiming] = []
+
+    def _groups(self, shards: list[Shard]) -> list[list[int]]:
+        if self.by == SHARD_BY_DIR:
+            return [[i] for i in range(len(shards))]
+        groups: dict[int | str, list[int]] = {}
+        for i, shard in enumerate(shards):
+            # root (sus ficheros sueltos) no tiene una rama propia: va con los de su st_dev
+            key = (branch_of(shard.path) if shard.recursive else None) or shard.device
+            groups.setdefault(key, []).append(i)
+        if len(groups) == 1 and len(shards) > 2:
+            logger.debug(f"{self.name:<10} - all shards on one device (a FUSE pool without branch xattrs?): scanning serially")
+        return list(groups.values())
+
+    def run(self, root: str, func, keep=None, label: str = 'scan') -> list:
+        """func(shard) para cada shard de root. devuelve sus resultados en el orden de los shards"""
+        start = time.perf_counter()
+        shards = plan_shards(root, keep)
+        results: list = [None] * len(shards)
+        timings: list[ShardTiming | None] = [None] * len(shards)
+
+        def run_group(group: list[int]) -> None:
+            for i in group:
+                shard = shards[i]
+                t = time.perf_counter()
+                results[i] = func(shard)
+                items = len(results[i]) if hasattr(results[i], '__len__') else 0
+                timings[i] = ShardTiming(shard.rel or '.', shard.device, time.perf_counter() - t, items)
+
+        groups = self._groups(shards)
+        workers = min(self.workers, len(groups))
+        if workers <= 1:
+            for group in groups:
+                run_group(group)
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"scan-{self.name}") as pool:
+                # list() para que salte aqui la excepcion de cualquier shard
+                list(pool.map(run_group, groups))
+
+        self.timings = timings
+        elapsed = time.perf_counter() - start
+        for timing in sorted(timings, key=lambda timing: -timing.seconds)[:5]:
+            logger.debug(f"{self.name:<10} - {label} shard {timing.shard} (dev {timing.device}): {timing.seconds:.2f}s, {timing.items} items")
+        logger.debug(f"{self.name:<10} - {label}: {len(shards)} shards ({len(groups)} {'devices' if self.by == SHARD_BY_DEVICE else 'tasks'}) "
+                     f"on {workers or 1} workers in {elapsed:.2f}s (sum {sum(timing.seconds for timing in timings):.2f}s)")
+        return results
+
+
+class FileStat(NamedTuple):
+    dev: int
+    ino: int
+    nlink: int
+    size: int
+    mtime: float
+
+
+def older_than(path: str, time_limit: float) -> bool:
+    """si el mtime de path en disco es anterior a time_limit (False si ya no esta)"""
+    try:
+        return os.stat(path).st_mtime < time_limit
+    except OSError:
+        return False
+
+
+def list_dir(path: str) -> tuple[list[str], dict[str, FileStat]]:
+    """
+    Subdirectorios y ficheros (con su stat) de path, en una sola pasada de scandir.
+    Como os.walk, los enlaces a directorios no se siguen; de un enlace a fichero cuenta el fichero al que apunta
+    """
+    subdirs: list[str] = []
+    files: dict[str, FileStat] = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+                continue
+            try:
+                st = os.stat(entry.path) if entry.is_symlink() else entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            files[entry.name] = FileStat(st.st_dev, st.st_ino, st.st_nlink, st.st_size, st.st_mtime)
+    return subdirs, files
+
+
+class ScanResult:
+    """
+    Todo lo que necesitan las tareas de disco de una pasada por root: el arbol de directorios y el stat de
+    cada fichero. Se saca una vez por task_disk (recorriendo el disco con scan_tree) y noHL, huerfanos, prune
+    y directorios vacios lo consultan en memoria en vez de volver a recorrer el disco.
+    Con el fsindex.FileIndex las mismas consultas van al indice sin cargarlo (fsindex.IndexResult).
+    nlink_fresh: el nlink es del stat de esta pasada (con el indice puede ser viejo: hay que mirarlo en disco).
+    Lo que las tareas mueven o borran se quita con discard() para que las siguientes lo vean
+    """
+
+    def __init__(self, root: str, nlink_fresh: bool = True) -> None:
+        self.root: str = os.path.abspath(root)
+        self.nlink_fresh: bool = nlink_fresh
+        self.dirs: dict[str, list[str]] = {}               # directorio -> subdirectorios
+        self.files: dict[str, dict[str, FileStat]] = {}    # directorio -> {nombre: stat}
+
+    def add(self, path: str, subdirs: list[str], files: dict[str, FileStat]) -> None:
+        self.dirs[path] = subdirs
+        if files:
+            self.files[path] = files
+
+    def __len__(self) -> int:
+        return sum(len(files) for files in self.files.values())
+
+    def covers(self, path: str) -> bool:
+        path = os.path.abspath(path)
+        return path == self.root or path.startswith(self.root + os.sep)
+
+    def is_dir(self, path: str) -> bool:
+        return path in self.dirs
+
+    def stat(self, path: str) -> FileStat | None:
+        directory, name = os.path.split(path)
+        return self.files.get(directory, {}).get(name)
+
+    def discard(self, path: str) -> None:
+        """el fichero ya no esta (movido o borrado)"""
+        directory, name = os.path.split(path)
+        files = self.files.get(directory)
+        if files is not None:
+            files.pop(name, None)
+            if not files:
+                del self.files[directory]
+
+    def walk_files(self, top: str):
+        """(ruta, stat) de los ficheros bajo el directorio top"""
+        stack: list[str] = [top]
+        while stack:
+            directory = stack.pop()
+            for name, st in self.files.get(directory, {}).items():
+                yield os.path.join(directory, name), st
+            stack.extend(self.dirs.get(directory, ()))
+
+    def inode_index(self) -> InodeIndex:
+        """cuantas veces aparece cada inodo bajo root (lo que da files.build_inode_map)"""
+        index = InodeIndex()
+        add = index.add
+        for files in self.files.values():
+            for st in files.values():
+                add(st.dev, st.ino, st.nlink)
+        return index.build()
+
+    def scan_files(self, ignore=None, skip: str | None = None) -> set[str]:
+        """lo mismo que files.scan_files(root, ignore, skip), sin tocar el disco"""
+        file_ignored = ignore._file if ignore is not None else None
+        found: set[str] = set()
+        join = os.path.join
+        for directory, rel in visible_dirs(self.root, self.dirs, ignore, skip).items():
+            for name in self.files.get(directory, ()):
+                if file_ignored is None or file_ignored(rel + name) is None:
+                    found.add(join(directory, name))
+        return found
+
+    def files_older_than(self, path: str, time_limit: float) -> set[str]:
+        """sin nlink_fresh el mtime es del indice y puede ser viejo (un fichero reescrito): cada candidato se confirma con un stat"""
+        old = {fullpath for fullpath, st in self.walk_files(os.path.abspath(path)) if st.mtime < time_limit}
+        if not self.nlink_fresh:
+            old = {fullpath for fullpath in old if older_than(fullpath, time_limit)}
+        return old
+
+    def empty_dirs(self, path: str, cascade: bool = True) -> list[str]:
+        """
+        Directorios bajo path (incluido) sin ficheros, cada hijo antes que su padre.
+        cascade: tambien los que solo tienen directorios vacios (los que quedan vacios al borrar los de dentro)
+        """
+        return empty_dirs(os.path.abspath(path), self.dirs, self.files, cascade)
+
+
+def visible_dirs(root: str, children: dict[str, list[str]], ignore=None, skip: str | None = None) -> dict[str, str]:
+    """directorio -> su ruta relativa a root acabada en '/' ('' para root), sin bajar a los que poda ignore (o skip)"""
+    dir_pruned = ignore._dir if ignore is not None else None
+    visible: dict[str, str] = {}
+    stack: list[tuple[str, str]] = [(root, '')]
+    while stack:
+        directory, rel = stack.pop()
+        visible[directory] = rel
+        for subdir in children.get(directory, ()):
+            sub_rel = rel + os.path.basename(subdir)
+            if skip is not None and subdir.startswith(skip):
+                continue
+            if dir_pruned is not None and dir_pruned(sub_rel) is not None:
+                continue
+            stack.append((subdir, sub_rel + '/'))
+    return visible
+
+
+def empty_dirs(top: str, children: dict[str, list[str]], with_files, cascade: bool = True) -> list[str]:
+    """los de ScanResult.empty_dirs a partir del arbol de directorios y de los que tienen ficheros (with_files)"""
+    empty: list[str] = []
+    empty_set: set[str] = set()
+    # postorden iterativo: un directorio se decide cuando ya se han decidido todos sus hijos
+    stack: list[tuple[str, bool]] = [(top, False)]
+    while stack:
+        directory, expanded = stack.pop()
+        subdirs = children.get(directory)
+        if subdirs is None:
+            continue
+        if not expanded:
+            stack.append((directory, True))
+            stack.extend((subdir, False) for subdir in subdirs)
+            continue
+        if directory in with_files:
+            continue
+        if not subdirs or (cascade and all(subdir in empty_set for subdir in subdirs)):
+            empty.append(directory)
+            empty_set.add(directory)
+    return empty
+
+
+def _scan_shard(shard: Shard) -> list[tuple[str, list[str], dict[str, FileStat]]]:
+    listed: list[tuple[str, list[str], dict[str, FileStat]]] = []
+    stack: list[str] = [shard.path]
+    while stack:
+        path = stack.pop()
+        try:
+            subdirs, files = list_dir(path)
+        except OSError:
+            continue
+        listed.append((path, subdirs, files))
+        if shard.recursive:
+            stack.extend(subdirs)
+    return listed
+
+
+def scan_tree(root: str, scanner: ShardedScanner | None = None) -> ScanResult:
+    """recorre root una vez (por shards si hay scanner) y deja el resultado para todas las tareas de disco"""
+    result = ScanResult(root)
+    if not os.path.isdir(result.root):
+        return result
+    if scanner is None:
+        shards = [_scan_shard(Shard(result.root, '', 0, True))]
+    else:
+        shards = scanner.run(result.root, _scan_shard, label='disk scan')
+    for listed in shards:
+        for path, subdirs, files in listed:
+            result.add(path, subdirs, files)
+    return result
@@ -0,0 +1,272 @@
+import math
+import time
+import asyncio
+import random
+import threading
+import traceback
+import concurrent.futures
+
+from .logger import logger
+
+
+class JobStats:
+    """
+    Lo que ha pasado con un job: cuanto ha habido de verdad entre arranques (interval),
+    cuanto ha arrancado tarde respecto a lo planificado (lateness) y cuanto ha durado
+    """
+
+    def __init__(self) -> None:
+        self.runs: int = 0
+        self.overruns: int = 0          # ejecuciones que han pasado del timeout
+        self.errors: int = 0
+        self.last_start: float = 0
+        self._intervals: int = 0
+        self._interval_sum: float = 0
+        self._interval_sq: float = 0
+        self.interval_min: float = math.inf
+        self.interval_max: float = 0
+        self._lateness_sum: float = 0
+        self.lateness_max: float = 0
+        self._duration_sum: float = 0
+        self.duration_max: float = 0
+
+    def record(self, planned: float, start: float, duration: float) -> None:
+        if self.runs:
+            interval = start - self.last_start
+            self._intervals += 1
+            self._interval_sum += interval
+            self._interval_sq += interval * interval
+            self.interval_min = min(self.interval_min, interval)
+            self.interval_max = max(self.interval_max, interval)
+        lateness = max(0.0, start - planned)
+        self._lateness_sum += lateness
+        self.lateness_max = max(self.lateness_max, lateness)
+        self._duration_sum += duration
+        self.duration_max = max(self.duration_max, duration)
+        self.last_start = start
+        self.runs += 1
+
+    @property
+    def interval_mean(self) -> float:
+        return self._interval_sum / self._intervals if self._intervals else 0
+
+    @property
+    def interval_stdev(self) -> float:
+        if self._intervals < 2:
+            return 0
+        mean = self.interval_mean
+        return math.sqrt(max(0.0, self._interval_sq / self._intervals - mean * mean))
+
+    @property
+    def lateness_mean(self) -> float:
+        return self._lateness_sum / self.runs if self.runs else 0
+
+    @property
+    def duration_mean(self) -> float:
+        return self._duration_sum / self.runs if self.runs else 0
+
+    def summary(self) -> str:
+        if not self.runs:
+            return "no runs"
+        interval = (f"interval {self.interval_mean:.1f}s ±{self.interval_stdev:.1f} "
+                    f"[{self.interval_min:.1f}-{self.interval_max:.1f}]") if self._intervals else "interval -"
+        return (f"{self.runs} runs, {interval}, late {self.lateness_mean:.2f}s (max {self.lateness_max:.2f}), "
+                f"took {self.duration_mean:.2f}s (max {self.duration_max:.2f}), {self.overruns} overruns, {self.errors} errors")
+
+
+class Job:
+    def __init__(self, name: str, func, interval: float, jitter: float, timeout: float | None) -> None:
+        self.name: str = name
+        self.func = func
+        self.interval: float = interval
+        self.jitter: float = jitter
+        self.timeout: float | None = timeout
+        self.next_run: float = 0
+        self.stats: JobStats = JobStats()
+
+
+class Scheduler:
+    """
+    Los timers de un solo cliente, en su propio hilo. Los jobs de un cliente se ejecutan uno detras de otro
+    (nunca se pisan tag y disco), pero un cliente lento o caido no retrasa a los demas.
+    Cada job se replanifica desde que arranca con interval * (1 ± jitter), para que los clientes con el mismo
+    intervalo no acaben lanzando sus peticiones a la vez. Un job que pasa de su timeout se avisa en el log
+    mientras sigue corriendo (un hilo no se puede matar: el corte de verdad es el timeout de las peticiones)
+    """
+
+    def __init__(self, name: str, jitter: float = 0.1, rng: random.Random | None = None) -> None:
+        self.name: str = name
+        self.jitter: float = jitter
+        self._rng: random.Random = rng or random.Random()
+        self._jobs: dict[str, Job] = {}
+        self._wake: threading.Event = threading.Event()
+        self._stopping: threading.Event = threading.Event()
+        self._lock: threading.Lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.current: str | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def every(self, name: str, func, interval: float, timeout: float | None = None, jitter: float | None = None, run_now: bool = True) -> Job:
+        job = Job(name, func, interval, self.jitter if jitter is None else jitter, timeout)
+        job.next_run = time.monotonic() if run_now else self._next(job, time.monotonic())
+        with self._lock:
+            self._jobs[name] = job
+        self._notify()
+        return job
+
+    def trigger(self, name: str, delay: float = 0) -> None:
+        """adelanta el job: corre en cuanto quede libre el hilo (o dentro de delay segundos)"""
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None:
+                return
+            job.next_run = min(job.next_run, time.monotonic() + delay)
+        self._notify()
+
+    def stats(self) -> dict[str, JobStats]:
+        return {name: job.stats for name, job in self._jobs.items()}
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._loop, name=f"sched-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> bool:
+        """para el hilo al acabar el job en curso. False si sigue corriendo pasado timeout"""
+        self._stopping.set()
+        self._notify()
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _notify(self) -> None:
+        self._wake.set()
+
+    def _next(self, job: Job, start: float) -> float:
+        spread = job.interval * job.jitter
+        return start + job.interval + (self._rng.uniform(-spread, spread) if spread else 0)
+
+    def _due(self) -> Job | None:
+        # el que toca antes; a igualdad, el que se registro primero
+        with self._lock:
+            return min(self._jobs.values(), key=lambda job: job.next_run, default=None)
+
+    def _loop(self) -> None:
+        while not self._stopping.is_set():
+            job = self._due()
+            now = time.monotonic()
+            if job is None or job.next_run > now:
+                self._wake.wait(None if job is None else job.next_run - now)
+                self._wake.clear()
+                continue
+            self._run(job, now)
+
+    def _run(self, job: Job, start: float) -> None:
+        planned = job.next_run
+        watchdog = self._watchdog(job)
+        self.current = job.name
+        try:
+            job.func()
+        except Exception as e:
+            self._failed(job, e)
+        finally:
+            self._done(job, planned, start, watchdog)
+
+    def _watchdog(self, job: Job):
+        if not job.timeout:
+            return None
+        watchdog = threading.Timer(job.timeout, self._overrun, args=(job,))
+        watchdog.daemon = True
+        watchdog.start()
+        return watchdog
+
+    def _failed(self, job: Job, e: Exception) -> None:
+        job.stats.errors += 1
+        logger.error(f"{self.name:<10} - {job.name} task failed: {e}\n{traceback.format_exc()}")
+
+    def _done(self, job: Job, planned: float, start: float, watchdog) -> None:
+        self.current = None
+        if watchdog is not None:
+            watchdog.cancel()
+        duration = time.monotonic() - start
+        job.stats.record(planned, start, duration)
+        with self._lock:
+            # si alguien lo ha adelantado con trigger() mientras corria, se respeta
+            next_run = self._next(job, start)
+            job.next_run = next_run if job.next_run == planned else min(job.next_run, next_run)
+        logger.debug(f"{self.name:<10} - {job.name} task took {duration:.2f}s ({max(0.0, start - planned):.2f}s late). next in {max(0.0, job.next_run - time.monotonic()):.0f}s")
+
+    def _overrun(self, job: Job) -> None:
+        job.stats.overruns += 1
+        logger.warning(f"{self.name:<10} - {job.name} task still running after {job.timeout:.0f}s")
+
+
+class AsyncScheduler(Scheduler):
+    """
+    Los mismos timers que Scheduler, pero como una tarea del event loop compartido (aio.shared_loop) en vez de
+    un hilo por cliente. Los jobs siguen siendo sincronos y corren en el executor del loop; su E/S vuelve al loop
+    """
+
+    def __init__(self, name: str, loop: asyncio.AbstractEventLoop, jitter: float = 0.1, rng: random.Random | None = None) -> None:
+        super().__init__(name, jitter=jitter, rng=rng)
+        self._aloop: asyncio.AbstractEventLoop = loop
+        self._future: concurrent.futures.Future | None = None
+        self._event: asyncio.Event | None = None # se crea dentro del loop
+
+    @property
+    def running(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def _notify(self) -> None:
+        if self._event is not None:
+            self._aloop.call_soon_threadsafe(self._event.set)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping.clear()
+        self._future = asyncio.run_coroutine_threadsafe(self._main(), self._aloop)
+
+    def stop(self, timeout: float | None = None) -> bool:
+        self._stopping.set()
+        self._notify()
+        if self._future is None:
+            return True
+        try:
+            self._future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            return False
+        return True
+
+    def _watchdog(self, job: Job):
+        if not job.timeout:
+            return None
+        return self._aloop.call_later(job.timeout, self._overrun, job)
+
+    async def _main(self) -> None:
+        self._event = asyncio.Event()
+        while not self._stopping.is_set():
+            job = self._due()
+            now = time.monotonic()
+            if job is None or job.next_run > now:
+                try:
+                    await asyncio.wait_for(self._event.wait(), None if job is None else job.next_run - now)
+                except asyncio.TimeoutError:
+                    pass
+                self._event.clear()
+                continue
+            planned = job.next_run
+            watchdog = self._watchdog(job)
+            self.current = job.name
+            try:
+                await asyncio.to_thread(job.func)
+            except Exception as e:
+                self._failed(job, e)
+            finally:
+                self._done(job, planned, now, watchdog)
@@ -0,0 +1,84 @@
+from typing import NamedTuple
+
+# por encima de este numero de combinaciones distintas vaciamos las caches (no deberia pasar nunca)
+MAX_SIGNATURES: int = 1 << 16
+
+
+class ProfileMask(NamedTuple):
+    categories: frozenset[str] | None
+    include_all: int
+    include_any: int | None     # None: la clausula no esta en la config
+    exclude_all: int | None
+    exclude_any: int
+
+
+class ShareLimitClassifier:
+    """
+    Perfiles de share limits compilados a mascaras de bits: un bit por cada tag que aparece en algun perfil.
+    Cada torrent se reduce a (categoria, mascara de sus tags) y el primer perfil que encaja se calcula
+    una vez por combinacion distinta, con unas pocas operaciones de bits por perfil.
+    """
+
+    def __init__(self, profiles) -> None:
+        self.profiles = tuple(profiles) # rules.ShareLimitProfile, en orden de prioridad
+        self._bits: dict[str, int] = {}
+        for profile in self.profiles:
+            for tags in (profile.include_all_tags, profile.include_any_tags, profile.exclude_all_tags, profile.exclude_any_tags):
+                for tag in tags or ():
+                    self._bits.setdefault(tag, 1 << len(self._bits))
+        self._masks: list[ProfileMask] = [
+            ProfileMask(
+                categories=profile.categories,
+                include_all=self.mask(profile.include_all_tags or ()),
+                include_any=None if profile.include_any_tags is None else self.mask(profile.include_any_tags),
+                exclude_all=None if profile.exclude_all_tags is None else self.mask(profile.exclude_all_tags),
+                exclude_any=self.mask(profile.exclude_any_tags or ()),
+            )
+            for profile in self.profiles
+        ]
+        # frozenset de tags -> mascara. el store reutiliza el mismo frozenset para el mismo string de tags
+        self._tagmasks: dict[frozenset[str], int] = {}
+        # (categoria, mascara) -> perfil
+        self._signatures: dict[tuple, object] = {}
+
+    def __iter__(self):
+        return iter(self.profiles)
+
+    def __len__(self) -> int:
+        return len(self.profiles)
+
+    def mask(self, tags) -> int:
+        bits = self._bits
+        mask = 0
+        for tag in tags:
+            mask |= bits.get(tag, 0)
+        return mask
+
+    def _first_match(self, category: str | None, mask: int):
+        for profile, pm in zip(self.profiles, self._masks):
+            if (
+                (pm.categories is not None and category not in pm.categories)
+                or (mask & pm.include_all) != pm.include_all
+                or (pm.include_any is not None and not mask & pm.include_any)
+                or (pm.exclude_all is not None and (mask & pm.exclude_all) == pm.exclude_all)
+                or (mask & pm.exclude_any)
+            ):
+                continue
+            return profile
+        return None
+
+    def match(self, category: str | None, tags: frozenset[str]):
+        """primer perfil que encaja, o None"""
+        tagmask = self._tagmasks.get(tags)
+        if tagmask is None:
+            if len(self._tagmasks) > MAX_SIGNATURES:
+                self._tagmasks.clear()
+            tagmask = self._tagmasks[tags] = self.mask(tags)
+        signature = (category, tagmask)
+        try:
+            return self._signatures[signature]
+        except KeyError:
+            if len(self._signatures) > MAX_SIGNATURES:
+                self._signatures.clear()
+            profile = self._signatures[signature] = self._first_match(category, tagmask)
+            return profile
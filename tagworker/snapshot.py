@@ -0,0 +1,48 @@
+import os
+import pickle
+
+from .logger import logger
+
+# se sube cuando cambia lo que se guarda: un snapshot de otra version se ignora
+SNAPSHOT_VERSION: int = 1
+
+
+def snapshot_path(state_dir: str, name: str) -> str:
+    return os.path.join(state_dir, f"{name}.snapshot")
+
+
+def write_snapshot(path: str, payload: dict) -> int:
+    """
+    Escritura atomica: se escribe a un temporal en el mismo directorio y se renombra encima.
+    Un corte a mitad deja el snapshot anterior intacto. Devuelve los bytes escritos
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    data = pickle.dumps({'version': SNAPSHOT_VERSION, **payload}, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(data)
+
+
+def read_snapshot(path: str) -> dict | None:
+    """el payload guardado, o None si no hay snapshot o no sirve (y se hace un full sync)"""
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            payload = pickle.load(f)
+    except Exception as e:
+        logger.warning(f"unable to read snapshot {path}: {e}")
+        return None
+    if not isinstance(payload, dict) or payload.get('version') != SNAPSHOT_VERSION:
+        logger.info(f"ignoring snapshot {path}: different version")
+        return None
+    return payload
@@ -0,0 +1,387 @@
+import sys
+from collections.abc import Mapping
+
+from .columnar import NumericColumns, Frame
+
+# campos con pocos valores distintos: internamos los str para que miles de torrents compartan el mismo objeto
+INTERNED_FIELDS: frozenset[str] = frozenset({'state', 'category', 'tags', 'tracker', 'save_path', 'download_path'})
+
+class _Missing:
+    """marca de campo ausente en las columnas. se serializa como referencia al singleton del modulo"""
+    __slots__ = ()
+
+    def __reduce__(self):
+        return '_MISSING'
+
+    def __repr__(self) -> str:
+        return '<missing>'
+
+
+_MISSING = _Missing()
+_NO_TAGS: frozenset[str] = frozenset()
+_NO_HASHES: frozenset[str] = frozenset()
+
+
+def parse_tags(tags: str | None) -> frozenset[str]:
+    """'a, b' -> frozenset({'a', 'b'})"""
+    if not tags:
+        return _NO_TAGS
+    return frozenset(tag for tag in tags.split(", ") if tag)
+
+
+class TorrentView(Mapping):
+    """
+    Vista ligera (solo lectura) de un torrent del TorrentStore.
+    Se comporta como el dict de qbittorrentapi: torrent['name'], torrent.get('tags') y torrent.name
+    """
+    __slots__ = ('_store', '_id', 'hash')
+
+    def __init__(self, store, tid: int, thash: str) -> None:
+        self._store = store
+        self._id = tid
+        self.hash = thash
+
+    def _value(self, key):
+        store = self._store
+        # el id se recicla al borrar torrents: una vista antigua no debe leer los datos de otro
+        if store._hashes[self._id] != self.hash:
+            return _MISSING
+        column = store._columns.get(key)
+        if column is None:
+            return _MISSING
+        return column[self._id]
+
+    def __getitem__(self, key):
+        value = self._value(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError(key)
+        value = self._value(key)
+        if value is _MISSING:
+            raise AttributeError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._value(key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key) -> bool:
+        return self._value(key) is not _MISSING
+
+    def __iter__(self):
+        tid = self._id
+        return (field for field, column in self._store._columns.items() if column[tid] is not _MISSING)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __bool__(self) -> bool:
+        # Mapping usaria __len__, que recorre todas las columnas
+        return self._store._hashes[self._id] == self.hash
+
+    @property
+    def tagset(self) -> frozenset[str]:
+        """tags ya parseados, mantenidos por el store"""
+        return self._store._tagsets[self._id] if self._store._hashes[self._id] == self.hash else _NO_TAGS
+
+    def __repr__(self) -> str:
+        return f"TorrentView({self.hash}, {dict(self)!r})"
+
+
+class TorrentTable(Mapping):
+    """hash -> TorrentView. Es lo que devuelve qBit.torrentdict"""
+    __slots__ = ('_store',)
+
+    def __init__(self, store) -> None:
+        self._store = store
+
+    def __getitem__(self, thash: str) -> TorrentView:
+        return TorrentView(self._store, self._store._ids[thash], thash)
+
+    def get(self, thash: str, default=None):
+        tid = self._store._ids.get(thash)
+        if tid is None:
+            return default
+        return TorrentView(self._store, tid, thash)
+
+    def __contains__(self, thash) -> bool:
+        return thash in self._store._ids
+
+    def __iter__(self):
+        return iter(self._store._ids)
+
+    def __len__(self) -> int:
+        return len(self._store._ids)
+
+    def keys(self):
+        return self._store._ids.keys()
+
+    def items(self):
+        store = self._store
+        return ((thash, TorrentView(store, tid, thash)) for thash, tid in store._ids.items())
+
+    def values(self):
+        store = self._store
+        return (TorrentView(store, tid, thash) for thash, tid in store._ids.items())
+
+
+class TorrentStore:
+    """
+    Estado acumulado de los torrents en columnas: una lista por campo indexada por un id entero.
+    Los hashes se internan a ids (reciclados al borrar) y los deltas se aplican campo a campo, sin recursion.
+    Mantiene ademas los indices inversos tag -> hashes y categoria -> hashes, y los tags parseados de cada torrent.
+    Con numeric (columnar.NumericColumns) lleva tambien los campos numericos en arrays de numpy.
+    """
+    __slots__ = ('_ids', '_hashes', '_free', '_columns', '_tagsets', '_by_tag', '_by_category', '_parsed', '_numeric', '_pending')
+
+    def __init__(self, numeric: NumericColumns | None = None) -> None:
+        self._ids: dict[str, int] = {}
+        self._hashes: list[str | None] = []
+        self._free: list[int] = []
+        self._columns: dict[str, list] = {}
+        self._tagsets: list[frozenset[str]] = []
+        self._by_tag: dict[str, set[str]] = {}
+        self._by_category: dict[str, set[str]] = {}
+        # cache 'a, b' -> frozenset. hay muchos menos strings de tags distintos que torrents
+        self._parsed: dict[str, frozenset[str]] = {}
+        self._numeric: NumericColumns | None = numeric
+        # campo -> {id: valor} de numeric. un dict por campo numerico: el resto no tiene entrada
+        self._pending: dict[str, dict] = numeric.pending if numeric is not None else {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def clear(self) -> None:
+        self._ids.clear()
+        self._hashes.clear()
+        self._free.clear()
+        self._columns.clear()
+        self._tagsets.clear()
+        self._by_tag.clear()
+        self._by_category.clear()
+        self._parsed.clear()
+        if self._numeric is not None:
+            self._numeric.clear()
+
+    def id_of(self, thash: str) -> int | None:
+        return self._ids.get(thash)
+
+    def _intern(self, thash: str) -> int:
+        tid = self._ids.get(thash)
+        if tid is not None:
+            return tid
+        if self._free:
+            tid = self._free.pop()
+            self._hashes[tid] = thash
+        else:
+            tid = len(self._hashes)
+            self._hashes.append(thash)
+            self._tagsets.append(_NO_TAGS)
+            for column in self._columns.values():
+                column.append(_MISSING)
+        self._ids[thash] = tid
+        return tid
+
+    def _set(self, tid: int, field: str, value) -> None:
+        column = self._columns.get(field)
+        if column is None:
+            column = self._columns[field] = [_MISSING] * len(self._hashes)
+        if field in INTERNED_FIELDS and isinstance(value, str):
+            value = sys.intern(value)
+        if field == 'tags':
+            self._index_tags(tid, value)
+        elif field == 'category':
+            self._index_category(tid, column[tid], value)
+        else:
+            pending = self._pending.get(field)
+            if pending is not None:
+                pending[tid] = value
+        column[tid] = value
+
+    def _index_tags(self, tid: int, value: str | None) -> None:
+        thash = self._hashes[tid]
+        parsed = self._parsed.get(value) if value else _NO_TAGS
+        if parsed is None:
+            parsed = self._parsed[value] = parse_tags(value)
+        old = self._tagsets[tid]
+        by_tag = self._by_tag
+        for tag in old - parsed:
+            holders = by_tag.get(tag)
+            if holders is not None:
+                holders.discard(thash)
+                if not holders:
+                    del by_tag[tag]
+        for tag in parsed - old:
+            by_tag.setdefault(tag, set()).add(thash)
+        self._tagsets[tid] = parsed
+
+    def _index_category(self, tid: int, old, value) -> None:
+        thash = self._hashes[tid]
+        if old is not _MISSING:
+            members = self._by_category.get(old)
+            if members is not None:
+                members.discard(thash)
+                if not members:
+                    del self._by_category[old]
+        if value is not _MISSING:
+            self._by_category.setdefault(value, set()).add(thash)
+
+    def remove(self, thash: str) -> bool:
+        tid = self._ids.get(thash)
+        if tid is None:
+            return False
+        self._index_tags(tid, None)
+        category = self._columns.get('category')
+        if category is not None:
+            self._index_category(tid, category[tid], _MISSING)
+        del self._ids[thash]
+        self._hashes[tid] = None
+        for column in self._columns.values():
+            column[tid] = _MISSING
+        if self._numeric is not None:
+            self._numeric.remove(tid)
+        self._free.append(tid)
+        return True
+
+    def update(self, torrents: dict, removed=()) -> tuple[list[str], list[str]]:
+        """Aplica un delta de sync/maindata (torrents y torrents_removed). Devuelve (nuevos, borrados)"""
+        ids = self._ids
+        set_field = self._set
+        added: list[str] = []
+        for thash, fields in torrents.items():
+            if thash not in ids:
+                added.append(thash)
+            tid = self._intern(thash)
+            for field, value in fields.items():
+                set_field(tid, field, value)
+        gone = [thash for thash in removed if self.remove(thash)]
+        return added, gone
+
+    def remove_tags(self, tags) -> set[str]:
+        """tags_removed: el tag ya no existe en el cliente, se lo quitamos a quien lo tuviera. Devuelve a quien"""
+        affected: set[str] = set()
+        for tag in tags:
+            holders = list(self._by_tag.get(tag, ()))
+            for thash in holders:
+                tid = self._ids[thash]
+                remaining = self._tagsets[tid] - {tag}
+                self._set(tid, 'tags', ", ".join(sorted(remaining)))
+            affected.update(holders)
+        return affected
+
+    def set_tags(self, thash: str, tags) -> bool:
+        """cambio local (optimista) de los tags de un torrent, a la espera de que lo confirme el servidor"""
+        tid = self._ids.get(thash)
+        if tid is None:
+            return False
+        self._set(tid, 'tags', ", ".join(sorted(tags)))
+        return True
+
+    def _differs(self, tid: int, field: str, value) -> bool:
+        if field == 'tags':
+            # el orden de los tags en el str no importa: comparamos conjuntos
+            parsed = self._parsed.get(value) if value else _NO_TAGS
+            if parsed is None:
+                parsed = self._parsed[value] = parse_tags(value)
+            return parsed != self._tagsets[tid]
+        column = self._columns.get(field)
+        return column is None or column[tid] != value
+
+    def replace(self, torrents: dict) -> tuple[list[str], list[str], dict[str, frozenset[str]]]:
+        """
+        full_update: el servidor nos manda el estado completo. En vez de tirar lo que tenemos, se compara
+        campo a campo y solo se aplica lo que ha derivado. Devuelve (nuevos, borrados, hash -> campos cambiados)
+        """
+        ids = self._ids
+        removed = [thash for thash in ids if thash not in torrents]
+        for thash in removed:
+            self.remove(thash)
+        # cache de tags parseados: aprovechamos para no arrastrar strings que ya no usa nadie
+        self._parsed = {}
+
+        set_field, differs = self._set, self._differs
+        added: list[str] = []
+        drifted: dict[str, frozenset[str]] = {}
+        for thash, fields in torrents.items():
+            tid = ids.get(thash)
+            if tid is None:
+                added.append(thash)
+                tid = self._intern(thash)
+                changed = fields.keys()
+            else:
+                changed = [field for field, value in fields.items() if differs(tid, field, value)]
+                if not changed:
+                    continue
+            for field in changed:
+                set_field(tid, field, fields[field])
+            drifted[thash] = frozenset(changed)
+        return added, removed, drifted
+
+    def tags_of(self, thash: str) -> frozenset[str]:
+        tid = self._ids.get(thash)
+        return _NO_TAGS if tid is None else self._tagsets[tid]
+
+    def has_tag(self, thash: str, tag: str) -> bool:
+        return thash in self._by_tag.get(tag, ())
+
+    def with_tag(self, tag: str) -> set[str]:
+        """hashes con el tag. es el propio indice: no modificar"""
+        return self._by_tag.get(tag, _NO_HASHES)
+
+    def in_category(self, category: str) -> set[str]:
+        """hashes de la categoria. es el propio indice: no modificar"""
+        return self._by_category.get(category, _NO_HASHES)
+
+    def rows(self, hashes, *fields):
+        """
+        (hash, tagset, valor de cada campo...) leido directamente de las columnas, sin crear vistas.
+        Para los bucles sobre muchos torrents. Los hashes desconocidos se saltan y los campos que falten son None
+        """
+        ids = self._ids
+        known = [thash for thash in hashes if thash in ids]
+        tids = [ids[thash] for thash in known]
+        tagsets = self._tagsets
+        columns = [known, [tagsets[tid] for tid in tids]]
+        for field in fields:
+            column = self._columns.get(field)
+            if column is None:
+                columns.append([None] * len(tids))
+            else:
+                columns.append([None if value is _MISSING else value for value in (column[tid] for tid in tids)])
+        return zip(*columns)
+
+    # lo que se guarda en el snapshot: el estado y los indices derivados, sin las columnas numericas (se regeneran)
+    _SNAPSHOT_SLOTS: tuple[str, ...] = ('_ids', '_hashes', '_free', '_columns', '_tagsets', '_by_tag', '_by_category', '_parsed')
+
+    def snapshot(self) -> dict:
+        """estado para serializar (pickle). comparte los objetos con el store: serializar antes de volver a tocarlo"""
+        return {slot: getattr(self, slot) for slot in self._SNAPSHOT_SLOTS}
+
+    def restore(self, data: dict) -> None:
+        self.clear()
+        for slot in self._SNAPSHOT_SLOTS:
+            setattr(self, slot, data[slot])
+        # las columnas numericas no van en el snapshot: se vuelven a cargar desde las columnas normales
+        for field, pending in self._pending.items():
+            column = self._columns.get(field)
+            if column is not None:
+                pending.update((tid, value) for tid, value in enumerate(column) if value is not _MISSING)
+
+    def frame(self, hashes) -> Frame | None:
+        """los hashes como arrays alineados para evaluar con numpy. None si no hay columnas numericas"""
+        if self._numeric is None:
+            return None
+        return Frame(self, self._numeric, hashes)
+
+    def table(self) -> TorrentTable:
+        return TorrentTable(self)
+
+    def view(self, thash: str) -> TorrentView | None:
+        tid = self._ids.get(thash)
+        if tid is None:
+            return None
+        return TorrentView(self, tid, thash)
@@ -0,0 +1,151 @@
+import re
+import time
+import threading
+import tldextract
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import logger
+
+# sitios que algun tagger necesita reconocer aunque el usuario no los tenga en tracker_details
+TRACKER_SITES: dict[str, str] = {
+    'HUNO': 'hawke.uno',
+}
+
+
+class TrackerMatch(NamedTuple):
+    rules: tuple[str, ...]      # claves de tracker_details que coinciden, en el orden de la config
+    tags: frozenset[str]        # tags de todas esas reglas
+    hr: object | None           # rules.HRRule de la primera que coincide
+    category: str | None
+    sites: frozenset[str]       # claves de TRACKER_SITES que coinciden
+
+
+class TrackerClassifier:
+    """
+    tracker_details compilado en una sola regex: un lookahead opcional con grupo con nombre por regla,
+    asi una pasada sobre la url dice todas las reglas que coinciden (como el "any(word in tracker)" de antes).
+    El resultado se memoiza por url de announce: miles de torrents comparten un punado de urls.
+    """
+
+    def __init__(self, rules, default_tag: str | None = None, sites: dict[str, str] = TRACKER_SITES) -> None:
+        self._rules = list(rules) # rules.TrackerRule, sin la default
+        self._sites: list[str] = list(sites)
+        self.default_tag: str | None = default_tag
+
+        groups: list[str] = []
+        for i, rule in enumerate(self._rules):
+            words = [word.strip() for word in rule.expr.split("|") if word.strip()]
+            alternatives = '|'.join(map(re.escape, words)) or '(?!)' # sin palabras no coincide con nada
+            groups.append(f"(?=(?P<r{i}>{alternatives}))?")
+        for i, needle in enumerate(sites.values()):
+            groups.append(f"(?=(?P<s{i}>{re.escape(needle)}))?")
+        self._pattern: re.Pattern = re.compile(''.join(groups))
+
+        # todos los tags que puede poner una regla (sin default): los que sobran se quitan
+        self.rule_tags: frozenset[str] = frozenset().union(*(rule.tags for rule in self._rules))
+        self._memo: dict[str, TrackerMatch] = {}
+        self._domains: dict[str, str] = {}
+
+    def _match(self, url: str) -> TrackerMatch:
+        found: set[str] = set()
+        for m in self._pattern.finditer(url):
+            found.update(name for name, value in m.groupdict().items() if value is not None)
+        matched = [self._rules[i] for i in sorted(int(name[1:]) for name in found if name[0] == 'r')]
+        first = matched[0] if matched else None
+        return TrackerMatch(
+            rules=tuple(rule.expr for rule in matched),
+            tags=frozenset().union(*(rule.tags for rule in matched)),
+            hr=first.hr if first else None,
+            category=first.category if first else None,
+            sites=frozenset(self._sites[int(name[1:])] for name in found if name[0] == 's'),
+        )
+
+    def classify(self, url: str | None) -> TrackerMatch:
+        url = url or ''
+        match = self._memo.get(url)
+        if match is None:
+            match = self._memo[url] = self._match(url)
+        return match
+
+    def domain(self, url: str | None) -> str:
+        """tldextract memoizado, para los logs"""
+        url = url or ''
+        domain = self._domains.get(url)
+        if domain is None:
+            domain = self._domains[url] = tldextract.extract(url).domain
+        return domain
+
+
+class TrackerStatusFetcher:
+    """
+    Estado de los trackers (torrents/trackers) de cada torrent, pedido en paralelo con un pool acotado
+    y cacheado por hash durante ttl segundos. La cache se invalida cuando el delta trae cambios de tracker/state.
+    """
+
+    def __init__(self, client, workers: int = 8, ttl: float = 300, name: str = '') -> None:
+        self.client = client
+        self.workers: int = max(1, int(workers))
+        self.ttl: float = ttl
+        self.name: str = name
+        self._cache: dict[str, tuple[float, list]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def invalidate(self, hashes) -> None:
+        with self._lock:
+            for thash in hashes:
+                self._cache.pop(thash, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def _get(self, thash: str):
+        try:
+            return thash, list(self.client.get_trackers(thash))
+        except Exception as e:
+            logger.warning(f"{self.name:<10} - unable to fetch trackers for {thash}: {e}")
+            return thash, None
+
+    def _get_many(self, hashes: list[str]) -> list:
+        # cliente asincrono (aio.BridgedQBit): todas las peticiones en el loop, acotadas por su semaforo
+        fetched = []
+        for thash, trackers in self.client.get_trackers_many(hashes).items():
+            if isinstance(trackers, Exception):
+                logger.warning(f"{self.name:<10} - unable to fetch trackers for {thash}: {trackers}")
+                trackers = None
+            fetched.append((thash, trackers))
+        return fetched
+
+    def fetch(self, hashes) -> dict[str, list]:
+        """hash -> lista de trackers. los que fallan no aparecen en el resultado"""
+        now = time.monotonic()
+        result: dict[str, list] = {}
+        missing: list[str] = []
+        with self._lock:
+            for thash in hashes:
+                cached = self._cache.get(thash)
+                if cached and now - cached[0] < self.ttl:
+                    result[thash] = cached[1]
+                else:
+                    missing.append(thash)
+
+        if not missing:
+            return result
+
+        if hasattr(self.client, 'get_trackers_many'):
+            fetched = self._get_many(missing)
+        elif len(missing) == 1:
+            fetched = [self._get(missing[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(missing)), thread_name_prefix=f"trackers-{self.name}") as pool:
+                fetched = list(pool.map(self._get, missing))
+
+        now = time.monotonic()
+        with self._lock:
+            for thash, trackers in fetched:
+                if trackers is None:
+                    continue
+                self._cache[thash] = (now, trackers)
+                result[thash] = trackers
+        return result
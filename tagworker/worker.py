@@ -3,34 +3,86 @@ import time
 import threading
 import traceback
 import tldextract
-import schedule
 
 from collections import defaultdict
 from datetime import timedelta
-from pytimeparse2 import parse
-from fnmatch import fnmatch
 
 from .config import GlobalConfig
 from .logger import logger
 from .qbit import qBit
-from .files import move_to_dir, is_file, build_inode_map, file_has_outer_links, translate_path, remove_empty_dirs
+from .batch import TagBatch
+from .trackers import TrackerStatusFetcher
+from .events import EventBus, SyncEvents, NO_EVENTS
+from .snapshot import snapshot_path
+from .dupes import HashIndex
+from .scheduler import Scheduler, AsyncScheduler
+from .rules import compile_share_limits, seconds
+from .sharelimits import ShareLimitClassifier
+from . import columnar, aio
+from .files import move_to_dir, is_file, file_has_outer_links, translate_path, remove_empty_dirs, IgnoreMatcher, files_older_than
+from .scan import ShardedScanner, ScanResult, scan_tree
+from .fsindex import FileIndex
+from .filelists import FileListCache, filelists_path, KEY_FIELDS
+from .btbackup import BTBackup
+from .nohl import NoHLTracker
+from .inodes import InodeIndex
+from .quarantine import QuarantineJournal, quarantine_path
 
 METHOD_API: int = 0
 METHOD_DICT: int = 1
 
 DEFAULT_ISSUE_METHOD: int = METHOD_API
 
+# maximo de pasadas de los taggers en un ciclo antes de dar los tags por imposibles de estabilizar
+MAX_TAG_PASSES: int = 10
+
+# campos del delta que interesan a cada consumidor: solo recibe los torrents en los que ha cambiado alguno
+SUBSCRIPTIONS: dict[str, frozenset[str]] = {
+    'tag_trackers': frozenset({'tracker', 'tags'}),
+    'tag_HR': frozenset({'state', 'seeding_time', 'ratio', 'progress', 'tags'}), # a bit spammy
+    'tag_TMM': frozenset({'auto_tmm', 'tags', 'category'}),
+    'tag_issues': frozenset({'tracker', 'state', 'tags'}),
+    'tag_lowseeds': frozenset({'num_complete', 'tags', 'tracker', 'state'}),
+    'tag_HUNO': frozenset({'seeding_time', 'tags'}),
+    'clean_noHL': frozenset({'category', 'tags'}),
+    'set_sharelimits': frozenset({'state', 'category', 'max_seeding_time', 'up_limit', 'tags'}),
+    'tracker_status': frozenset({'tracker', 'state'}),
+    'file_lists': KEY_FIELDS,
+    'tag_dupes': frozenset({'tags'}),
+}
+
 class worker:
     instances: set = set()
-    reacted: dict = dict()
+    # hash -> clientes que lo tienen, de todas las instancias. lo alimenta cada una con sus added/removed
+    hash_index: HashIndex = HashIndex()
 
     new_torrents: bool = False
 
 
     def __init__(self, name: str, config, trackerissue_method: int = DEFAULT_ISSUE_METHOD, tag_interval: int = 15, disk_interval: int = 1800) -> None:
-        self.client: qBit = qBit(config.url, config.user, config.password)
+        tracker_workers: int = GlobalConfig.get('app.tracker_status.workers', 8)
+        use_columnar: bool = GlobalConfig.get('app.columnar', True)
+        request_timeout: float = seconds(GlobalConfig.get('app.scheduler.request_timeout', 30))
+        jitter: float = GlobalConfig.get('app.scheduler.jitter', 0.1)
         self.config: GlobalConfig = config
         self.name: str = name or tldextract.extract(config['url']).domain
+        if use_columnar and not columnar.available():
+            logger.info(f"{self.name:<10} - numpy not installed. numeric taggers will run torrent by torrent")
+
+        use_asyncio: bool = GlobalConfig.get('app.scheduler.engine', 'threads') == 'asyncio'
+        if use_asyncio and not aio.available():
+            logger.warning(f"{self.name:<10} - aiohttp not installed. using the threaded engine")
+            use_asyncio = False
+        if use_asyncio:
+            # E/S de todos los clientes en el mismo loop; los taggers siguen siendo sincronos
+            loop = aio.shared_loop()
+            self.client: qBit = aio.BridgedQBit(config.url, config.user, config.password, loop,
+                                                concurrency=GlobalConfig.get('app.scheduler.concurrency', 8),
+                                                numeric=use_columnar, timeout=request_timeout)
+            self.scheduler: Scheduler = AsyncScheduler(self.name, loop, jitter=jitter)
+        else:
+            self.client: qBit = qBit(config.url, config.user, config.password, pool_size=tracker_workers + 2, numeric=use_columnar, timeout=request_timeout)
+            self.scheduler: Scheduler = Scheduler(self.name, jitter=jitter)
         self.commands: dict[str, bool] = getattr(config, 'commands', {})
         self.folders: dict[str, str] = getattr(config, 'folders', {})
         self.translation_table: dict[str, str] = getattr(config, 'translation_table', {})
@@ -39,10 +91,66 @@ class worker:
         self.dryrun: bool = getattr(config, 'dryrun', True)
         self.local_client: bool = getattr(config, 'local_instance', False)
         self.trackerissue_method: int = trackerissue_method
-
-        self.changes_dict: set = set()
+        self.batch: TagBatch = TagBatch(self.client, self.name)
+        self.tracker_status: TrackerStatusFetcher = TrackerStatusFetcher(
+            self.client,
+            workers=tracker_workers,
+            ttl=seconds(GlobalConfig.get('app.tracker_status.ttl', '5m')),
+            name=self.name,
+        )
+
+        # el delta del sync (o los tags cambiados en la pasada anterior) repartido entre los taggers
+        self.bus: EventBus = EventBus()
+        for consumer, fields in SUBSCRIPTIONS.items():
+            self.bus.subscribe(consumer, fields)
+        self._events: SyncEvents = NO_EVENTS
         self._full_update_time: float = 0
 
+        # snapshot del estado para que un reinicio no empiece con un full sync
+        self.snapshot_path: str = snapshot_path(GlobalConfig.get('app.state_dir', 'state'), self.name)
+        self.snapshot_interval: float = seconds(GlobalConfig.get('app.snapshot_interval', '5m'))
+        self._snapshot_time: float = 0
+
+        self.scanner: ShardedScanner = ShardedScanner(
+            workers=GlobalConfig.get('app.scan.workers', 4),
+            by=GlobalConfig.get('app.scan.shard_by', 'dir'),
+            name=self.name,
+        )
+        self.fsindex: FileIndex | None = None
+        if self.local_client and self.folders.get('root_path') and GlobalConfig.get('app.scan.index', True):
+            self.fsindex = FileIndex(
+                os.path.join(GlobalConfig.get('app.state_dir', 'state'), f"{self.name}.files.sqlite"),
+                self.folders['root_path'],
+                scanner=self.scanner,
+                name=self.name,
+            )
+
+        # BT_backup de qBittorrent en este mismo disco: los ficheros de cada torrent sin pedirlos a la WebUI
+        self.bt_backup: BTBackup | None = None
+        if self.local_client and self.folders.get('bt_backup'):
+            self.bt_backup = BTBackup(self.folders['bt_backup'], name=self.name)
+            if not self.bt_backup.available():
+                logger.warning(f"{self.name:<10} - BT_backup not found at {self.bt_backup.path}. using the WebUI")
+                self.bt_backup = None
+        state_dir: str = GlobalConfig.get('app.state_dir', 'state')
+        self.file_lists: FileListCache = FileListCache(
+            self.client,
+            path=filelists_path(state_dir, self.name) if GlobalConfig.get('app.scan.file_lists', True) else None,
+            workers=tracker_workers,
+            name=self.name,
+            local=self.bt_backup,
+        )
+        # lo que se mueve a orphaned_path, apuntado al moverlo: prune no tiene que recorrer el directorio
+        self.quarantine: QuarantineJournal | None = None
+        if self.local_client and self.folders.get('orphaned_path') and GlobalConfig.get('app.quarantine_journal', True):
+            self.quarantine = QuarantineJournal(quarantine_path(state_dir, self.name), self.folders['orphaned_path'], name=self.name)
+        # si la pasada no cubre orphaned_path, cada cuanto se recorre para apuntar lo que no este en el diario
+        self.quarantine_reconcile: float = seconds(GlobalConfig.get('app.quarantine_reconcile', '1d'))
+        self._quarantine_reconciled: float = 0
+
+        # lo que vio noHL de cada torrent: la siguiente pasada solo evalua lo que ha cambiado
+        self.nohl: NoHLTracker = NoHLTracker()
+
         self.tag_interval: int = tag_interval
         self.disk_interval: int = disk_interval
 
@@ -50,12 +158,12 @@ class worker:
         self.tag_running: threading.Event = threading.Event()
         self.disk_running: threading.Event = threading.Event()
 
-        self.__class__.reacted[self] = False
         self.__class__.instances.add(self)
 
 
     def run(self, singlerun: bool = False):
         if not self.verify_credentials(): return False
+        self.load_snapshot()
 
         if singlerun:
             self.task_tag()
@@ -63,12 +171,13 @@ class worker:
                 self.task_disk()
             return None
 
-        schedule.every(self.tag_interval).seconds.do(self.task_tag)
-        self.task_tag()
-
+        # primero tags (el disco necesita el cliente sincronizado), luego disco, y desde ahi cada uno a su ritmo
+        self.scheduler.every('tag', self.task_tag, self.tag_interval,
+                             timeout=seconds(GlobalConfig.get('app.scheduler.tag_timeout', '5m')))
         if self.local_client:
-            schedule.every(self.disk_interval).seconds.do(self.task_disk)
-            self.task_disk()
+            self.scheduler.every('disk', self.task_disk, self.disk_interval,
+                                 timeout=seconds(GlobalConfig.get('app.scheduler.disk_timeout', '2h')))
+        self.scheduler.start()
         return True
 
 
@@ -102,13 +211,79 @@ class worker:
         self.client.auth_log_out()
 
 
-    def torrents_changed(self, prop):
-        # obtengo la informacion de los cambios de los torrents
-        changed_t = self.client.sync_data.get('torrents', {})
-        # ahora filtro los que no han tenido cambios que nos importen
-        watched_props = [prop] if isinstance(prop, str) else prop
+    def stop(self, timeout: float = 30) -> None:
+        # dejamos acabar lo que este corriendo (sin esperar para siempre a un cliente colgado)
+        if not self.scheduler.stop(timeout):
+            logger.warning(f"{self.name:<10} - {self.scheduler.current} task still running. not waiting for it")
+        for job, stats in self.scheduler.stats().items():
+            logger.info(f"{self.name:<10} - {job} schedule: {stats.summary()}")
+        # con un ciclo de tags a medias el estado no es consistente: nos quedamos con el ultimo snapshot
+        if self.tag_running.is_set():
+            logger.warning(f"{self.name:<10} - tag task running. keeping previous snapshot")
+        else:
+            self.save_snapshot()
+        if self.fsindex is not None:
+            self.fsindex.close()
+        if self.quarantine is not None:
+            self.sync_quarantine()
+            self.quarantine.close()
+        self.save_file_lists()
+        self.logout()
+
+
+    def load_snapshot(self) -> bool:
+        try:
+            loaded = self.client.load_snapshot(self.snapshot_path)
+        except Exception as e:
+            logger.warning(f"{self.name:<10} - unable to load snapshot: {e}")
+            return False
+        if loaded:
+            # el full sync periodico sigue contando desde el ultimo de verdad
+            self._full_update_time = self.client.full_update_time
+            self._snapshot_time = time.time()
+            # no habra added para lo que ya viene en el snapshot
+            self.__class__.hash_index.forget(self.name)
+            self.__class__.hash_index.update(self.name, self.client.torrentdict.keys())
+            logger.info(f"{self.name:<10} - resuming from snapshot ({len(self.client.torrentdict)} torrents)")
+        return loaded
+
+
+    def save_snapshot(self) -> None:
+        try:
+            written = self.client.save_snapshot(self.snapshot_path)
+        except Exception as e:
+            logger.error(f"{self.name:<10} - unable to save snapshot: {e}")
+            return
+        self._snapshot_time = time.time()
+        if written:
+            logger.debug(f"{self.name:<10} - snapshot saved ({written // 1024} KiB)")
+
+
+    def save_file_lists(self) -> None:
+        try:
+            written = self.file_lists.save()
+        except Exception as e:
+            logger.error(f"{self.name:<10} - unable to save file lists: {e}")
+            return
+        if written:
+            logger.debug(f"{self.name:<10} - file lists saved ({written // 1024} KiB)")
+
+
+    def sync_quarantine(self) -> None:
+        try:
+            self.quarantine.sync()
+        except Exception as e:
+            logger.error(f"{self.name:<10} - unable to write quarantine journal: {e}")
+
+
+    def changed_hashes(self, consumer: str) -> list[str]:
+        # cambios de la pasada actual: el delta del sync en la primera, los tags cambiados en local en las siguientes
+        return self.bus.batch(consumer)
+
+
+    def changed_torrents(self, consumer: str):
         all_torrents = self.client.torrentdict
-        return {th: all_torrents[th] for th, tv in changed_t.items() if not watched_props or (watched_props & tv.keys())}
+        return {th: all_torrents[th] for th in self.bus.batch(consumer) if th in all_torrents}
 
 
     def task_tag(self) -> None:
@@ -120,62 +295,79 @@ class worker:
         sl_torrent_queue = set()
 
         try:
-            while True:
-                prev_torrents = set(self.client.torrentdict.keys())
-
-                request_fullsync = time.time() - self._full_update_time > parse(GlobalConfig.get('app.fullsync_interval'))
-                if request_fullsync:
-                    logger.info("%-10s - *** FULL SYNC ***", self.name)
-                    self._full_update_time = time.time()
-                self.client.do_sync(request_fullsync)
-
-                tag_funcs = {
-                    'tag_trackers': self.tag_trackers,
-                    'tag_HR': self.tag_HR,
-                    'scan_no_tmm': self.tag_TMM,
-                    'tag_issues': self.tag_issues,
-                    'tag_rename': self.tag_rename,
-                    'tag_lowseeds': self.tag_lowseeds,
-                    'tag_HUNO': self.tag_HUNO,
-                }
-
-                tags_changed: bool = False
+            request_fullsync = time.time() - self._full_update_time > GlobalConfig.rules.fullsync_interval
+            if request_fullsync:
+                logger.info("%-10s - *** FULL SYNC ***", self.name)
+                self._full_update_time = time.time()
+            self._events = self.client.do_sync(request_fullsync)
+            self.bus.publish(self._events)
+            if self._events.full_update:
+                drift = self.client.drift
+                fields = ', '.join(f"{field}: {count}" for field, count in sorted(drift.fields.items(), key=lambda item: -item[1]))
+                logger.info(f"{self.name:<10} - full sync drift: {drift.torrents} torrents changed{' (' + fields + ')' if fields else ''}, {drift.added} added, {drift.removed} removed")
+
+            self.tracker_status.invalidate(self.changed_hashes('tracker_status'))
+            self.tracker_status.invalidate(self._events.removed)
+            self.file_lists.invalidate(self.changed_hashes('file_lists'))
+            self.file_lists.invalidate(self._events.removed)
+            if self.bt_backup is not None:
+                self.bt_backup.forget(self._events.removed)
+            self.nohl.forget(self._events.removed)
+
+            if self._events.added or self._events.removed:
+                logger.debug(f"{self.name:<10} - torrentlist changed: {len(self._events.added)} added, {len(self._events.removed)} removed")
+                self.__class__.hash_index.update(self.name, self._events.added, self._events.removed)
+
+            tag_funcs = {
+                'tag_trackers': self.tag_trackers,
+                'tag_HR': self.tag_HR,
+                'scan_no_tmm': self.tag_TMM,
+                'tag_issues': self.tag_issues,
+                'tag_rename': self.tag_rename,
+                'tag_lowseeds': self.tag_lowseeds,
+                'tag_HUNO': self.tag_HUNO,
+            }
+
+            # los cambios de tags se aplican en local al momento: repetimos los taggers solo sobre
+            # los torrents que han cambiado en la pasada anterior hasta que no haya mas cambios
+            for tag_pass in range(MAX_TAG_PASSES):
                 for key, func in tag_funcs.items():
                     if self.commands.get(key, False):
                         changes = func()
                         if changes: logger.debug(f"{self.name:<10} - {key} made changes.")
-                        tags_changed |= changes
-
-                # curr_torrents = set(self.client.status.get('torrents', {}).keys())
-                curr_torrents = set(self.client.torrentdict.keys())
-                if curr_torrents != prev_torrents:
-                    logger.info(f"{self.name:<10} - torrentlist changed. broadcasting need to check dupes")
-                    # podria estar ya a true y con alguna instancia ya reaccionada. estas se lo podrian perder
-                    self.__class__.reacted = {key: False for key in self.__class__.reacted}
-
-                # si el usuario quiere, si han habido novedades desde el ultimo scan
-                # ... y si el resto de instancias estan ya pobladas!
-                # tag_dupes devuelve None si no encuentra ningun otro cliente poblado
-                if GlobalConfig.get('app.dupes.enabled', False) and not self.__class__.reacted[self]:
-                    try:
-                        tags_changed |= self.tag_dupes()
-                        self.__class__.reacted[self] = True
-                    except Exception as e:
-                        if str(e) != "Not all clients are synced": raise
-
-                tags_changed |= self.clean_noHL()
-
-                sl_torrent_queue |= set(self.torrents_changed({'state', 'category', 'max_seeding_time', 'up_limit', 'tags'}).keys())
-
-                if tags_changed:
-                    logger.debug(f"{self.name:<10} - changes have been made. looping...")
-                    time.sleep(5)
-                else:
-                    # cuando los tags están en orden es cuando ajustamos SL
-                    if self.commands.get('share_limits', False): self.set_sharelimits(sl_torrent_queue)
-                    sl_torrent_queue.clear()
+
+                # solo mira los hashes que han entrado o salido de algun cliente (y los que han cambiado de tags)
+                if GlobalConfig.get('app.dupes.enabled', False):
+                    self.tag_dupes()
+
+                self.clean_noHL()
+
+                sl_torrent_queue.update(self.changed_hashes('set_sharelimits'))
+
+                touched = self.batch.take_touched()
+                if not touched:
                     break
+                logger.debug(f"{self.name:<10} - changes have been made. looping...")
+                self._events = SyncEvents.local(touched)
+                self.bus.publish(self._events)
+            else:
+                logger.warning(f"{self.name:<10} - tags did not converge after {MAX_TAG_PASSES} passes")
+
+            # cuando los tags están en orden es cuando ajustamos SL
+            if self.commands.get('share_limits', False): self.set_sharelimits(sl_torrent_queue)
+
+            # una sola tanda de peticiones con todos los cambios de tags del ciclo.
+            # el delta del siguiente sync confirma lo que ya tenemos en local
+            self.batch.flush()
+
+            # desde aqui dentro nadie mas toca el estado mientras se serializa
+            if self.snapshot_interval and time.time() - self._snapshot_time > self.snapshot_interval:
+                self.save_snapshot()
         finally:
+            # si algo ha fallado a mitad de ciclo, deshacemos lo no enviado y el siguiente lo recalcula
+            self.batch.rollback()
+            self._events = NO_EVENTS
+            self.bus.clear()
             self.tag_running.clear()
 
 
@@ -183,14 +375,10 @@ class worker:
         if not self.local_client:
             return
 
-        BUSY_WAIT: int = 5
-        while not self.client.synced:
-            logger.warning(f"{self.name:<10} - Client not synced yet. Retrying in {BUSY_WAIT}s...")
-            time.sleep(BUSY_WAIT)
-        while self.tag_running.is_set():
-            logger.warning(f"{self.name:<10} - Busy. Retrying in {BUSY_WAIT}s... ({self.tag_running.is_set() = }) ")
-            time.sleep(BUSY_WAIT)
-            # return
+        # tags y disco van en el mismo hilo del cliente: aqui ya no puede estar corriendo el de tags
+        if not self.client.synced:
+            logger.warning(f"{self.name:<10} - Client not synced yet. Skipping disk task")
+            return
         if self.disk_running.is_set():
             logger.warning(f"{self.name:<10} - Busy. (Already executing. Skipping.)")
             return
@@ -203,90 +391,127 @@ class worker:
         logger.debug(f"{self.name:<10} - disk task started")
 
         try:
+            # una sola pasada por root para todas las tareas; cada una quita del resultado lo que mueve o borra
+            result: ScanResult | None = None
+            if self.folders.get('root_path') and any(commands.get(command) for command in (
+                    'tag_noHL', 'clean_orphaned', 'prune_orphaned', 'delete_empty_dirs')):
+                result = self.scan_disk()
 
             if commands.get('tag_noHL'):
                 # logger.info(f"{self.name:<10} - checking hardlinks")
-                tagged = self.disk_noHL()
+                tagged = self.disk_noHL(result)
             if commands.get('clean_orphaned'):
                 # logger.info(f"{self.name:<10} - moving orphan files")
-                self.disk_orphans(dry_run)
+                self.disk_orphans(dry_run, result)
 
             if commands.get('prune_orphaned'):
                 # logger.info(f"{self.name:<10} - pruning old orphans")
-                self.disk_prune_old(dry_run)
+                self.disk_prune_old(dry_run, result)
 
             if commands.get('delete_empty_dirs'):
-                remove_empty_dirs(self.folders.get('root_path'), dry_run, self.name)
+                remove_empty_dirs(self.folders.get('root_path'), dry_run, self.name, scanner=self.scanner, result=result)
 
         except Exception as e:
             logger.error(f"Error: {e}\n{traceback.format_exc()}")
         finally:
+            self.save_file_lists()
+            if self.quarantine is not None:
+                self.sync_quarantine()
             self.disk_running.clear()
 
         logger.debug(f"{self.name:<10} - disk task done")
         if tagged:
             logger.debug(f"{self.name:<10} - triggering tag task")
-            threading.Thread(target=self.task_tag).start()
+            if self.scheduler.running:
+                self.scheduler.trigger('tag')
+            else:
+                self.task_tag()
         # if singlerun: break
 
 
-    def disk_orphans(self, dry_run: bool = True) -> None:
+    def scan_disk(self) -> ScanResult:
+        """
+        La pasada por root que comparten noHL, huerfanos, prune y directorios vacios.
+        Con indice: se pone al dia (un stat por directorio + lo cambiado) y las tareas lo consultan sin cargarlo;
+        si no, se recorre root por shards
+        """
+        if self.fsindex is not None:
+            self.fsindex.refresh()
+            return self.fsindex.result()
+        start: float = time.perf_counter()
+        result: ScanResult = scan_tree(self.folders['root_path'], self.scanner)
+        logger.debug(f"{self.name:<10} - disk scan: {len(result.dirs)} dirs, {len(result)} files in {time.perf_counter() - start:.2f}s")
+        return result
+
+    def disk_orphans(self, dry_run: bool = True, result: ScanResult | None = None) -> None:
         root: str = os.path.abspath(self.folders["root_path"])
         orphan: str = os.path.abspath(self.folders["orphaned_path"])
+        if result is None:
+            result = self.scan_disk()
 
-        # patrones absolutos + POSIX
-        pats: list[str] = [
-            os.path.abspath(os.path.join(root, p)).replace(os.sep, "/")
-            for p in self.folders.get("orphaned_ignored", [])
-        ]
-
-        def ignored(path: str) -> bool:
-            p = path.replace(os.sep, "/")
-            return any(fnmatch(p, pat) for pat in pats)
-
-        # recopilar archivos
-        hd_files: set[str] = set()
-
-        for r, dirs, files in os.walk(root):
-            r_abs: str = os.path.abspath(r)
-
-            if r_abs.startswith(orphan):
-                dirs[:] = []
-                continue
-
-            # filtrar dirs ignorados
-            dirs[:] = [
-                d for d in dirs
-                if not ignored(os.path.abspath(os.path.join(r, d)))
-            ]
-
-            # añadir archivos no ignorados
-            for f in files:
-                full: str = os.path.abspath(os.path.join(r, f))
-                if not ignored(full):
-                    hd_files.add(os.path.normpath(full))
+        # patrones compilados una vez; los directorios ignorados (y el de huerfanos) ni se miran
+        ignore = IgnoreMatcher(root, self.folders.get("orphaned_ignored", []))
+        hd_files: set[str] = result.scan_files(ignore, skip=orphan)
 
         # archivos referenciados
         total_referenced: set[str] = set()
 
-        for thash, t in self.client.torrentdict.items():
+        torrents = self.client.torrentdict
+        # primera pasada: que es cada content_path. las listas de ficheros que falten se piden todas a la vez
+        kinds: dict[str, tuple[str, bool | None]] = {}
+        for thash, t in torrents.items():
             content_path: str = str(t.get("content_path"))
             if not content_path:
                 # si no hay content_path, no hay referencia a comprobar
                 continue
-
-            p: str = translate_path(content_path, self.translation_table)
-            p = os.path.abspath(p)
+            p: str = os.path.abspath(translate_path(content_path, self.translation_table))
+            kinds[thash] = (p, is_file(p))
+        self.file_lists.retain(torrents)
+
+        def listed_paths(thash: str, names) -> set[str]:
+            save_path: str = torrents[thash].get('save_path', '')
+            return {
+                os.path.normpath(os.path.abspath(translate_path(os.path.join(save_path, name), self.translation_table)))
+                for name in names
+            }
+
+        def exists(path: str) -> bool:
+            return result.stat(path) is not None if result.covers(path) else os.path.lexists(path)
+
+        listed: dict[str, tuple[object, set[str]]] = {}
+        def unlisted(thash: str, names) -> frozenset[str]:
+            # un fichero renombrado dentro del torrent no cambia save_path, content_path ni name: la lista guardada
+            # sigue con el nombre viejo y el nuevo pareceria huerfano. se compara con la pasada por el disco lo que deja
+            # un rename: un fichero que la lista no tiene y uno de la lista que no esta. solo completos: los
+            # incompletos tienen sus .!qB y los ficheros que aun no se han empezado
+            paths = listed_paths(thash, names)
+            listed[thash] = (names, paths)
+            if torrents[thash].get('progress', 0) != 1:
+                return frozenset()
+            extra = frozenset(f for f, _ in result.walk_files(kinds[thash][0]) if f in hd_files and f not in paths)
+            if not extra or all(exists(f) for f in paths):
+                return frozenset()
+            return extra
+
+        file_lists: dict[str, list[str]] = self.file_lists.fetch(
+            {thash: torrents[thash] for thash, (_, isfile) in kinds.items() if isfile is False}, unlisted=unlisted,
+        )
+
+        for thash, (p, isfile) in kinds.items():
+            t = torrents[thash]
             referenced: set[str]
 
-            if os.path.isfile(p):
+            if isfile:
                 referenced = {os.path.normpath(p)}
-            elif os.path.isdir(p):
-                # obtener la lista de ficheros del torrent y normalizar rutas
-                referenced = {
-                    os.path.normpath(os.path.abspath(translate_path(f, self.translation_table)))
-                    for f in self.client.torrent_files(thash)
-                }
+            elif isfile is False:
+                if thash not in file_lists:
+                    # sin su lista no se sabe que es suyo: mejor no dar nada por huerfano dentro
+                    hd_files = {f for f in hd_files if not f.startswith(p + os.sep)}
+                    continue
+                # la lista del torrent con las rutas normalizadas (ya hechas si se ha comprobado contra el disco)
+                names, referenced = listed.get(thash, (None, None))
+                if names is not file_lists[thash]:
+                    referenced = listed_paths(thash, file_lists[thash])
             else:
                 if t.get("state") in ["error", "missingFiles"] or t.get("progress", 0) != 1:
                     continue
@@ -296,7 +521,7 @@ class worker:
             if total_referenced & referenced:
                 logger.warning(
                     f"{self.name:<10} - Tracker-dupe? {t.get('name', '<unknown>')} "
-                    f"({tldextract.extract(t.get('tracker', '')).domain}) files belong to multiple torrents"
+                    f"({GlobalConfig.rules.trackers.domain(t.get('tracker', ''))}) files belong to multiple torrents"
                 )
 
             total_referenced |= referenced
@@ -312,35 +537,56 @@ class worker:
         if condom > 0 and len(orphans) > condom:
             dry_run = True
             logger.warning(f"Found {len(orphans)} orphans. Enforcing dry-run!")
+        if self.quarantine is not None and not dry_run:
+            # cargado (o creado con lo que ya haya en orphaned_path) antes de mover nada
+            self.quarantine.load()
         for f in sorted(orphans):
             if dry_run:
                 logger.info(f"{self.name:<10} - *** DRY-RUN *** moved {f} to {orphan}")
             else:
-                move_to_dir(root, orphan, f)
+                move_to_dir(root, orphan, f, self.quarantine)
+                result.discard(f)
                 logger.info(f"{self.name:<10} - moved {f} to {orphan}")
 
 
 
-    def disk_prune_old(self, dry_run: bool = True) -> None:
+    def disk_prune_old(self, dry_run: bool = True, result: ScanResult | None = None) -> None:
         path: str = self.folders.get('orphaned_path', '')
-        expire_time: float = parse(GlobalConfig.get("app.prune_orphaned_time", 0))
+        expire_time: float = GlobalConfig.rules.prune_orphaned_time
 
         time_limit: float = time.time() - expire_time
-        files_to_delete: set[str] = set()
-
-        for root, _, files in os.walk(path):
-            for filename in files:
-                fullpath: str = os.path.join(root, filename)
-                mod_time: float = os.path.getmtime(fullpath)
-                if mod_time < time_limit:
-                    files_to_delete.add(fullpath)
+        if not os.path.isdir(path):
+            return
+        if self.quarantine is not None:
+            # lo que llego a orphaned_path sin pasar por move_to_dir: con lo que ya vio la pasada, o recorriendolo de vez en cuando
+            if result is not None and result.covers(path):
+                self.quarantine.reconcile(fullpath for fullpath, _ in result.walk_files(path))
+            elif time.time() - self._quarantine_reconciled > self.quarantine_reconcile:
+                self.quarantine.reconcile()
+                self._quarantine_reconciled = time.time()
+            # lo caducado sale del diario por orden de hora: ni recorrido ni un stat por fichero
+            files_to_delete: list[str] | set[str] = [entry.moved for entry in self.quarantine.expired(time_limit)]
+        elif result is not None and result.covers(path):
+            files_to_delete = result.files_older_than(path, time_limit)
+        else:
+            files_to_delete = set().union(*self.scanner.run(
+                path, lambda shard: files_older_than(shard.path, time_limit, shard.recursive), label='prune',
+            ))
 
         if files_to_delete:
             logger.info(f"%-10s - Deleting {len(files_to_delete)} old orphans.", self.name)
             try:
                 for fullpath in files_to_delete:
                     if not dry_run:
-                        os.remove(fullpath)
+                        try:
+                            os.remove(fullpath)
+                        except FileNotFoundError:
+                            # borrado a mano: solo falta quitarlo del diario
+                            pass
+                        if self.quarantine is not None:
+                            self.quarantine.discard(fullpath)
+                        if result is not None:
+                            result.discard(fullpath)
                         logger.info(f"%-10s - Deleted {os.path.basename(fullpath)}", self.name)
                     else:
                         logger.info(f"%-10s - *** DRY-RUN *** deleted {os.path.basename(fullpath)}", self.name)
@@ -348,13 +594,13 @@ class worker:
                 logger.warning(f'%-10s - Error trying to delete file {fullpath}: {e}', self.name)
 
 
-    def disk_noHL(self) -> bool:
+    def disk_noHL(self, result: ScanResult | None = None) -> bool:
         # creamos una lista con todos los inodos dentro del root_path y cuantas veces aparecen
         # posteriormente miramos los torrents uno a uno
         # si tiene HL fuera, el fichero deberia tener una cantidad de links superior a los que hemos encontrado
         #
         # en caso de multifile miraremos fichero a fichero sus contenidos hasta encontrar alguno que si tenga HL fuera
-        def torrent_has_HL(torrent, inode_map, translation_table) -> bool:
+        def torrent_has_HL(thash, torrent, inode_map, translation_table) -> bool:
             # TODO en que situacion esta vacio?? soltar excepcion?? continuar??
             # try:
             content_path: str|None = torrent.get("content_path", None)
@@ -363,6 +609,12 @@ class worker:
             # except:
                 # pass
             realfile: str = translate_path(content_path, translation_table)
+            if result.covers(realfile):
+                # lo que vio la pasada (ni isdir/isfile ni walk del torrent), y solo si ha cambiado desde la anterior
+                has_HL = self.nohl.has_HL(thash, realfile, result, inode_map)
+                if has_HL is not None:
+                    return has_HL
+                # no estaba (o cuelga de un enlace a directorio): se mira en disco
             if is_file(realfile):
                 return file_has_outer_links(realfile, inode_map)
             # FIXME iterar contenidos del content_path. si hay algun HL lo damos por bueno
@@ -385,15 +637,19 @@ class worker:
 
         if not torrents:
             return False
-        inode_map: dict[int, int] = build_inode_map(root_path)
+        if result is None:
+            result = self.scan_disk()
+        inode_map: InodeIndex = result.inode_index()
+        self.nohl.retain(torrents)
+        self.nohl.reset_counters()
         noHLs, addtag, deltag = set(), set(), set()
         for thash, torrent in torrents.items():
             # if torrent.get("category") not in noHL_cats:
                 # continue
 
-            tagged: bool = noHL_tag in torrent.get("tags", "").split(", ")
+            tagged: bool = noHL_tag in torrent.tagset
 
-            if torrent.get("category", '') in noHL_cats and torrent.get("progress", 0) == 1 and not torrent_has_HL(torrent, inode_map, translation_table):
+            if torrent.get("category", '') in noHL_cats and torrent.get("progress", 0) == 1 and not torrent_has_HL(thash, torrent, inode_map, translation_table):
                 noHLs.add(thash)
                 if not tagged:
                     logger.info(f"{self.name:<10} - noHL: {torrent.get('name')}")
@@ -401,10 +657,12 @@ class worker:
             elif tagged:
                 logger.info(f"{self.name:<10} - found link for: {torrent.get('name', 'Unknown')}")
                 deltag.add(thash)
+        logger.debug(f"{self.name:<10} - noHL: {self.nohl.evaluated} torrents evaluated, {self.nohl.reused} with the same outer link, {self.nohl.stats} stats")
 
         if addtag or deltag:
-            if addtag: self.client.add_tags(addtag, noHL_tag)
-            if deltag: self.client.remove_tags(deltag, noHL_tag)
+            if addtag: self.batch.add(addtag, noHL_tag)
+            if deltag: self.batch.remove(deltag, noHL_tag)
+            self.batch.flush()
             logger.info(f"{self.name:<10} - {len(noHLs)} noHL. New {len(addtag)} - Untagged {len(deltag)}")
             return True
         return False
@@ -423,8 +681,8 @@ class worker:
             raise Exception("noHL tag not set")
 
         noHL_cats: list[str] = GlobalConfig.get("app.noHL.categories", [])
-        torrents: dict[str, dict[str, str]] = self.torrents_changed({'category', 'tags'})
-        torrents = {th: tval for th, tval in torrents.items() if noHL_tag in tval['tags'].split(", ")} # filter torrents by noHL tag
+        torrents: dict[str, dict[str, str]] = self.changed_torrents('clean_noHL')
+        torrents = {th: tval for th, tval in torrents.items() if noHL_tag in tval.tagset} # filter torrents by noHL tag
         hashes: set[str] = set()
         if not self.commands.get('tag_noHL'):
             hashes.update(set(torrents.keys()))
@@ -435,86 +693,103 @@ class worker:
                     logger.info(f"{self.name:<10} - Untagged {noHL_tag} {torrent.get('name')}: disabled category")
                     hashes.add(thash)
         if hashes:
-            self.client.remove_tags(hashes, noHL_tag)
+            self.batch.remove(hashes, noHL_tag)
         return bool(hashes)
 
     def tag_lowseeds(self) -> bool:
-        torrents: dict[str, dict[str, str]] = self.torrents_changed({'num_complete', 'tags', 'tracker', 'state'})
-        if not torrents:
+        hashes: list[str] = self.changed_hashes('tag_lowseeds')
+        if not hashes:
             return False
 
         addtag: set = set()
         deltag: set = set()
         tag: str = GlobalConfig.get("app.lowseeds.tag", '')
         min_seeds: int = GlobalConfig.get("app.lowseeds.min_seeds", 0)
-        for thash, torrent in torrents.items():
-            tags: list[str] = torrent.get("tags", "").split(", ")
-            seeds: int = int(torrent.get('num_complete', 0))
-            if torrent.get("progress", 0) != 1 or torrent.get('state','') in ['stoppedUP', 'pausedUP', 'pausedDL', 'error', 'unknown']: # filtramos solos los que estan vivos XD
-                continue
-            if seeds < min_seeds and isinstance(seeds, int):
-                if tag not in tags:
-                    addtag.add(thash)
-            elif tag in tags:
-                deltag.add(thash)
+
+        frame = self.client.torrent_frame(hashes)
+        if frame is not None:
+            alive = (frame.column('progress') == 1) & ~frame.isin('state', {'stoppedUP', 'pausedUP', 'pausedDL', 'error', 'unknown'})
+            low = frame.column('num_complete', missing=0) < min_seeds
+            tagged = frame.has_tag(tag)
+            addtag = frame.hashes_where(alive & low & ~tagged)
+            deltag = frame.hashes_where(alive & ~low & tagged)
+        else:
+            all_torrents = self.client.torrentdict
+            for thash in hashes:
+                torrent = all_torrents[thash]
+                tags: frozenset[str] = torrent.tagset
+                seeds: int = int(torrent.get('num_complete', 0))
+                if torrent.get("progress", 0) != 1 or torrent.get('state','') in ['stoppedUP', 'pausedUP', 'pausedDL', 'error', 'unknown']: # filtramos solos los que estan vivos XD
+                    continue
+                if seeds < min_seeds and isinstance(seeds, int):
+                    if tag not in tags:
+                        addtag.add(thash)
+                elif tag in tags:
+                    deltag.add(thash)
 
         if addtag:
-            self.client.add_tags(addtag, tag)
+            self.batch.add(addtag, tag)
         if deltag:
-            self.client.remove_tags(deltag, tag)
+            self.batch.remove(deltag, tag)
         return bool(addtag or deltag)
 
     def tag_dupes(self) -> bool:
-        if not len(self.__class__.instances) > 1: # 1 is me!
-            logger.warning(f"{self.name:<10} - no other clients. skipping dupe tagging")
-            return False
-        torrents: set[str] = set()
         for instance in self.__class__.all_instances_iterator():
-            if instance == self: continue # my torrents are not dupes!
             if not instance.client.synced:
-                logger.warning(f"{self.name:<10} - not all clients are synced. skipping dupe tagging")
-                raise Exception("Not all clients are synced")
-            torrents.update(instance.client.torrentdict.keys())
+                # sus torrents aun no estan en el indice: esperamos, lo pendiente se queda ahi
+                logger.debug(f"{self.name:<10} - not all clients are synced. skipping dupe tagging")
+                return False
+
+        index: HashIndex = self.__class__.hash_index
+        my_torrents = self.client.torrentdict
+        candidates: set[str] = index.take_dirty(self.name)
+        candidates.update(self.changed_hashes('tag_dupes'))
+        candidates &= my_torrents.keys()
+        if not candidates:
+            return False
 
-        my_torrents: dict[str, dict[str, str]] = self.client.torrentdict
-        dupes: set[str] = torrents & set(my_torrents.keys())
+        dupes: set[str] = index.dupes(candidates)
         dupetag: str = GlobalConfig.get("app.dupes.tag", '')
 
-        addtag: set[str] = set()
-        deltag: set[str] = set()
-        for thash, tval in my_torrents.items():
-            tags = my_torrents[thash]['tags'].split(", ")
-            if dupetag in tags:
-                if thash not in dupes:
-                    logger.debug(f"{self.name:<10} - {tval['name']} should not be marked as dupe")
-                    deltag.add(thash)
-            elif thash in dupes:
-                    logger.debug(f"{self.name:<10} - {tval['name']} is a dupe")
-                    addtag.add(thash)
+        tagged: set[str] = self.client.torrents_with_tag(dupetag) & candidates
+        addtag: set[str] = dupes - tagged
+        deltag: set[str] = tagged - dupes
+        for thash in deltag:
+            logger.debug(f"{self.name:<10} - {my_torrents[thash]['name']} should not be marked as dupe")
+        for thash in addtag:
+            logger.debug(f"{self.name:<10} - {my_torrents[thash]['name']} is a dupe")
 
-        if addtag: self.client.add_tags(addtag, dupetag) # taguea dupes
-        if deltag: self.client.remove_tags(deltag, dupetag)
+        if addtag: self.batch.add(addtag, dupetag) # taguea dupes
+        if deltag: self.batch.remove(deltag, dupetag)
 
-        logger.info(f"{self.name:<10} - Found {len(dupes)} dupes across all clients. Tagged {len(addtag)} - Untagged {len(deltag)}")
+        if addtag or deltag:
+            logger.info(f"{self.name:<10} - Checked {len(candidates)} hashes across {len(self.__class__.instances)} clients. Tagged {len(addtag)} - Untagged {len(deltag)}")
 
         return bool(addtag or deltag)
 
     def tag_issues(self):
-        torrents = self.torrents_changed({'tracker', 'state', 'tags'})
+        torrents = self.changed_torrents('tag_issues')
 
         if not torrents:
             return False
 
         errored, unerrored = set(), set()
         errortag = GlobalConfig.get("app.issue.tag")
+        inactive_states = {'stoppedUP', 'pausedUP', 'pausedDL', 'error', 'unknown'}
+
+        if self.trackerissue_method == METHOD_API:
+            # todas las peticiones de golpe, en paralelo y tirando de cache
+            trackers = self.tracker_status.fetch(th for th, t in torrents.items() if t.get('state') not in inactive_states)
+
         for thash, torrent in torrents.items():
-            ttags = torrent.get("tags", "").split(", ")
-            if torrent.get('state') in ['stoppedUP', 'pausedUP','pausedDL', 'error', 'unknown']:
+            ttags = torrent.tagset
+            if torrent.get('state') in inactive_states:
                 if errortag in ttags:
                     unerrored.add(thash)
                 continue
             if self.trackerissue_method == METHOD_API:
-                response = self.client.get_trackers(thash)
+                response = trackers.get(thash)
+                if response is None: continue # no se ha podido consultar. lo dejamos como esta
                 working = False
                 errormsg = ""
                 for tracker in response:
@@ -528,74 +803,95 @@ class worker:
                 working = torrent.get('tracker')
             if not working:
                 if errortag not in ttags:
-                    logger.debug(f"{self.name:<10} - errored {tldextract.extract(torrent['tracker']).domain}: {torrent['name']} {'(' + errormsg + ')' if errormsg else ''}")
+                    logger.debug(f"{self.name:<10} - errored {GlobalConfig.rules.trackers.domain(torrent['tracker'])}: {torrent['name']} {'(' + errormsg + ')' if errormsg else ''}")
                     errored.add(thash)
             elif errortag in ttags:
-                logger.debug(f"{self.name:<10} - fixed {tldextract.extract(torrent['tracker']).domain}: {torrent['name']} ")
+                logger.debug(f"{self.name:<10} - fixed {GlobalConfig.rules.trackers.domain(torrent['tracker'])}: {torrent['name']} ")
                 unerrored.add(thash)
 
         if errored:
-            self.client.add_tags(errored, errortag)
+            self.batch.add(errored, errortag)
             logger.info(f"{self.name:<10} - {len(errored)} torrents with tracker issues")
 
         if unerrored:
-            self.client.remove_tags(unerrored, errortag)
+            self.batch.remove(unerrored, errortag)
             logger.info(f"{self.name:<10} - {len(unerrored)} torrents fixed")
 
         return bool(errored or unerrored)
 
     def tag_HR(self):
-        torrents = self.torrents_changed({'state', 'seeding_time', 'ratio', 'progress', 'tags'}) # a bit spammy
+        hashes = self.changed_hashes('tag_HR')
         client = self.client
 
-        if not torrents:
+        if not hashes:
             return False
 
-        tracker_rules = GlobalConfig.get("tracker_details")
-        hr_tag = GlobalConfig.get("app.HR.tag")
-        exclude_xseed = GlobalConfig.get("app.HR.exclude_xseed")
-        autostart_hr = GlobalConfig.get("app.HR.autostart")
-        extra_time = GlobalConfig.get("app.HR.extra_seed_time")
-        extra_ratio = GlobalConfig.get("app.HR.extra_ratio")
+        classify = GlobalConfig.rules.trackers.classify
+        hr_tag, extra_time, extra_ratio, exclude_xseed, autostart_hr = GlobalConfig.rules.hr
 
         unsatisfied = set()
         satisfied = set()
         autostart = set()
 
-        for thash, torrent in torrents.items():
-            seeding_time = torrent['seeding_time']
-            torrent_ratio = torrent['ratio']
-            torrent_tags = torrent.get("tags", "").split(", ")
-
-            for key, rules in tracker_rules.items():
-                if any(word in torrent['tracker'] for word in key.split("|")):
-                    hr = getattr(rules, 'HR', None)
-                    # satisfied
-                    if (
-                        not hr
-                        or (seeding_time > parse(hr.time) + parse(extra_time))
-                        or (getattr(hr,'ratio', None) and torrent_ratio > hr.ratio + extra_ratio)
-                        or (exclude_xseed and torrent['downloaded'] == 0)
-                        or (getattr(hr, 'percent', None) and (torrent['downloaded'] < (hr.percent/100) * torrent['size']))
-                        ):
-                        if hr_tag in torrent_tags:
-                            logger.debug(f"{self.name:<10} - {torrent.name} now satisfied.")
-                            satisfied.add(thash)
-                    # H&R
-                    else:
-                        if hr_tag not in torrent_tags:
-                            unsatisfied.add(thash)
-                        if torrent['state'] in {'stoppedUP', 'pausedUP'}:  # y queuedUP ??
-                            autostart.add(thash)
-                    break
+        frame = client.torrent_frame(hashes)
+        if frame is not None:
+            # las reglas de H&R dependen del tracker: una tabla por url de announce distinta
+            def hr_value(field):
+                return lambda url: getattr(classify(url).hr, field, None) or 0
+            has_rules = frame.lookup('tracker', lambda url: bool(classify(url).rules), bool)
+            has_hr = frame.lookup('tracker', lambda url: classify(url).hr is not None, bool)
+            hr_time, hr_ratio, hr_percent = (frame.lookup('tracker', hr_value(field)) for field in ('time', 'ratio', 'percent'))
+            downloaded = frame.column('downloaded')
+            is_satisfied = (
+                ~has_hr
+                | (frame.column('seeding_time') > hr_time + extra_time)
+                | ((hr_ratio != 0) & (frame.column('ratio') > hr_ratio + extra_ratio))
+                | (bool(exclude_xseed) & (downloaded == 0))
+                | ((hr_percent != 0) & (downloaded < (hr_percent/100) * frame.column('size')))
+            )
+            tagged = frame.has_tag(hr_tag)
+            satisfied = frame.hashes_where(has_rules & is_satisfied & tagged)
+            unsatisfied = frame.hashes_where(has_rules & ~is_satisfied & ~tagged)
+            autostart = frame.hashes_where(has_rules & ~is_satisfied & frame.isin('state', {'stoppedUP', 'pausedUP'}))
+            for thash in satisfied:
+                logger.debug(f"{self.name:<10} - {client.torrentdict[thash].name} now satisfied.")
+        else:
+            all_torrents = client.torrentdict
+            for thash in hashes:
+                torrent = all_torrents[thash]
+                seeding_time = torrent['seeding_time']
+                torrent_ratio = torrent['ratio']
+                torrent_tags = torrent.tagset
+
+                match = classify(torrent['tracker'])
+                if not match.rules:
+                    continue
+                hr = match.hr
+                # satisfied
+                if (
+                    not hr
+                    or (seeding_time > hr.time + extra_time)
+                    or (hr.ratio and torrent_ratio > hr.ratio + extra_ratio)
+                    or (exclude_xseed and torrent['downloaded'] == 0)
+                    or (hr.percent and (torrent['downloaded'] < (hr.percent/100) * torrent['size']))
+                    ):
+                    if hr_tag in torrent_tags:
+                        logger.debug(f"{self.name:<10} - {torrent.name} now satisfied.")
+                        satisfied.add(thash)
+                # H&R
+                else:
+                    if hr_tag not in torrent_tags:
+                        unsatisfied.add(thash)
+                    if torrent['state'] in {'stoppedUP', 'pausedUP'}:  # y queuedUP ??
+                        autostart.add(thash)
 
         if unsatisfied:
             logger.info(f'%-10s - {len(unsatisfied)} unsatisfied', self.name)
-            client.add_tags(unsatisfied, hr_tag)
+            self.batch.add(unsatisfied, hr_tag)
 
         if satisfied:
             logger.info(f'%-10s - {len(satisfied)} now satisfied', self.name)
-            client.remove_tags(satisfied, hr_tag)
+            self.batch.remove(satisfied, hr_tag)
 
         if autostart_hr and autostart:
             # client.force_start(autostart)
@@ -605,60 +901,67 @@ class worker:
         return bool(unsatisfied or satisfied or (autostart_hr and autostart))
 
     def tag_HUNO(self):
-        def tag(name):
-            return GlobalConfig.get("app.huno_tag_prefix") + name
-        torrents = self.torrents_changed({'seeding_time', 'tags'})
-        client = self.client
+        hashes = self.changed_hashes('tag_HUNO')
 
-        if not torrents:
+        if not hashes:
             return False
         # logger.info(f'%s - HUNO: {len(torrents)} torrents', self.name)
 
-        HUNO_TYPES = {
-            "Legend": parse("5y"),
-            "Champion": parse("1y"),
-            "Knight": parse("6 months"),
-            "Squire": parse("10d"),
-            "Vanguard": parse("1d"),
-        }
-
+        HUNO_RANKS = GlobalConfig.rules.huno
+        classify = GlobalConfig.rules.trackers.classify
         tags_to_add = defaultdict(set)
         tags_to_remove = defaultdict(set)
-        for thash, torrent in torrents.items():
-            new_rank = None
-            seeding_time = torrent['seeding_time']
-            if 'hawke.uno' not in torrent['tracker'] or seeding_time < 86400: # 1d
-                continue
-            existing_tags = torrent['tags'].split(", ")
 
-            # averiguo el adecuado
-            for rank, min_time in HUNO_TYPES.items():
-                if seeding_time >= min_time:
-                    new_rank = rank
-                    break
+        frame = self.client.torrent_frame(hashes)
+        if frame is not None:
+            seeding_time = frame.column('seeding_time')
+            eligible = frame.lookup('tracker', lambda url: 'HUNO' in classify(url).sites, bool) & (seeding_time >= 86400) # 1d
+            # los rangos van de mayor a menor: cada torrent se queda con el primero que alcanza
+            ranked = ~eligible
+            for rank in HUNO_RANKS:
+                in_rank = (seeding_time >= rank.min_time) & ~ranked
+                ranked |= in_rank
+                tagged = frame.has_tag(rank.tag)
+                if add := frame.hashes_where(in_rank & ~tagged): tags_to_add[rank.tag] = add
+                if remove := frame.hashes_where(eligible & tagged & ~in_rank): tags_to_remove[rank.tag] = remove
+        else:
+            all_torrents = self.client.torrentdict
+            for thash in hashes:
+                torrent = all_torrents[thash]
+                new_rank = None
+                seeding_time = torrent['seeding_time']
+                if 'HUNO' not in classify(torrent['tracker']).sites or seeding_time < 86400: # 1d
+                    continue
+                existing_tags = torrent.tagset
+
+                # averiguo el adecuado
+                for rank in HUNO_RANKS:
+                    if seeding_time >= rank.min_time:
+                        new_rank = rank
+                        break
 
-            # elimino los que no corresponden
-            for rank, _ in HUNO_TYPES.items():
-                if rank != new_rank and tag(rank) in existing_tags:
-                    tags_to_remove[rank].add(thash)
+                # elimino los que no corresponden
+                for rank in HUNO_RANKS:
+                    if rank != new_rank and rank.tag in existing_tags:
+                        tags_to_remove[rank.tag].add(thash)
 
-            # averiguo si necesita el tag correcto o ya lo tiene
-            if new_rank and tag(new_rank) not in existing_tags:
-                tags_to_add[new_rank].add(thash)
+                # averiguo si necesita el tag correcto o ya lo tiene
+                if new_rank and new_rank.tag not in existing_tags:
+                    tags_to_add[new_rank.tag].add(thash)
 
 
-        for rank, thashes in tags_to_add.items():
-            logger.debug(f"{self.name:<10} - added {tag(rank)} tag to {len(thashes)} torrents")
-            client.add_tags(thashes, tag(rank))
+        for tag, thashes in tags_to_add.items():
+            logger.debug(f"{self.name:<10} - added {tag} tag to {len(thashes)} torrents")
+            self.batch.add(thashes, tag)
 
-        for rank, thashes in tags_to_remove.items():
-            logger.debug(f"{self.name:<10} - fixing {len(thashes)} {tag(rank)} tags")
-            client.remove_tags(thashes, tag(rank))
+        for tag, thashes in tags_to_remove.items():
+            logger.debug(f"{self.name:<10} - fixing {len(thashes)} {tag} tags")
+            self.batch.remove(thashes, tag)
 
         return bool(tags_to_add or tags_to_remove)
 
     def tag_TMM(self) -> bool:
-        torrents = self.torrents_changed({'auto_tmm', 'tags', 'category'})
+        torrents = self.changed_torrents('tag_TMM')
         client = self.client
         config = GlobalConfig.get("app.noTMM")
 
@@ -673,8 +976,8 @@ class worker:
         tag_add: set[str] = set()
         tag_remove: set[str] = set()
         for thash, tval in torrents.items():
-            ttags = set(tval['tags'].split(', '))
-            if tval['auto_tmm'] or (ignoredtags and ttags & ignoredtags) or (ignoredcats and tval['category'] in ignoredcats):
+            ttags = tval.tagset
+            if tval['auto_tmm'] or (ignoredtags and not ttags.isdisjoint(ignoredtags)) or (ignoredcats and tval['category'] in ignoredcats):
                 # no deberia tenerlo
                 if tag in ttags:
                     tag_remove.add(thash)
@@ -687,17 +990,17 @@ class worker:
             if config.auto_enable:
                 client.enable_tmm(tag_add)
             else:
-                client.add_tags(tag_add, tag)
+                self.batch.add(tag_add, tag)
         if tag_remove:
-            client.remove_tags(tag_remove, tag)
+            self.batch.remove(tag_remove, tag)
 
         return bool(tag_add or tag_remove)
 
     def tag_rename(self):
         client = self.client
         tags_to_rename = GlobalConfig.get("app.tag_renamer")
-        # obtengo la informacion de los cambios de los torrents
-        changed_t = client.sync_data.get('tags', {}) & tags_to_rename.keys()
+        # tags nuevos en este sync
+        changed_t = self._events.tags_added & tags_to_rename.keys()
 
         if not changed_t:
             # logger.debug(f'%-10s - no tags to rename', self.name)
@@ -708,25 +1011,23 @@ class worker:
         for old_tag, new_tag in tags_to_rename.items():
             if old_tag not in changed_t:
                 continue
-            hashes = {th for th, tv in client.torrentdict.items() if old_tag in tv.get("tags", "").split(", ")}
-            client.add_tags(hashes, new_tag)
+            hashes = set(client.torrents_with_tag(old_tag))
+            self.batch.add(hashes, new_tag)
 
-        self.client.delete_tags(tags_to_rename.keys()) # FIXME
+        # el borrado sale en el flush despues de los añadidos; en local el tag viejo ya no esta para el resto de taggers
+        self.batch.delete(tags_to_rename.keys())
         return True
 
     def tag_trackers(self):
-        torrents = self.torrents_changed({'tracker', 'tags'})
-        client = self.client
-        tracker_details = GlobalConfig.get("tracker_details")
+        torrents = self.changed_torrents('tag_trackers')
 
         if not torrents:
             return False
 
-        try:
-            default_tag = tracker_details.default.tag
-        except KeyError:
+        classifier = GlobalConfig.rules.trackers
+        default_tag = classifier.default_tag
+        if not default_tag:
             logger.warning(f"{self.name:<10} - tracker_details['default']['tag'] no está definido")
-            default_tag = None
 
         addtag = defaultdict(set)
         deltag = defaultdict(set)
@@ -734,153 +1035,148 @@ class worker:
         for thash, torrent in torrents.items():
             torrent_tracker = torrent.get('tracker')
             if not torrent_tracker: continue
-            good_tags, bad_tags = set(), set()
-            torrent_tags = set(torrent.get("tags", "").split(", "))
-
-            torrent_classified = False
-            for expr, value in tracker_details.items():
-                if expr == 'default': continue
-                tracker_tags = set(value.get('tag', '').split(", "))
-                words = {word.strip() for word in expr.split("|")}
-                if any(word in torrent_tracker for word in words):
-                    torrent_classified = True
-                    # es un poco tonteria el |=. un torrent solo deberia matchear con una definicion
-                    # pero... tampoco causaria problemas si lo hiciese con varias
-                    good_tags |= tracker_tags
-                    missing_tags = tracker_tags - torrent_tags
-                    for tag in missing_tags:
-                        addtag[tag].add(thash)
-                    # era default y tenemos que quitarle el tag pq ya no lo es
-                    if default_tag and default_tag in torrent_tags:
-                        deltag[default_tag].add(thash)
-                    # no break para poder eliminar tags de otras definiciones
-                else:
-                    bad_tags.update(tracker_tags & torrent_tags)
-            # si llegamos a este punto sin tracker_tags, es que no coincide con ninguna descripcion de tracker -> deberia ser el default
-            # aun asi, lo hacemos con torrent_classified por legibilidad
-            if not torrent_classified and default_tag and default_tag not in torrent_tags:
+            torrent_tags = torrent.tagset
+            # un torrent solo deberia coincidir con una definicion, pero si lo hace con varias se le ponen todos sus tags
+            match = classifier.classify(torrent_tracker)
+
+            for tag in match.tags - torrent_tags:
+                addtag[tag].add(thash)
+            if match.rules:
+                # era default y tenemos que quitarle el tag pq ya no lo es
+                if default_tag and default_tag in torrent_tags:
+                    deltag[default_tag].add(thash)
+            # no coincide con ninguna descripcion de tracker -> deberia ser el default
+            elif default_tag and default_tag not in torrent_tags:
                 addtag[default_tag].add(thash)
-            bad_tags -= good_tags
-            for tag in bad_tags:
+            # tags de otras definiciones que no le corresponden
+            for tag in (torrent_tags & classifier.rule_tags) - match.tags:
                 deltag[tag].add(thash)
 
         for value, hashes in addtag.items():
             logger.info(f"{self.name:<10} - tagging {len(hashes)} torrents {value}")
-            client.add_tags(hashes, value)
+            self.batch.add(hashes, value)
 
         for value, hashes in deltag.items():
             logger.info(f"{self.name:<10} - untagging {len(hashes)} torrents {value}")
-            client.remove_tags(hashes, value)
+            self.batch.remove(hashes, value)
 
         return bool(addtag or deltag)
 
     def set_sharelimits(self, torrentset) -> bool:
         if not torrentset: return False
-        torrents = {thash : self.client.torrentdict.get(thash) for thash in torrentset}
+        torrents = self.client.torrentdict
+        torrentset = set(torrentset)
+        for thash in torrentset - torrents.keys():
+            logger.warning(f"{self.name:<10} - skipping hash {thash}. ")
+        torrentset &= torrents.keys()
 
-        # logger.debug(f"{self.name:<10} - checking {len(torrents)} torrents sharelimits")
+        # logger.debug(f"{self.name:<10} - checking {len(torrentset)} torrents sharelimits")
 
-        profiles: dict[str, dict[str, str]] = dict(self.share_limits)
-        tagprefix = GlobalConfig.get("app.share_limits_tag_prefix")
+        profiles = GlobalConfig.rules.share_limits.get(self.name)
+        if profiles is None:
+            profiles = ShareLimitClassifier(compile_share_limits(self.share_limits, GlobalConfig.get("app.share_limits_tag_prefix")))
         profiles_dict: dict[str, set] = dict()
         tagdict: dict[str, set] = dict()
 
         # lo inicializo con todos los nombres para que hayan items o no, se recorra para tag Y UNTAG
-        for profile_name, profile_config in profiles.items():
-            tagname: str = profile_config.get('custom_tag', tagprefix + profile_name)
-            profiles_dict[profile_name] = set()
-            tagdict[tagname] = set()
+        for profile in profiles:
+            profiles_dict[profile.name] = set()
+            tagdict[profile.tag] = set()
 
         # CLASIFICAR TORRENTS
-        for thash, torrent in torrents.items():
-            if not torrent:
-                logger.warning(f"{self.name:<10} - skipping hash {thash}. ")
-                continue
+        # leemos directamente de las columnas del estado: con miles de torrents las vistas pesan
+        for thash, tags, category, progress in self.client.torrent_rows(torrentset, 'category', 'progress'):
             # no categorizo si no está completo
-            if torrent.get("progress", 0) != 1: continue
+            if progress != 1: continue
 
-            tags = torrent.get("tags", "").split(", ")
             # find matching profile
-            for profile_name, profile_config in profiles.items():
-                pc = dict(profile_config)
-                if (
-                    ('category' in pc and not any(cat == torrent.get('category') for cat in pc['category']))
-                    or ('include_all_tags' in pc and not all(tag in tags for tag in pc['include_all_tags']))
-                    or ('include_any_tags' in pc and not any(tag in tags for tag in pc['include_any_tags']))
-                    or ('exclude_all_tags' in pc and all(tag in tags for tag in pc['exclude_all_tags']))
-                    or ('exclude_any_tags' in pc and any(tag in tags for tag in pc['exclude_any_tags']))
-                ):
-                    continue
-
-                tagname = pc.get('custom_tag', tagprefix + profile_name)
-                if pc.get('add_group_to_tag', True):
-                    tagdict[tagname].add(thash)
-                profiles_dict[profile_name].add(thash)
-                break
+            profile = profiles.match(category, tags)
+            if profile is None:
+                continue
+            if profile.add_group_to_tag:
+                tagdict[profile.tag].add(thash)
+            profiles_dict[profile.name].add(thash)
 
         # DICCIONARIOS PARA TAGUEADO, DESTAGUEADO
         addtag = defaultdict(set)
         deltag = defaultdict(set)
+        # con el indice tag -> hashes: los que deberian tenerlo y no lo tienen, y al reves
         for sltag, hashes in tagdict.items():
-            for thash in hashes:
-                torrent = torrents[thash]
-                torrenttags = set(torrent.get("tags", "").split(", "))
-                if sltag not in torrenttags:
-                    logger.debug(f"{self.name:<10} - adding tag {sltag} to {torrent.get('name')}")
-                    addtag[sltag].add(thash)
-        for thash, torrent in torrents.items():
-            sltags = set(torrent.get("tags","").split(", ")) & set(tagdict.keys()) # tags relativos a sharelimits
-            for sltag in sltags:
-                if thash not in tagdict[sltag]:
-                    logger.debug(f"{self.name:<10} - removing tag {sltag} from {torrent.get('name')}")
-                    deltag[sltag].add(thash)
+            tagged = self.client.torrents_with_tag(sltag)
+            for thash in hashes - tagged:
+                logger.debug(f"{self.name:<10} - adding tag {sltag} to {torrents[thash].get('name')}")
+                addtag[sltag].add(thash)
+            for thash in (tagged & torrentset) - hashes:
+                logger.debug(f"{self.name:<10} - removing tag {sltag} from {torrents[thash].get('name')}")
+                deltag[sltag].add(thash)
 
         # APLICACION DE SHARELIMITS Y GENERACION DE LISTA PARA RESUME
         sharelimits_changed = 0
         resume = set()
         delete = set()
-        for group_name, hashes in profiles_dict.items():
-            tagname = profiles[group_name].get('custom_tag', tagprefix + group_name)
-            # logger.debug(f"{self.name:<10} - {len(hashes)} torrents {tagname}")
-
-            # ratio and limit
-            p_maxratio = profiles[group_name].get('max_ratio', -2)
-            p_maxtime = profiles[group_name].get('max_seeding_time', -2)
-            p_uplimit = profiles[group_name].get('upload_limit', -2)
-            p_autoresume = profiles[group_name].get('auto_resume', True) # ? buen default??
-            p_autodelete = profiles[group_name].get('auto_delete', False)
-
-            if parse(p_maxtime) > 0:
-                p_maxtime = int((parse(p_maxtime) / 60))
-            if p_maxratio != None or p_maxtime != None:
-                limits = {
-                    'ratio': p_maxratio,
-                    'time':p_maxtime
-                }
+        for profile in profiles:
+            group_name = profile.name
+            hashes = profiles_dict[group_name]
+            # logger.debug(f"{self.name:<10} - {len(hashes)} torrents {profile.tag}")
+
+            # ratio and limit (max_seeding_time ya viene en minutos)
+            p_maxratio = profile.max_ratio
+            p_maxtime = profile.max_seeding_time
+            p_uplimit = profile.upload_limit
+            p_autoresume = profile.auto_resume # ? buen default??
+            p_autodelete = profile.auto_delete
+
+            limits = {
+                'ratio': p_maxratio,
+                'time':p_maxtime
+            }
 
             fix_hashes = set()
-            for h in hashes:
-                torrent = torrents[h]
-                if (
-                    (torrent['ratio_limit'] != p_maxratio)
-                    or (torrent['seeding_time_limit'] != p_maxtime)
-                    or (torrent['up_limit'] > 0 and torrent['up_limit'] != p_uplimit * 1024)
-                ):
-                    logger.debug(f"{self.name:<10} - Changing {torrent.get('name')} sharelimit to {group_name} profile.")
+            frame = self.client.torrent_frame(hashes)
+            if frame is not None:
+                up_limit = frame.column('up_limit')
+                wrong_limits = (
+                    (frame.column('ratio_limit') != p_maxratio)
+                    | (frame.column('seeding_time_limit') != p_maxtime)
+                    | ((up_limit > 0) & (up_limit != p_uplimit * 1024))
+                )
+                maxtime = frame.column('max_seeding_time') * 60
+                completed = (maxtime >= 0) & (maxtime < frame.column('seeding_time'))
+                stopped = frame.isin('state', {'stoppedUP', 'pausedUP'})
+                for h in frame.hashes_where(wrong_limits):
+                    logger.debug(f"{self.name:<10} - Changing {torrents[h].get('name')} sharelimit to {group_name} profile.")
                     fix_hashes.add(h)
-
-                maxtime = torrent['max_seeding_time'] * 60
-                completed = maxtime >= 0 and maxtime < torrent['seeding_time']
                 if p_autoresume:
-                    if torrent.get('state') in ['stoppedUP', 'pausedUP'] and not completed:
-                        # FIXME
-                        logger.debug(f"{self.name:<10} - Resuming {torrent.get('name')}.")
+                    for h in frame.hashes_where(stopped & ~completed):
+                        logger.debug(f"{self.name:<10} - Resuming {torrents[h].get('name')}.")
                         resume.add(h)
-
                 if p_autodelete:
-                    if completed and torrent.get('state') in ['stoppedUP', 'pausedUP']:
-                        logger.debug(f"{self.name:<10} - Torrent {torrent.get('name')} marked for autodeletion.")
+                    for h in frame.hashes_where(stopped & completed):
+                        logger.debug(f"{self.name:<10} - Torrent {torrents[h].get('name')} marked for autodeletion.")
                         delete.add(h)
+            else:
+                for h in hashes:
+                    torrent = torrents[h]
+                    if (
+                        (torrent['ratio_limit'] != p_maxratio)
+                        or (torrent['seeding_time_limit'] != p_maxtime)
+                        or (torrent['up_limit'] > 0 and torrent['up_limit'] != p_uplimit * 1024)
+                    ):
+                        logger.debug(f"{self.name:<10} - Changing {torrent.get('name')} sharelimit to {group_name} profile.")
+                        fix_hashes.add(h)
+
+                    maxtime = torrent['max_seeding_time'] * 60
+                    completed = maxtime >= 0 and maxtime < torrent['seeding_time']
+                    if p_autoresume:
+                        if torrent.get('state') in ['stoppedUP', 'pausedUP'] and not completed:
+                            # FIXME
+                            logger.debug(f"{self.name:<10} - Resuming {torrent.get('name')}.")
+                            resume.add(h)
+
+                    if p_autodelete:
+                        if completed and torrent.get('state') in ['stoppedUP', 'pausedUP']:
+                            logger.debug(f"{self.name:<10} - Torrent {torrent.get('name')} marked for autodeletion.")
+                            delete.add(h)
 
 
             if len(fix_hashes):
@@ -891,15 +1187,15 @@ class worker:
         # APLICACION DE TAGS Y RESUME
         tags_changed = 0
         for sltag, hashes in addtag.items():
-            self.client.add_tags(hashes, sltag)
+            self.batch.add(hashes, sltag)
             tags_changed += len(hashes)
         for sltag, hashes in deltag.items():
-            self.client.remove_tags(hashes, sltag)
+            self.batch.remove(hashes, sltag)
             tags_changed += len(hashes)
         if resume:
             self.client.start(resume)
         if delete:
-            self.client.add_tags(delete, "!DELETE")
+            self.batch.add(delete, "!DELETE")
 
         if tags_changed:
             logger.info(f"{self.name:<10} - {tags_changed} tags changed")